@@ -7,3 +7,6 @@ class AccountsConfig(AppConfig):
     
     def ready(self):
         import accounts.signals
+        from hospital_management import thumbnails
+        
+        thumbnails.register(self.get_model('User'), 'profile_picture')
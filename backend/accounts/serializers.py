@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from hospital_management.eager_loading import EagerLoadingMixin
+from hospital_management.thumbnails import ThumbnailsField
 from .models import UserProfile
 
 User = get_user_model()
@@ -14,13 +16,16 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ['bio', 'date_of_birth', 'gender', 'emergency_contact']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     profile = UserProfileSerializer(required=False)
+    profile_picture_thumbnails = ThumbnailsField(source='profile_picture')
+    
+    select_related_fields = ('profile',)
     
     class Meta:
         model = User
         fields = ['id', 'email', 'first_name', 'last_name', 'role', 'phone_number', 
-                  'address', 'profile_picture', 'is_active', 'date_joined', 'profile']
+                  'address', 'profile_picture', 'profile_picture_thumbnails', 'is_active', 'date_joined', 'profile']
         read_only_fields = ['id', 'date_joined']
     
     def update(self, instance, validated_data):
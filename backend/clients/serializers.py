@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Client, ClientContact, ClientAddress
 from accounts.serializers import UserSerializer
+from hospital_management.eager_loading import EagerLoadingMixin
 
 
 class ClientAddressSerializer(serializers.ModelSerializer):
@@ -17,11 +18,14 @@ class ClientContactSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at', 'updated_at')
 
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     contacts = ClientContactSerializer(many=True, read_only=True)
     addresses = ClientAddressSerializer(many=True, read_only=True)
     
+    select_related_fields = ('user',) + UserSerializer.nested_select_related('user')
+    prefetch_related_fields = ('contacts', 'addresses')
+    
     class Meta:
         model = Client
         fields = '__all__'
@@ -0,0 +1,61 @@
+"""
+Running work outside the request cycle.
+
+submit() hands a Celery task to the broker. When no broker is reachable
+(local development, or the broker is down) the task runs in a small
+in-process thread pool instead, so requests still return straight away.
+
+Finding out that the broker is down takes a few seconds of connection
+retries, so after a failure the broker is skipped for
+BACKGROUND_BROKER_RETRY_SECONDS rather than retried on every request.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+# time.monotonic() before which the broker isn't tried again
+_broker_down_until = 0
+
+
+def _executor(name, workers):
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        return _executors[name]
+
+
+def _run_locally(task, args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception("Running %s%r in-process failed", task.name, args)
+    finally:
+        # Worker threads open their own connection; don't leave it behind
+        connection.close()
+
+
+def submit(task, *args, workers=1):
+    """
+    Queue the Celery `task` with `args`, or run it on a local pool of
+    `workers` threads if the broker can't be reached.
+    """
+    global _broker_down_until
+
+    if time.monotonic() >= _broker_down_until:
+        try:
+            # Nothing waits on these results
+            task.apply_async(args, retry=False, ignore_result=True)
+            return
+        except Exception:
+            logger.warning("No Celery broker available, running %s in-process", task.name, exc_info=True)
+            _broker_down_until = time.monotonic() + getattr(settings, 'BACKGROUND_BROKER_RETRY_SECONDS', 60)
+    _executor(task.name, workers).submit(_run_locally, task, args)
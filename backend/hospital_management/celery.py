@@ -0,0 +1,16 @@
+"""
+Celery application for hospital_management.
+
+Periodic tasks are stored with django_celery_beat; the entries in
+settings.CELERY_BEAT_SCHEDULE are synced to its tables when beat starts.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
+
+app = Celery('hospital_management')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,196 @@
+"""
+Serving stored files.
+
+serve_file() answers a download of a FieldFile without reading it into
+memory:
+
+- If-None-Match / If-Modified-Since (and If-Match / If-Unmodified-Since)
+  are answered from the ETag and Last-Modified given for the file,
+- a single byte range is served as 206 Partial Content, honouring
+  If-Range, and an unsatisfiable one as 416,
+- whole files go through FileResponse, so the WSGI server can use
+  sendfile, with Content-Length and Accept-Ranges set,
+- compressible files are gzipped on the fly for clients that accept it,
+  unless they asked for a range.
+
+With FILE_DOWNLOAD_OFFLOAD set to 'x-accel-redirect' (nginx) or
+'x-sendfile' (Apache, lighttpd) the view only checks access and the web
+server sends the file itself, ranges and validators included.
+"""
+import os
+import re
+import zlib
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    The (start, end) byte positions, inclusive, of a single-range Range
+    header. None when the whole file should be sent instead: no header, a
+    malformed one, or several ranges, which servers may answer in full.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last `last` bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable
+    return start, min(end, size - 1)
+
+
+def accepts_gzip(request):
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            quality = params.strip().replace(' ', '')
+            return quality not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.META.get('HTTP_IF_RANGE')
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        # Only strong validators may be used with If-Range
+        return etag is not None and not etag.startswith('W/') and value == etag
+    return last_modified is not None and parse_http_date_safe(value) == last_modified
+
+
+def _read(file, start, length, chunk_size):
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = file.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def _gzip(file, chunk_size):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        file.close()
+
+
+def _offload(field_file, filename, content_type, as_attachment):
+    mode = getattr(settings, 'FILE_DOWNLOAD_OFFLOAD', None)
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+        header, value = 'X-Accel-Redirect', prefix.rstrip('/') + '/' + quote(field_file.name)
+    elif mode == 'x-sendfile':
+        try:
+            header, value = 'X-Sendfile', field_file.path
+        except NotImplementedError:
+            # Remote storage: nothing local for the web server to send
+            return None
+    else:
+        return None
+
+    response = HttpResponse(content_type=content_type)
+    response[header] = value
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    return response
+
+
+def serve_file(request, field_file, filename=None, content_type='application/octet-stream',
+               etag=None, last_modified=None, compress=False, as_attachment=True):
+    """
+    Respond to a download of `field_file` as an attachment named
+    `filename`, or for display inline if not `as_attachment`. `etag` is a
+    quoted ETag for the stored bytes and `last_modified` a datetime;
+    `compress` allows gzip on the fly.
+    """
+    filename = filename or os.path.basename(field_file.name)
+    response = _offload(field_file, filename, content_type, as_attachment)
+    if response is not None:
+        return response
+
+    chunk_size = getattr(settings, 'FILE_DOWNLOAD_CHUNK_SIZE', CHUNK_SIZE)
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    size = field_file.size
+    range_header = request.META.get('HTTP_RANGE')
+
+    gzip = compress and not range_header and accepts_gzip(request)
+    if gzip and etag:
+        # The gzipped bytes are a different representation
+        etag = f'{etag[:-1]}-gzip"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = None
+        if range_header and _if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f"bytes */{size}"
+                return response
+
+        if gzip:
+            response = StreamingHttpResponse(_gzip(field_file.open('rb'), chunk_size), content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        elif byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _read(field_file.open('rb'), start, length, chunk_size),
+                status=206,
+                content_type=content_type,
+            )
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = length
+        else:
+            response = FileResponse(field_file.open('rb'), content_type=content_type)
+            response.block_size = chunk_size
+            response['Content-Length'] = size
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+        if not gzip:
+            response['Accept-Ranges'] = 'bytes'
+
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    if compress:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,47 @@
+"""
+Declarative eager loading for serializers.
+
+Serializers list the joins (select_related) and prefetches their
+representation needs, including those of nested serializers, and viewsets
+build their querysets from those declarations. This keeps the number of
+queries for a list endpoint fixed regardless of the page size.
+"""
+from django.db.models import Prefetch
+
+
+class EagerLoadingMixin:
+    """Serializer mixin declaring the related data its output reads."""
+
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def nested_select_related(cls, prefix):
+        """This serializer's joins as seen from a parent through `prefix`."""
+        return tuple(f"{prefix}__{field}" for field in cls.select_related_fields)
+
+    @classmethod
+    def nested_prefetch_related(cls, prefix):
+        """This serializer's prefetches as seen from a parent through `prefix`."""
+        lookups = []
+        for lookup in cls.prefetch_related_fields:
+            if isinstance(lookup, Prefetch):
+                lookups.append(Prefetch(f"{prefix}__{lookup.prefetch_through}", queryset=lookup.queryset))
+            else:
+                lookups.append(f"{prefix}__{lookup}")
+        return tuple(lookups)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+
+def eager_load(queryset, serializer_class):
+    """Apply a serializer's eager loading declarations, if it has any."""
+    if issubclass(serializer_class, EagerLoadingMixin):
+        return serializer_class.setup_eager_loading(queryset)
+    return queryset
@@ -0,0 +1,212 @@
+"""
+Pagination classes shared by the API apps.
+
+Large list endpoints use KeysetOrPageNumberPagination: page-number
+pagination by default, or keyset (cursor) pagination when the client asks
+for it with `?pagination=keyset`. Keyset pages continue from the ordering
+values of the last row seen, so they need neither COUNT(*) nor a deep
+OFFSET.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """JSON encoder keeping full microsecond precision for cursor values."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over the queryset's current ordering.
+
+    The ordering applied by the view (OrderingFilter or the viewset's
+    `ordering`, falling back to the model's Meta.ordering) is extended with
+    the primary key as a tiebreaker, and each cursor stores the ordering
+    values of the row at the page boundary. Ordering fields are columns of
+    the model or annotations, such as the rank of a search; NULLs of
+    nullable columns sort after every value, as in PostgreSQL, on every
+    database.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+    unsupported_ordering_message = "This list can't be paginated by cursor in this order; use page numbers."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(queryset)
+        self.model = queryset.model
+
+        position, reverse = self.decode_cursor(request)
+        ordering = [self._flip(field) for field in self.ordering] if reverse else self.ordering
+
+        queryset = queryset.order_by(*[self._order_by(queryset.model, field) for field in ordering])
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+
+        if reverse:
+            page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = page
+        return page
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by)
+        if not all(isinstance(field, str) for field in ordering):
+            # Cursors hold field values; annotate expressions to order by them
+            raise ParseError(self.unsupported_ordering_message)
+        if not ordering:
+            ordering = [field for field in queryset.model._meta.ordering if isinstance(field, str)]
+
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    def _flip(self, field):
+        return field[1:] if field.startswith('-') else f"-{field}"
+
+    def _nullable(self, model, name):
+        if name == 'pk':
+            return False
+        try:
+            return model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return False
+
+    def _order_by(self, model, field):
+        name = field.lstrip('-')
+        if not self._nullable(model, name):
+            return field
+        # NULL is the largest value: last going up, first going down
+        if field.startswith('-'):
+            return F(name).desc(nulls_first=True)
+        return F(name).asc(nulls_last=True)
+
+    def _after(self, ordering, position):
+        """Rows strictly after `position` in `ordering`, as a Q object."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            if value is None:
+                # Going up nothing follows NULL; going down every value does
+                if descending:
+                    condition |= equal & Q(**{f"{name}__isnull": False})
+                equal &= Q(**{f"{name}__isnull": True})
+                continue
+            after = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            if not descending and self._nullable(self.model, name):
+                after |= Q(**{f"{name}__isnull": True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+        return condition
+
+    def _position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, position, reverse=False):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, cls=CursorEncoder)
+        cursor = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            position = payload['p']
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetOrPageNumberPagination(PageNumberPagination):
+    """
+    Page-number pagination with opt-in keyset mode.
+
+    Clients request keyset pagination with `?pagination=keyset` and follow
+    the returned `next`/`previous` links, which carry the cursor.
+    """
+    mode_query_param = 'pagination'
+    keyset_mode = 'keyset'
+    keyset_class = KeysetPagination
+
+    def use_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.keyset_mode
+            or self.keyset_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
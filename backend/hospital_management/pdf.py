@@ -0,0 +1,246 @@
+"""
+Incremental PDF writing, shared by report PDFs and QR label sheets.
+
+reportlab's canvas keeps the whole document until save(). Here pages are
+drawn as content streams, and Document numbers the objects and returns
+them as bytes as each page is done, keeping only their offsets, so a
+document can be written to a file or streamed a page at a time.
+
+Text is set in TrueType fonts embedded as CID fonts and written as glyph
+ids (Identity-H), so every character the font has is drawn as itself;
+a ToUnicode map keeps the text searchable. The fonts are reportlab's
+Bitstream Vera unless the PDF_FONT and PDF_BOLD_FONT environment
+variables name others (e.g. DejaVu Sans, for Cyrillic or Greek), and
+characters a font lacks show as its missing-glyph box. Fonts are embedded
+whole: pages are written before it is known which characters the
+document uses.
+
+Imports nothing from Django, so it can run in pool worker processes.
+"""
+import os
+import re
+import zlib
+from functools import cached_property
+
+import reportlab
+from reportlab.pdfbase.ttfonts import TTFontFile
+
+
+_REPORTLAB_FONTS = os.path.join(os.path.dirname(reportlab.__file__), 'fonts')
+
+# Resource names of the fonts, and their files
+REGULAR = 'F1'
+BOLD = 'F2'
+FONT_FILES = {
+    REGULAR: os.getenv('PDF_FONT') or os.path.join(_REPORTLAB_FONTS, 'Vera.ttf'),
+    BOLD: os.getenv('PDF_BOLD_FONT') or os.path.join(_REPORTLAB_FONTS, 'VeraBd.ttf'),
+}
+
+# Glyph ids mapped per ToUnicode block; CMaps allow at most 100
+CMAP_BLOCK = 100
+
+
+class Font:
+    """A TrueType font: its metrics, its glyph ids, and its PDF objects."""
+
+    def __init__(self, path):
+        self.path = path
+        self.ttf = TTFontFile(path)
+        self.name = re.sub(rb'[^\w+-]', b'', self.ttf.name) or b'Font'
+
+    def width(self, text, size):
+        """Width of `text` at `size` points."""
+        widths = self.ttf.charWidths
+        default = self.ttf.defaultWidth
+        return sum(widths.get(ord(char), default) for char in text) * size / 1000
+
+    def encode(self, text):
+        """`text` as a PDF string of glyph ids."""
+        glyphs = self.ttf.charToGlyph
+        return b'<%s>' % ''.join('%04X' % glyphs.get(ord(char), 0) for char in text).encode()
+
+    @cached_property
+    def widths(self):
+        scale = 1000 / self.ttf.unitsPerEm
+        return b' '.join(b'%d' % round(advance * scale) for advance, lsb in self.ttf.hmetrics)
+
+    @cached_property
+    def font_file(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        return len(data), zlib.compress(data)
+
+    @cached_property
+    def to_unicode(self):
+        characters = {}
+        for char, glyph in sorted(self.ttf.charToGlyph.items()):
+            # Glyph 0 is the missing-glyph box, not a character
+            if glyph:
+                characters.setdefault(glyph, char)
+        mappings = [
+            b'<%04X> <%s>' % (glyph, chr(char).encode('utf-16-be').hex().upper().encode())
+            for glyph, char in sorted(characters.items())
+        ]
+        blocks = []
+        for start in range(0, len(mappings), CMAP_BLOCK):
+            block = mappings[start:start + CMAP_BLOCK]
+            blocks.append(b'%d beginbfchar\n%s\nendbfchar' % (len(block), b'\n'.join(block)))
+        return zlib.compress(
+            b'/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+            b'/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+            b'1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n'
+            + b'\n'.join(blocks)
+            + b'\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend'
+        )
+
+
+_fonts = {}
+
+
+def font(name):
+    """The Font of resource `name` (REGULAR or BOLD), loaded once per process."""
+    if name not in _fonts:
+        _fonts[name] = Font(FONT_FILES[name])
+    return _fonts[name]
+
+
+def string_width(text, name, size):
+    return font(name).width(text, size)
+
+
+def fit(text, name, size, width):
+    """`text`, cut short with an ellipsis if it is wider than `width`."""
+    if string_width(text, name, size) <= width:
+        return text
+    while text and string_width(text + '...', name, size) > width:
+        text = text[:-1]
+    return text.rstrip() + '...'
+
+
+def text(x, y, name, size, value):
+    """Content stream operators drawing `value` at (x, y)."""
+    return b'BT /%s %d Tf %.2f %.2f Td %s Tj ET' % (name.encode(), size, x, y, font(name).encode(value))
+
+
+def _text_string(value):
+    return b'<FEFF%s>' % value.encode('utf-16-be').hex().upper().encode()
+
+
+class Document:
+    """
+    The objects of a PDF with `width` x `height` points pages, as bytes:
+    header() first, then page() for each page and close() at the end.
+    """
+
+    def __init__(self, width, height, fonts=(REGULAR, BOLD)):
+        self.width = width
+        self.height = height
+        self.fonts = fonts
+        self.position = 0
+        self.offsets = {}
+        # 1: catalog and 2: page tree, written last
+        self.number = 3
+        self.kids = []
+        self.font_resources = None
+
+    def new_number(self):
+        number = self.number
+        self.number += 1
+        return number
+
+    def object(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        data = b'%d 0 obj\n%s\n' % (number, body)
+        if stream is not None:
+            data += b'stream\n' + stream + b'\nendstream\n'
+        data += b'endobj\n'
+        self.position += len(data)
+        return data
+
+    def _font_objects(self, name, number):
+        embedded = font(name)
+        length, data = embedded.font_file
+        cid_font, descriptor, font_file, to_unicode = (self.new_number() for _ in range(4))
+        ttf = embedded.ttf
+        return b''.join([
+            self.object(number, (
+                b'<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H '
+                b'/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>'
+            ) % (embedded.name, cid_font, to_unicode)),
+            self.object(cid_font, (
+                b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+                b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+                b'/FontDescriptor %d 0 R /CIDToGIDMap /Identity /W [0 [%s]] >>'
+            ) % (embedded.name, descriptor, embedded.widths)),
+            self.object(descriptor, (
+                b'<< /Type /FontDescriptor /FontName /%s /Flags %d /FontBBox [%s] /ItalicAngle %.2f '
+                b'/Ascent %d /Descent %d /CapHeight %d /StemV %d /FontFile2 %d 0 R >>'
+            ) % (
+                embedded.name, ttf.flags, b' '.join(b'%d' % round(value) for value in ttf.bbox),
+                ttf.italicAngle, round(ttf.ascent), round(ttf.descent), round(ttf.capHeight), ttf.stemV,
+                font_file,
+            )),
+            self.object(
+                font_file, b'<< /Length1 %d /Filter /FlateDecode /Length %d >>' % (length, len(data)), data,
+            ),
+            self.object(
+                to_unicode, b'<< /Filter /FlateDecode /Length %d >>' % len(embedded.to_unicode),
+                embedded.to_unicode,
+            ),
+        ])
+
+    def header(self):
+        """The file header and the fonts."""
+        data = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(data)
+        chunks = [data]
+        resources = []
+        for name in self.fonts:
+            number = self.new_number()
+            resources.append(b'/%s %d 0 R' % (name.encode(), number))
+            chunks.append(self._font_objects(name, number))
+        self.font_resources = b'<< ' + b' '.join(resources) + b' >>'
+        return b''.join(chunks)
+
+    def page(self, content, xobjects=()):
+        """
+        A page drawn by the deflated content stream `content`, using the
+        (name, object number) images of `xobjects`.
+        """
+        contents = self.new_number()
+        chunks = [self.object(contents, b'<< /Filter /FlateDecode /Length %d >>' % len(content), content)]
+        resources = b'/Font %s' % self.font_resources
+        if xobjects:
+            resources += b' /XObject << %s >>' % b' '.join(
+                b'/%s %d 0 R' % (name.encode(), number) for name, number in xobjects
+            )
+        page = self.new_number()
+        chunks.append(self.object(page, (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] '
+            b'/Resources << %s >> /Contents %d 0 R >>'
+        ) % (self.width, self.height, resources, contents)))
+        self.kids.append(b'%d 0 R' % page)
+        return b''.join(chunks)
+
+    def close(self, title=None):
+        """The page tree, catalog, document info and cross-reference table."""
+        chunks = [
+            self.object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(self.kids), len(self.kids))),
+            self.object(1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+        ]
+        info = b''
+        if title:
+            number = self.new_number()
+            chunks.append(self.object(number, b'<< /Title %s >>' % _text_string(title)))
+            info = b' /Info %d 0 R' % number
+
+        xref = self.position
+        entries = [b'0000000000 65535 f \n'] + [
+            b'%010d 00000 n \n' % self.offsets[number] for number in range(1, self.number)
+        ]
+        chunks.append(
+            b'xref\n0 %d\n' % self.number + b''.join(entries)
+            + b'trailer\n<< /Size %d /Root 1 0 R%s >>\nstartxref\n%d\n%%%%EOF\n' % (self.number, info, xref)
+        )
+        return b''.join(chunks)
@@ -0,0 +1,75 @@
+"""
+Private files.
+
+Reports that hold customer or catalog data (import error reports,
+unmatched statement rows) are kept in PRIVATE_FILES_ROOT, outside
+MEDIA_ROOT, so the web server never serves them. Each is saved under a
+random token and handed out only through views that check permissions
+first.
+
+Files are kept for PRIVATE_FILE_MAX_AGE seconds: older ones are no longer
+opened, and each save deletes the expired files of its directory.
+"""
+import re
+import secrets
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import LazyObject
+
+
+TOKEN_RE = re.compile(r'^[\w-]{32}$')
+
+
+class PrivateStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = FileSystemStorage(location=settings.PRIVATE_FILES_ROOT, base_url=None)
+
+
+storage = PrivateStorage()
+
+
+def _name(directory, token, extension):
+    return f"{directory}/{token}.{extension}"
+
+
+def _expired(name, now):
+    try:
+        return now - storage.get_modified_time(name).timestamp() > settings.PRIVATE_FILE_MAX_AGE
+    except FileNotFoundError:
+        return True
+
+
+def purge(directory):
+    """Delete the expired files of `directory`. Returns how many were deleted."""
+    try:
+        files = storage.listdir(directory)[1]
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    deleted = 0
+    for filename in files:
+        name = f"{directory}/{filename}"
+        if _expired(name, now):
+            storage.delete(name)
+            deleted += 1
+    return deleted
+
+
+def save(directory, content, extension='csv'):
+    """Store `content` (a File) in `directory` and return its token."""
+    purge(directory)
+    token = secrets.token_urlsafe(24)
+    storage.save(_name(directory, token, extension), content)
+    return token
+
+
+def open_file(directory, token, extension='csv'):
+    """The file stored under `token` as an open binary file, or None if it is unknown or expired."""
+    if not TOKEN_RE.match(token or ''):
+        return None
+    name = _name(directory, token, extension)
+    if _expired(name, time.time()):
+        return None
+    return storage.open(name, 'rb')
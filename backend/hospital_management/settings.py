@@ -175,6 +175,12 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Reports with customer data, kept outside MEDIA_ROOT and only served
+# through permission-checked views (hospital_management.private_files),
+# for PRIVATE_FILE_MAX_AGE seconds
+PRIVATE_FILES_ROOT = os.getenv('PRIVATE_FILES_ROOT') or os.path.join(BASE_DIR, 'private')
+PRIVATE_FILE_MAX_AGE = int(os.getenv('PRIVATE_FILE_MAX_AGE', 7 * 24 * 3600))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -198,6 +204,71 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+# Cache (set REDIS_CACHE_URL so all workers share it)
+if os.getenv('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Order and invoice numbers reserved per counter update (1 keeps numbering gap-free)
+DOCUMENT_NUMBER_BLOCK_SIZE = int(os.getenv('DOCUMENT_NUMBER_BLOCK_SIZE', 1))
+
+# Processes rendering invoice PDFs, shared by all renders in a process (render_invoices uses the CPU count)
+INVOICE_PDF_WORKERS = int(os.getenv('INVOICE_PDF_WORKERS', 2))
+
+# Large downloads (hospital_management.downloads): 'x-accel-redirect' hands
+# the transfer to nginx through an internal location serving MEDIA_ROOT at
+# FILE_DOWNLOAD_ACCEL_PREFIX, 'x-sendfile' to Apache or lighttpd
+FILE_DOWNLOAD_OFFLOAD = os.getenv('FILE_DOWNLOAD_OFFLOAD') or None
+FILE_DOWNLOAD_ACCEL_PREFIX = os.getenv('FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+FILE_DOWNLOAD_CHUNK_SIZE = int(os.getenv('FILE_DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+
+# Report generation: in-process threads when no Celery broker is reachable,
+# and how long a queued or running report may be waited on before an
+# identical request starts a new one
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 2))
+REPORT_JOB_TIMEOUT = int(os.getenv('REPORT_JOB_TIMEOUT', 3600))
+# Report PDFs and QR label sheets set text in the TrueType fonts named by
+# the PDF_FONT and PDF_BOLD_FONT environment variables, read directly by
+# hospital_management.pdf so pool worker processes see them too (default:
+# reportlab's Bitstream Vera; e.g. DejaVu Sans covers Cyrillic and Greek)
+
+# Seconds dashboard widget data stays cached; writes to the tables a
+# widget reads invalidate it sooner
+WIDGET_DATA_CACHE_TTL = int(os.getenv('WIDGET_DATA_CACHE_TTL', 300))
+# Threads per process computing dashboard widgets in parallel
+DASHBOARD_RENDER_WORKERS = int(os.getenv('DASHBOARD_RENDER_WORKERS', 4))
+
+# Request coalescing (hospital_management.single_flight). SINGLE_FLIGHT_LOCK
+# 'file' or 'database' also coalesces across processes, sharing results
+# through the cache for SINGLE_FLIGHT_RESULT_TTL seconds
+SINGLE_FLIGHT_LOCK = os.getenv('SINGLE_FLIGHT_LOCK') or None
+SINGLE_FLIGHT_LOCK_DIR = os.getenv('SINGLE_FLIGHT_LOCK_DIR') or None
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL', 5))
+SINGLE_FLIGHT_TIMEOUT = int(os.getenv('SINGLE_FLIGHT_TIMEOUT', 30))
+
+# Instrument QR codes are drawn in the background (instruments.qr), in
+# batches of QR_CODE_BATCH_SIZE on QR_CODE_WORKERS local threads when no
+# Celery broker is reachable
+QR_CODE_BATCH_SIZE = int(os.getenv('QR_CODE_BATCH_SIZE', 200))
+QR_CODE_WORKERS = int(os.getenv('QR_CODE_WORKERS', 2))
+# QR codes rendered at other sizes or as SVG kept in memory per process
+QR_CODE_CACHE_SIZE = int(os.getenv('QR_CODE_CACHE_SIZE', 512))
+# Processes rendering QR label sheet pages, shared by all requests (print_qr_labels uses the CPU count)
+QR_LABEL_WORKERS = int(os.getenv('QR_LABEL_WORKERS', 2))
+
+# Time an instrument allocation may spend retrying around concurrent allocators
+ALLOCATION_BUDGET_SECONDS = float(os.getenv('ALLOCATION_BUDGET_SECONDS', 2.0))
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
@@ -225,6 +296,24 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+
+# How long background work stays in-process after the broker refused a task
+BACKGROUND_BROKER_RETRY_SECONDS = int(os.getenv('BACKGROUND_BROKER_RETRY_SECONDS', 60))
+
+# Periodic sweeps (notifications.sweepers); run_sweepers is the manual fallback
+SWEEP_INTERVAL_SECONDS = float(os.getenv('SWEEP_INTERVAL_SECONDS', 3600))
+RENTAL_EXPIRY_NOTICE_DAYS = int(os.getenv('RENTAL_EXPIRY_NOTICE_DAYS', 3))
+CELERY_BEAT_SCHEDULE = {
+    'sweep-rental-expiry': {
+        'task': 'notifications.sweep_rental_expiry',
+        'schedule': SWEEP_INTERVAL_SECONDS,
+    },
+    'sweep-overdue-invoices': {
+        'task': 'notifications.sweep_overdue_invoices',
+        'schedule': SWEEP_INTERVAL_SECONDS,
+    },
+}
 
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
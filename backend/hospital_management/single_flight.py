@@ -0,0 +1,182 @@
+"""
+Request coalescing (single flight) for expensive reads.
+
+When many users refresh the same dashboard at once, identical requests
+would otherwise run the same queries side by side. With
+@coalesce_requests on a viewset action, the first request for a key
+(the leader) computes the response and concurrent identical requests
+wait for it and get a copy instead.
+
+Within a process, followers wait on the leader's call. SINGLE_FLIGHT_LOCK
+extends this across processes:
+
+- 'file': an exclusive flock() on one of SINGLE_FLIGHT_LOCK_STRIPES lock
+  files under SINGLE_FLIGHT_LOCK_DIR (processes on one host),
+- 'database': a PostgreSQL advisory lock (every host sharing the
+  database; other databases run without a cross-process lock).
+
+The process holding the lock publishes its result in the shared cache
+for SINGLE_FLIGHT_RESULT_TTL seconds, and processes that waited on the
+lock read it from there. That needs a cache shared by the processes
+(Redis); with a per-process cache they are only serialized.
+
+Requests are identical when they hit the same view, action, URL kwargs
+and query parameters with the same scope: the user for clients, the role
+for staff and admins, who see the same data.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from rest_framework.response import Response
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs each key's function once at a time and shares the result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function):
+        """Return (result, shared): `function()`'s result, or a concurrent call's."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(getattr(settings, 'SINGLE_FLIGHT_TIMEOUT', 30)):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            # The leader is taking too long; don't queue behind it forever
+            return function(), False
+
+        try:
+            call.result, shared = _across_processes(key, function)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+flight = SingleFlight()
+
+
+def _digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+@contextmanager
+def _file_lock(key):
+    directory = getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'hospital-management-single-flight'
+    )
+    os.makedirs(directory, exist_ok=True)
+    # A fixed set of lock files; unrelated keys rarely share one
+    stripe = int(_digest(key)[:8], 16) % getattr(settings, 'SINGLE_FLIGHT_LOCK_STRIPES', 256)
+    with open(os.path.join(directory, f"{stripe}.lock"), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _database_lock(key):
+    lock_id = int(_digest(key)[:15], 16)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id])
+        try:
+            yield
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+
+
+def _process_lock(key):
+    mode = getattr(settings, 'SINGLE_FLIGHT_LOCK', None)
+    if mode == 'file' and fcntl is not None:
+        return _file_lock(key)
+    if mode == 'database' and connection.vendor == 'postgresql':
+        return _database_lock(key)
+    return None
+
+
+def _across_processes(key, function):
+    lock = _process_lock(key)
+    if lock is None:
+        return function(), False
+
+    result_key = f"single-flight:{_digest(key)}"
+    started = time.time()
+    with lock:
+        published = cache.get(result_key)
+        if published is not None and published[0] >= started:
+            # Computed by another process while this one waited
+            return published[1], True
+        result = function()
+        cache.set(result_key, (time.time(), result), getattr(settings, 'SINGLE_FLIGHT_RESULT_TTL', 5))
+        return result, False
+
+
+def request_scope(request):
+    """Requests with the same scope see the same data."""
+    user = request.user
+    if not user.is_authenticated:
+        return 'anonymous'
+    if user.is_client:
+        return f"user:{user.pk}"
+    return f"role:{'superuser' if user.is_superuser else user.role}"
+
+
+def coalesce_requests(method):
+    """
+    Share the response of a viewset action between concurrent identical
+    requests. Only the status and data of the response are shared, so use
+    it on actions returning a plain DRF Response.
+    """
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        params = sorted((name, request.query_params.getlist(name)) for name in request.query_params)
+        key = repr((
+            type(self).__module__, type(self).__name__, method.__name__,
+            sorted(kwargs.items()), params, request_scope(request),
+        ))
+
+        def respond():
+            response = method(self, request, *args, **kwargs)
+            return response.status_code, response.data
+
+        (status_code, data), shared = flight.do(key, respond)
+        response = Response(data, status=status_code)
+        if shared:
+            response['X-Coalesced'] = '1'
+        return response
+
+    return wrapper
@@ -0,0 +1,74 @@
+"""
+Table versions.
+
+A version counter per database table in the shared cache, bumped once a
+transaction that wrote to the table commits. Results computed from a
+table and cached elsewhere (reports.widget_data) put the versions of the
+tables they read into their cache keys, so any write makes them miss
+without having to know which entries it affected.
+
+track() bumps a model's version on post_save and post_delete. Code that
+writes with queryset.update() or bulk_create() calls touch() itself.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+
+_pending = threading.local()
+
+
+def _key(model):
+    return f"table-version:{model._meta.db_table}"
+
+
+def _initial():
+    # A version recreated after eviction must not repeat an earlier one
+    return time.time_ns()
+
+
+def versions(models):
+    """The current versions of the given models' tables, in order."""
+    keys = [_key(model) for model in models]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial(), timeout=None)
+        found.update(cache.get_many(missing))
+    return tuple(found.get(key) for key in keys)
+
+
+def touch(*models):
+    """Bump the versions of the given models' tables once the transaction commits."""
+    pending = getattr(_pending, 'models', None)
+    if pending is None:
+        pending = _pending.models = set()
+    pending.update(models)
+    transaction.on_commit(_flush)
+
+
+def _flush():
+    # Every callback of a commit runs this; the first one does the work
+    models = getattr(_pending, 'models', None)
+    _pending.models = None
+    for model in models or ():
+        try:
+            cache.incr(_key(model))
+        except ValueError:
+            cache.set(_key(model), _initial(), timeout=None)
+
+
+def _changed(sender, **kwargs):
+    touch(sender)
+
+
+def track(*models):
+    """Bump the models' table versions whenever one of their rows is saved or deleted."""
+    for model in models:
+        uid = f"table-version:{model._meta.label}"
+        post_save.connect(_changed, sender=model, dispatch_uid=uid)
+        post_delete.connect(_changed, sender=model, dispatch_uid=uid)
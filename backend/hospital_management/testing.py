@@ -0,0 +1,33 @@
+"""
+Helpers shared by the apps' tests.
+"""
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .pagination import KeysetOrPageNumberPagination, KeysetPagination
+
+
+class QueryCountMixin:
+    """
+    assertFixedQueryCount() for list endpoints: a large page must take as
+    many queries as a small one, so related rows are joined or prefetched
+    rather than read per row. Needs `self.api`, an authenticated client,
+    and at least `large_page` rows behind each URL.
+    """
+    small_page = 2
+    large_page = 6
+
+    def get_page(self, url, page_size):
+        with mock.patch.object(KeysetOrPageNumberPagination, 'page_size', page_size), \
+                mock.patch.object(KeysetPagination, 'page_size', page_size):
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+
+    def assertFixedQueryCount(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(url, self.small_page)
+        with self.assertNumQueries(len(queries)):
+            self.get_page(url, self.large_page)
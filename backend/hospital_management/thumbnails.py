@@ -0,0 +1,208 @@
+"""
+Image thumbnails.
+
+Uploaded images are served in fixed renditions (RENDITIONS) instead of at
+full resolution. A rendition is made on its first request: the thumbnail
+view decodes the original with Pillow's draft mode (JPEG's DCT scaling)
+and reduce(), which skip most of the pixels instead of resampling them
+all, stores the result in a thumbnails/ directory next to the original
+and redirects to it. Later requests for the same rendition redirect
+straight away, and browsers cache the redirect, since a rendition URL
+always names the same bytes.
+
+register() connects an image field of a model: when the field's file
+changes or its row is deleted, the renditions of the old file are
+deleted. ThumbnailsField puts the rendition URLs in a serializer.
+
+Rendition URLs carry the original's storage name, signed, so the view
+only ever reads files that an image field pointed at. A rendition is
+only made while a registered field still holds its original, so the
+signed URLs of a replaced or deleted image don't bring back the
+renditions register() deleted.
+"""
+import hashlib
+import os
+from io import BytesIO
+
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.http import Http404, HttpResponseRedirect
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .single_flight import flight
+
+
+# Bounding boxes, in pixels; images keep their aspect ratio
+RENDITIONS = {
+    'list': (160, 160),
+    'card': (480, 360),
+    'detail': (1200, 1200),
+}
+JPEG_QUALITY = 82
+# Stored formats keep transparency; everything else becomes JPEG
+LOSSLESS_EXTENSIONS = ('.png', '.gif', '.webp')
+
+SALT = 'hospital_management.thumbnails'
+REDIRECT_MAX_AGE = 365 * 24 * 3600
+
+# (model, field name) of the image fields connected by register()
+_fields = []
+
+
+def rendition_name(name, rendition):
+    """Storage name of a rendition of the file stored as `name`."""
+    directory, filename = os.path.split(name)
+    stem, extension = os.path.splitext(filename)
+    # Changes when the bounding box does, so resized renditions are made again
+    token = hashlib.sha256(f"{name}:{RENDITIONS[rendition]}:{JPEG_QUALITY}".encode()).hexdigest()[:10]
+    extension = '.png' if extension.lower() in LOSSLESS_EXTENSIONS else '.jpg'
+    return os.path.join(directory, 'thumbnails', f"{stem}.{rendition}.{token}{extension}")
+
+
+def render(source, size, image_format='JPEG'):
+    """A thumbnail of the image file `source` fitting in `size`, as PNG or JPEG bytes."""
+    with Image.open(source) as image:
+        # JPEG decodes at 1/2, 1/4 or 1/8 scale, never smaller than asked
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        if image_format == 'PNG':
+            transparent = 'A' in image.mode or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        factor = min(image.width // size[0], image.height // size[1])
+        if factor >= 2:
+            # Box-averages whole blocks of pixels; much cheaper than resampling
+            image = image.reduce(factor)
+        image.thumbnail(size, Image.LANCZOS)
+
+        buffer = BytesIO()
+        if image_format == 'PNG':
+            image.save(buffer, 'PNG', optimize=True)
+        else:
+            image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        return buffer.getvalue()
+
+
+def ensure(name, rendition):
+    """Make the rendition of the file `name` unless it is stored already; returns its name."""
+    target = rendition_name(name, rendition)
+
+    def make():
+        if default_storage.exists(target):
+            return target
+        with default_storage.open(name, 'rb') as source:
+            data = render(source, RENDITIONS[rendition], 'PNG' if target.endswith('.png') else 'JPEG')
+        saved = default_storage.save(target, ContentFile(data))
+        if saved != target:
+            # Made by another process meanwhile
+            default_storage.delete(saved)
+        return target
+
+    return flight.do(f"thumbnail:{target}", make)[0]
+
+
+def is_current(name):
+    """Whether a registered image field holds the file stored as `name`."""
+    return any(model._default_manager.filter(**{field: name}).exists() for model, field in _fields)
+
+
+def url(name, rendition):
+    """URL of a rendition of the file stored as `name`."""
+    token = signing.dumps(name, salt=SALT, compress=True)
+    return reverse('thumbnail', args=[rendition, token])
+
+
+def urls(field_file, request=None):
+    """URLs of every rendition of an image field's file, or None without a file."""
+    if not field_file:
+        return None
+    result = {}
+    for rendition in RENDITIONS:
+        location = url(field_file.name, rendition)
+        result[rendition] = request.build_absolute_uri(location) if request is not None else location
+    return result
+
+
+def delete(name):
+    """Delete the stored renditions of the file `name`."""
+    for rendition in RENDITIONS:
+        default_storage.delete(rendition_name(name, rendition))
+
+
+def thumbnail(request, rendition, token):
+    """Redirect to a rendition, making it first if needed."""
+    if rendition not in RENDITIONS:
+        raise Http404("Unknown rendition")
+    try:
+        name = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        raise Http404("Invalid thumbnail")
+    if not default_storage.exists(rendition_name(name, rendition)) and not is_current(name):
+        # Signed for an image that has since been replaced or deleted
+        raise Http404("No image")
+    try:
+        target = ensure(name, rendition)
+    except (OSError, Image.DecompressionBombError):
+        # Missing, unreadable or not an image
+        raise Http404("No image")
+
+    response = HttpResponseRedirect(default_storage.url(target))
+    patch_cache_control(response, public=True, max_age=REDIRECT_MAX_AGE, immutable=True)
+    return response
+
+
+class ThumbnailsField(serializers.ReadOnlyField):
+    """The rendition URLs of an image field, e.g. ThumbnailsField(source='image')."""
+
+    def to_representation(self, value):
+        return urls(value, self.context.get('request'))
+
+
+def _name(value):
+    return getattr(value, 'name', value) or None
+
+
+def _remember(sender, instance, **kwargs):
+    # Names, not files: saving a new upload renames the field's file in place
+    values = instance.__dict__
+    instance._thumbnail_sources = {
+        field: _name(values[field]) for field in sender._thumbnail_fields if field in values
+    }
+
+
+def _delete_later(names):
+    names = [name for name in names if name]
+    if names:
+        transaction.on_commit(lambda: [delete(name) for name in names])
+
+
+def _changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old_names = []
+    for field, old_name in getattr(instance, '_thumbnail_sources', {}).items():
+        if old_name != _name(getattr(instance, field)):
+            old_names.append(old_name)
+    _delete_later(old_names)
+    _remember(sender, instance)
+
+
+def _deleted(sender, instance, **kwargs):
+    _delete_later([_name(getattr(instance, field)) for field in sender._thumbnail_fields])
+
+
+def register(model, *fields):
+    """Delete the renditions of the model's image `fields` when their files change or rows go."""
+    model._thumbnail_fields = tuple(getattr(model, '_thumbnail_fields', ())) + fields
+    _fields.extend((model, field) for field in fields if (model, field) not in _fields)
+    uid = f"thumbnails:{model._meta.label}"
+    post_init.connect(_remember, sender=model, dispatch_uid=uid)
+    post_save.connect(_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(_deleted, sender=model, dispatch_uid=uid)
@@ -22,6 +22,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from hospital_management import thumbnails
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Hospital Instrument Management API",
@@ -50,6 +52,9 @@ urlpatterns = [
     path('api/orders/', include('orders.urls')),
     path('api/reports/', include('reports.urls')),
     path('api/notifications/', include('notifications.urls')),
+    
+    # Image renditions, made on first request
+    path('api/thumbnails/<str:rendition>/<str:token>/', thumbnails.thumbnail, name='thumbnail'),
 ]
 
 if settings.DEBUG:
@@ -1,9 +1,25 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from import_export.admin import ImportExportModelAdmin
 
+from .imports import IMPORT_FORMATS, error_report, guess_format, import_upload
 from .models import InstrumentCategory, Instrument, InstrumentMaintenance
 
 
+class BulkImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or XLSX with a header row; categories are given by name.")
+    format = forms.ChoiceField(
+        choices=[('', 'From the file name')] + [(value, value.upper()) for value in IMPORT_FORMATS],
+        required=False,
+    )
+    create_categories = forms.BooleanField(required=False, help_text="Create categories that don't exist yet.")
+
+
 class InstrumentMaintenanceInline(admin.TabularInline):
     model = InstrumentMaintenance
     extra = 0
@@ -23,6 +39,7 @@ class InstrumentAdmin(ImportExportModelAdmin):
     search_fields = ('name', 'serial_number', 'description')
     readonly_fields = ('qr_code',)
     inlines = [InstrumentMaintenanceInline]
+    change_list_template = 'admin/instruments/instrument/change_list.html'
     fieldsets = (
         ('Basic Information', {
             'fields': ('name', 'serial_number', 'category', 'description', 'status')
@@ -34,6 +51,71 @@ class InstrumentAdmin(ImportExportModelAdmin):
             'fields': ('manufacturer', 'warranty_expiry', 'notes', 'image', 'qr_code')
         }),
     )
+    
+    def get_urls(self):
+        urls = [
+            path('bulk-import/', self.admin_site.admin_view(self.bulk_import_view), name='instruments_instrument_bulk_import'),
+            path(
+                'bulk-import/errors/<str:token>/',
+                self.admin_site.admin_view(self.bulk_import_errors_view),
+                name='instruments_instrument_bulk_import_errors',
+            ),
+        ]
+        return urls + super().get_urls()
+    
+    def bulk_import_view(self, request):
+        """
+        Import a large catalog through instruments.imports instead of the
+        row-by-row import-export import.
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        
+        form = BulkImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            import_format = form.cleaned_data['format'] or guess_format(upload.name)
+            try:
+                stats, report_token = import_upload(
+                    upload.file, import_format, create_categories=form.cleaned_data['create_categories']
+                )
+            except ValueError as e:
+                form.add_error('file', f"Cannot read the instrument file: {e}")
+            else:
+                self.message_user(
+                    request,
+                    f"{stats.get('rows', 0)} rows: {stats.get('created', 0)} instruments created, "
+                    f"{stats.get('rejected', 0)} rejected.",
+                    messages.WARNING if stats.get('rejected') else messages.SUCCESS,
+                )
+                if report_token is None:
+                    return redirect('admin:instruments_instrument_changelist')
+                return TemplateResponse(request, 'admin/instruments/instrument/bulk_import.html', {
+                    **self.admin_site.each_context(request),
+                    'opts': self.model._meta,
+                    'title': 'Bulk import instruments',
+                    'form': BulkImportForm(),
+                    'errors': stats['errors'],
+                    'rejected': stats['rejected'],
+                    'report_url': reverse('admin:instruments_instrument_bulk_import_errors', args=[report_token]),
+                })
+        
+        return TemplateResponse(request, 'admin/instruments/instrument/bulk_import.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Bulk import instruments',
+            'form': form,
+        })
+    
+    def bulk_import_errors_view(self, request, token):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        report = error_report(token)
+        if report is None:
+            raise Http404("No such error report")
+        return FileResponse(
+            report, as_attachment=True, filename='instrument-import-errors.csv', content_type='text/csv'
+        )
 
 
 @admin.register(InstrumentMaintenance)
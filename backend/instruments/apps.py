@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class InstrumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'instruments'
+    
+    def ready(self):
+        import instruments.signals
+        from hospital_management import thumbnails
+        
+        thumbnails.register(self.get_model('Instrument'), 'image')
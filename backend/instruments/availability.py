@@ -0,0 +1,214 @@
+"""
+Rental availability index.
+
+Keeps the rental periods of every instrument in memory, sorted by start
+date with a running maximum of end dates, so "is instrument X free between
+these dates" is a binary search instead of a scan of the order_items table.
+
+The index is built from OrderItem on first use and updated incrementally
+when order items or orders change. Each change bumps a version counter in
+the shared cache and records the ids of the changed items under that
+version. Other worker processes notice the new version on their next
+query and re-read just those items; they only rebuild from the whole
+table when they fell more than MAX_DELTAS versions behind or a change
+record expired (DELTA_TTL).
+
+Worker processes only learn of each other's changes through the cache, so
+deployments with more than one process need a shared cache (Redis, see
+REDIS_CACHE_URL); with the local-memory cache each process sees only its
+own bookings.
+"""
+import bisect
+import threading
+from datetime import date
+
+from django.core.cache import cache
+
+
+VERSION_KEY = 'instruments:availability:version'
+
+# Changes another process can catch up with before rebuilding instead
+MAX_DELTAS = 500
+DELTA_TTL = 3600
+
+# Instruments in these statuses can't be rented whatever their bookings
+UNAVAILABLE_STATUSES = ('sold', 'stored', 'maintenance')
+
+# Open-ended rentals block the instrument indefinitely
+OPEN_END = date.max
+
+
+class InstrumentBookings:
+    """Rental periods of one instrument, sorted by start date."""
+
+    def __init__(self):
+        self.starts = []
+        self.periods = []
+        self.max_ends = []
+
+    def _rebuild_max_ends(self, start_index=0):
+        running = self.max_ends[start_index - 1] if start_index else date.min
+        del self.max_ends[start_index:]
+        for period in self.periods[start_index:]:
+            running = max(running, period[1])
+            self.max_ends.append(running)
+
+    def add(self, start, end, item_id):
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.periods.insert(index, (start, end, item_id))
+        self._rebuild_max_ends(index)
+
+    def remove(self, item_id):
+        for index, period in enumerate(self.periods):
+            if period[2] == item_id:
+                del self.starts[index]
+                del self.periods[index]
+                self._rebuild_max_ends(index)
+                return True
+        return False
+
+    def overlaps(self, start, end):
+        """Whether any booking overlaps the inclusive range start..end."""
+        # Bookings starting after `end` can't overlap; of the rest, one
+        # overlaps if the latest end among them reaches `start`.
+        count = bisect.bisect_right(self.starts, end)
+        return count > 0 and self.max_ends[count - 1] >= start
+
+    def __bool__(self):
+        return bool(self.periods)
+
+
+class AvailabilityIndex:
+    """Bookings of all instruments, shared by the threads of one process."""
+
+    fields = ('id', 'order_id', 'instrument_id', 'rental_start_date', 'rental_end_date')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.bookings = {}
+        self.items = {}
+        self.order_items = {}
+        self.version = None
+
+    def _add(self, item_id, order_id, instrument_id, start, end):
+        self.bookings.setdefault(instrument_id, InstrumentBookings()).add(start, end or OPEN_END, item_id)
+        self.items[item_id] = (order_id, instrument_id)
+        self.order_items.setdefault(order_id, set()).add(item_id)
+
+    def _remove(self, item_id):
+        if item_id not in self.items:
+            return
+        order_id, instrument_id = self.items.pop(item_id)
+
+        bookings = self.bookings[instrument_id]
+        bookings.remove(item_id)
+        if not bookings:
+            del self.bookings[instrument_id]
+
+        order_items = self.order_items[order_id]
+        order_items.discard(item_id)
+        if not order_items:
+            del self.order_items[order_id]
+
+    def rebuild(self):
+        from orders.models import OrderItem
+
+        with self.lock:
+            version = cache.get_or_set(VERSION_KEY, 1, timeout=None)
+            self.bookings = {}
+            self.items = {}
+            self.order_items = {}
+            rows = booking_items(OrderItem.objects.all()).values_list(*self.fields)
+            for row in rows.iterator(chunk_size=5000):
+                self._add(*row)
+            self.version = version
+
+    def _reload(self, item_ids):
+        from orders.models import OrderItem
+
+        for item_id in item_ids:
+            self._remove(item_id)
+        rows = booking_items(OrderItem.objects.filter(pk__in=item_ids)).values_list(*self.fields)
+        for row in rows:
+            self._add(*row)
+
+    def _catch_up(self, version):
+        """Apply the changes of versions after ours up to `version`; False if some are gone."""
+        if self.version is None or not 0 <= version - self.version <= MAX_DELTAS:
+            return False
+        keys = [_delta_key(number) for number in range(self.version + 1, version + 1)]
+        deltas = cache.get_many(keys)
+        if len(deltas) < len(keys):
+            return False
+        self._reload(set().union(*deltas.values()))
+        self.version = version
+        return True
+
+    def ensure_current(self):
+        with self.lock:
+            version = cache.get(VERSION_KEY)
+            if version == self.version and version is not None:
+                return
+            if version is None or not self._catch_up(version):
+                self.rebuild()
+
+    def _publish(self, item_ids):
+        """Record a change for other processes and catch up with theirs."""
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, timeout=None)
+            version = 1
+        cache.set(_delta_key(version), item_ids, DELTA_TTL)
+        if self.version is None:
+            return
+        if version != self.version + 1 and not self._catch_up(version - 1):
+            # Others changed bookings meanwhile and their changes are gone
+            self.version = None
+            return
+        self.version = version
+
+    def refresh_items(self, item_ids):
+        """Re-read the given order items from the database."""
+        item_ids = set(item_ids)
+        with self.lock:
+            if self.version is not None:
+                self._reload(item_ids)
+            self._publish(item_ids)
+
+    def refresh_order(self, order_id):
+        """Re-read every item of an order, e.g. after it was cancelled or edited."""
+        from orders.models import OrderItem
+
+        with self.lock:
+            known = self.order_items.get(order_id, set())
+            current = set(OrderItem.objects.filter(order_id=order_id).values_list('pk', flat=True))
+            self.refresh_items(known | current)
+
+    def booked(self, instrument_ids, start, end):
+        """Ids of the given instruments with a booking overlapping start..end."""
+        self.ensure_current()
+        with self.lock:
+            return {
+                instrument_id for instrument_id in instrument_ids
+                if instrument_id in self.bookings and self.bookings[instrument_id].overlaps(start, end)
+            }
+
+    def is_free(self, instrument_id, start, end):
+        return not self.booked([instrument_id], start, end)
+
+
+def _delta_key(version):
+    return f"{VERSION_KEY}:{version}"
+
+
+def booking_items(queryset):
+    """Order items that block their instrument for a date range."""
+    return queryset.filter(
+        order__order_type='rental',
+        rental_start_date__isnull=False,
+    ).exclude(order__status='cancelled')
+
+
+index = AvailabilityIndex()
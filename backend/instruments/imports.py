@@ -0,0 +1,340 @@
+"""
+Bulk import of instruments from CSV or XLSX.
+
+Rows are streamed from the file and processed in fixed size chunks, so
+memory use does not grow with the catalog. For each chunk:
+
+- every row is parsed and checked on its own (required fields, dates,
+  prices, status),
+- categories are resolved by name through one map loaded up front,
+- serial numbers are checked against the file so far and against the
+  database with one query,
+- the valid rows are written with bulk_create in their own transaction,
+  and their QR codes are scheduled in the background (instruments.qr).
+
+Rejected rows are written to the error report with their row number and
+the reason; a failing row never stops the rest of the import. A file
+that can't be read any further after some rows ends the import there,
+with the reason reported as a row error.
+
+Error reports hold whole catalog rows, prices included, so uploads keep
+them as private files (hospital_management.private_files) under a random
+token that is only handed out through authenticated downloads, and for a
+limited time.
+"""
+import csv
+import io
+import tempfile
+import zipfile
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_date
+
+from hospital_management import private_files
+from hospital_management.table_versions import touch
+from . import qr
+from .models import Instrument, InstrumentCategory
+
+
+INSTRUMENT_FIELDS = [
+    'name', 'serial_number', 'category', 'description', 'purchase_date', 'purchase_price',
+    'rental_price_per_day', 'selling_price', 'status', 'manufacturer', 'warranty_expiry', 'notes',
+]
+ERROR_FIELDS = ['row'] + INSTRUMENT_FIELDS + ['error']
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+# Errors kept in the result of run(); the report has all of them
+MAX_LISTED_ERRORS = 100
+
+ERROR_REPORT_DIR = 'imports/errors'
+
+MAX_PRICE = Decimal('99999999.99')
+
+
+def _header(names):
+    return [str(name or '').strip().lower().replace(' ', '_') for name in names]
+
+
+def read_csv(stream):
+    """Iterate over (row number, row dict) of a CSV file."""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(stream)
+    header = _header(next(reader, []))
+    for values in reader:
+        yield reader.line_num, dict(zip(header, values))
+
+
+def read_xlsx(stream):
+    """Iterate over (row number, row dict) of the first sheet of an XLSX workbook."""
+    # Installed with django-import-export (tablib[xlsx])
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except (KeyError, OSError, zipfile.BadZipFile):
+        raise ValueError("Not a readable XLSX workbook")
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = _header(next(rows, []))
+        for number, values in enumerate(rows, start=2):
+            yield number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_instruments(stream, import_format):
+    if import_format == 'csv':
+        return read_csv(stream)
+    if import_format == 'xlsx':
+        return read_xlsx(stream)
+    raise ValueError(f"Unsupported import format: {import_format}")
+
+
+def guess_format(filename):
+    return 'xlsx' if filename.lower().endswith(('.xlsx', '.xlsm')) else 'csv'
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _date(value, field, required=False):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _text(value)
+    if not text:
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    parsed = parse_date(text[:10])
+    if parsed is None:
+        raise ValueError(f"Invalid {field}")
+    return parsed
+
+
+def _price(value, field):
+    text = _text(value).replace(',', '')
+    if not text:
+        raise ValueError(f"{field} is required")
+    try:
+        price = Decimal(text).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"Invalid {field}")
+    if price < 0 or price > MAX_PRICE:
+        raise ValueError(f"{field} out of range")
+    return price
+
+
+class InstrumentImport:
+    """
+    Imports instrument rows.
+
+    `errors` is an optional text stream that receives a CSV report of the
+    rows that were not imported. Unknown categories are rejected, or
+    created when `create_categories` is set.
+    """
+
+    def __init__(self, chunk_size=1000, errors=None, create_categories=False):
+        self.chunk_size = chunk_size
+        self.create_categories = create_categories
+        self.stats = Counter()
+        self.errors = []
+        self.report = None
+        if errors is not None:
+            self.report = csv.DictWriter(errors, fieldnames=ERROR_FIELDS, extrasaction='ignore')
+            self.report.writeheader()
+
+        # One lookup for the whole import; the first of equally named categories wins
+        self.categories = {}
+        for pk, name in InstrumentCategory.objects.order_by('-pk').values_list('pk', 'name'):
+            self.categories[name.strip().casefold()] = pk
+        self.statuses = {}
+        for value, label in Instrument.STATUS_CHOICES:
+            self.statuses[value] = self.statuses[label.casefold()] = value
+        self.seen = set()
+
+    def run(self, rows):
+        """
+        Import `rows` and return the stats. Raises ValueError if the file
+        can't be read at all; nothing was imported then.
+        """
+        for chunk in chunked(self.read(rows), self.chunk_size):
+            self.import_chunk(chunk)
+        return {**self.stats, 'errors': self.errors}
+
+    def read(self, rows):
+        rows = iter(rows)
+        number = None
+        while True:
+            try:
+                number, row = next(rows)
+            except StopIteration:
+                return
+            except (ValueError, csv.Error) as e:
+                if number is None:
+                    raise ValueError(str(e)) from e
+                # Earlier chunks are already imported; report where reading stopped
+                self.stats['rows'] += 1
+                self.reject(number + 1, {}, f"Cannot read the file from here on: {e}")
+                return
+            yield number, row
+
+    def reject(self, number, row, reason):
+        self.stats['rejected'] += 1
+        if len(self.errors) < MAX_LISTED_ERRORS:
+            self.errors.append({'row': number, 'serial_number': _text(row.get('serial_number')), 'error': reason})
+        if self.report is not None:
+            self.report.writerow({**{field: row.get(field) for field in INSTRUMENT_FIELDS}, 'row': number, 'error': reason})
+
+    def category_id(self, name):
+        key = name.casefold()
+        if key not in self.categories and self.create_categories:
+            self.categories[key] = InstrumentCategory.objects.create(name=name).pk
+            self.stats['categories_created'] += 1
+        return self.categories.get(key)
+
+    def parse_row(self, row):
+        name = _text(row.get('name'))
+        serial_number = _text(row.get('serial_number'))
+        category = _text(row.get('category'))
+        if not name:
+            raise ValueError('name is required')
+        if len(name) > 200:
+            raise ValueError('name is longer than 200 characters')
+        if not serial_number:
+            raise ValueError('serial_number is required')
+        if len(serial_number) > 100:
+            raise ValueError('serial_number is longer than 100 characters')
+        if not category:
+            raise ValueError('category is required')
+        if len(category) > 100:
+            raise ValueError('category is longer than 100 characters')
+
+        status = _text(row.get('status')).casefold() or 'available'
+        if status not in self.statuses:
+            raise ValueError(f"Unknown status: {row.get('status')}")
+        manufacturer = _text(row.get('manufacturer')) or None
+        if manufacturer and len(manufacturer) > 100:
+            raise ValueError('manufacturer is longer than 100 characters')
+
+        instrument = Instrument(
+            name=name,
+            serial_number=serial_number,
+            description=_text(row.get('description')) or None,
+            purchase_date=_date(row.get('purchase_date'), 'purchase_date', required=True),
+            purchase_price=_price(row.get('purchase_price'), 'purchase_price'),
+            rental_price_per_day=_price(row.get('rental_price_per_day'), 'rental_price_per_day'),
+            selling_price=_price(row.get('selling_price'), 'selling_price'),
+            status=self.statuses[status],
+            manufacturer=manufacturer,
+            warranty_expiry=_date(row.get('warranty_expiry'), 'warranty_expiry'),
+            notes=_text(row.get('notes')) or None,
+        )
+        # Last, so invalid rows don't create categories
+        instrument.category_id = self.category_id(category)
+        if instrument.category_id is None:
+            raise ValueError(f"Unknown category: {category}")
+        return instrument
+
+    def import_chunk(self, rows):
+        parsed = []
+        for number, row in rows:
+            if not any(_text(value) for value in row.values()):
+                continue
+            self.stats['rows'] += 1
+            try:
+                parsed.append((number, row, self.parse_row(row)))
+            except ValueError as e:
+                self.reject(number, row, str(e))
+
+        existing = set(
+            Instrument.objects.filter(serial_number__in=[instrument.serial_number for *_, instrument in parsed])
+            .values_list('serial_number', flat=True)
+        )
+
+        to_create = []
+        for number, row, instrument in parsed:
+            if instrument.serial_number in self.seen:
+                self.reject(number, row, 'Duplicate serial_number in file')
+                continue
+            self.seen.add(instrument.serial_number)
+            if instrument.serial_number in existing:
+                self.reject(number, row, 'serial_number already exists')
+                continue
+            to_create.append((number, row, instrument))
+
+        self.create(to_create)
+
+    def create(self, rows, retry=True):
+        """Write (row number, row, instrument) entries in one transaction."""
+        instruments = [instrument for number, row, instrument in rows]
+        if not instruments:
+            return
+        try:
+            with transaction.atomic():
+                Instrument.objects.bulk_create(instruments)
+                touch(Instrument)
+                ids = [instrument.pk for instrument in instruments]
+                if None in ids:
+                    # Databases that don't return ids from bulk inserts
+                    ids = list(Instrument.objects.filter(
+                        serial_number__in=[instrument.serial_number for instrument in instruments]
+                    ).values_list('pk', flat=True))
+                qr.schedule(ids)
+        except IntegrityError:
+            if not retry:
+                raise
+            # Someone else added some of these serial numbers since they were checked
+            taken = set(
+                Instrument.objects.filter(serial_number__in=[instrument.serial_number for instrument in instruments])
+                .values_list('serial_number', flat=True)
+            )
+            remaining = []
+            for number, row, instrument in rows:
+                instrument.pk = None
+                if instrument.serial_number in taken:
+                    self.reject(number, row, 'serial_number already exists')
+                else:
+                    remaining.append((number, row, instrument))
+            self.create(remaining, retry=False)
+            return
+        self.stats['created'] += len(instruments)
+
+
+def import_upload(stream, import_format, create_categories=False):
+    """
+    Import an uploaded instrument file. Returns the import's stats and the
+    token of its error report (see error_report()), if any row was
+    rejected.
+    """
+    with tempfile.TemporaryFile('w+', newline='') as report:
+        importer = InstrumentImport(errors=report, create_categories=create_categories)
+        stats = importer.run(read_instruments(stream, import_format))
+
+        token = None
+        if stats.get('rejected'):
+            report.seek(0)
+            token = private_files.save(ERROR_REPORT_DIR, File(report))
+    return stats, token
+
+
+def error_report(token):
+    """The stored error report of an upload as an open file, or None if it is unknown or expired."""
+    return private_files.open_file(ERROR_REPORT_DIR, token)
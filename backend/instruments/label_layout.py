@@ -0,0 +1,157 @@
+"""
+QR label sheet layout.
+
+A sheet is a PDF of A4 pages holding a grid of labels, each with an
+instrument's QR code, name, serial number and category.
+
+reportlab's canvas keeps the whole document until save(), so it can
+neither spread pages over processes nor send the first page before the
+last one is drawn. Here each page is rendered on its own to a content
+stream and its QR images, and write_sheet() writes them out through
+hospital_management.pdf as the pages come back. Memory is bounded by the
+pages in flight, whatever the number of labels.
+
+Works on plain tuples and imports nothing from Django, so it can run in
+pool worker processes.
+"""
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import qrcode
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+
+from hospital_management import pdf
+
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 10 * mm
+COLUMNS = 3
+ROWS = 8
+LABELS_PER_PAGE = COLUMNS * ROWS
+LABEL_WIDTH = (PAGE_WIDTH - 2 * MARGIN) / COLUMNS
+LABEL_HEIGHT = (PAGE_HEIGHT - 2 * MARGIN) / ROWS
+PADDING = 3 * mm
+
+TITLE_SIZE = 8
+TEXT_SIZE = 7
+
+
+def qr_bitmap(text):
+    """
+    The QR code of `text` as a 1-bit image: (modules per side, deflated
+    rows, white bits set).
+    """
+    # Scoring all eight mask patterns takes most of the time; any mask scans
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=1, mask_pattern=2)
+    code.add_data(text)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    rows = bytearray()
+    for row in matrix:
+        for start in range(0, len(row), 8):
+            modules = row[start:start + 8]
+            byte = 0
+            for module in modules:
+                byte = (byte << 1) | (not module)
+            rows.append(byte << (8 - len(modules)))
+    return len(matrix), zlib.compress(bytes(rows))
+
+
+def _wrap(text, font, size, width, lines):
+    """`text` broken into at most `lines` lines no wider than `width`."""
+    result = []
+    words = text.split()
+    while words and len(result) < lines:
+        line = words.pop(0)
+        while words and pdf.string_width(f"{line} {words[0]}", font, size) <= width:
+            line = f"{line} {words.pop(0)}"
+        result.append(line)
+    if words:
+        result[-1] = pdf.fit(f"{result[-1]} {' '.join(words)}", font, size, width - 1)
+    return [pdf.fit(line, font, size, width) for line in result]
+
+
+def render_page(labels):
+    """
+    Render one page of (qr_text, bitmap, name, serial_number, category)
+    labels, `bitmap` being a qr_bitmap() to reuse or None. Returns (deflated content stream, [(modules, deflated bitmap), ...]),
+    the page's images being /Q0, /Q1, ... in order.
+    """
+    code = []
+    images = []
+    qr_size = LABEL_HEIGHT - 2 * PADDING
+    text_width = LABEL_WIDTH - qr_size - 3 * PADDING
+    for index, (qr_text, bitmap, name, serial_number, category) in enumerate(labels):
+        column, row = index % COLUMNS, index // COLUMNS
+        x = MARGIN + column * LABEL_WIDTH
+        y = PAGE_HEIGHT - MARGIN - (row + 1) * LABEL_HEIGHT
+
+        # Cutting guide
+        code.append(f"q 0.8 G 0.25 w {x:.2f} {y:.2f} {LABEL_WIDTH:.2f} {LABEL_HEIGHT:.2f} re S Q".encode())
+
+        images.append(bitmap or qr_bitmap(qr_text))
+        code.append(
+            f"q {qr_size:.2f} 0 0 {qr_size:.2f} {x + PADDING:.2f} {y + PADDING:.2f} cm /Q{index} Do Q".encode()
+        )
+
+        text_x = x + qr_size + 2 * PADDING
+        lines = [(pdf.BOLD, TITLE_SIZE, line) for line in _wrap(name, pdf.BOLD, TITLE_SIZE, text_width, 2)]
+        lines.append((pdf.REGULAR, TEXT_SIZE, pdf.fit(serial_number, pdf.REGULAR, TEXT_SIZE, text_width)))
+        if category:
+            lines.append((pdf.REGULAR, TEXT_SIZE, pdf.fit(category, pdf.REGULAR, TEXT_SIZE, text_width)))
+        text_y = y + LABEL_HEIGHT - PADDING - TITLE_SIZE
+        for font, size, line in lines:
+            code.append(pdf.text(text_x, text_y, font, size, line))
+            text_y -= size + 2
+    return zlib.compress(b'\n'.join(code)), images
+
+
+def render_pages(pages, workers=1, pool=None):
+    """
+    Render the label lists of `pages` in order, `workers` processes at a
+    time, in `pool` if given (else a pool of its own). Each page is yielded
+    as soon as it and the pages before it are done; at most two pages per
+    worker are in flight.
+    """
+    if workers <= 1 and pool is None:
+        yield from map(render_page, pages)
+        return
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    in_flight = deque()
+    try:
+        for labels in pages:
+            in_flight.append(pool.submit(render_page, labels))
+            while in_flight and (len(in_flight) >= 2 * workers or in_flight[0].done()):
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        if own_pool:
+            pool.shutdown(cancel_futures=True)
+        else:
+            for future in in_flight:
+                future.cancel()
+
+
+def write_sheet(rendered_pages):
+    """Yield a PDF of the pages of render_page() output, a page at a time."""
+    document = pdf.Document(PAGE_WIDTH, PAGE_HEIGHT)
+    yield document.header()
+    for content, images in rendered_pages:
+        chunks = []
+        xobjects = []
+        for index, (modules, bitmap) in enumerate(images):
+            number = document.new_number()
+            chunks.append(document.object(number, (
+                b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray '
+                b'/BitsPerComponent 1 /Interpolate false /Filter /FlateDecode /Length %d >>'
+            ) % (modules, modules, len(bitmap)), bitmap))
+            xobjects.append((f"Q{index}", number))
+        chunks.append(document.page(content, xobjects))
+        yield b''.join(chunks)
+    yield document.close()
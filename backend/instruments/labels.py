@@ -0,0 +1,105 @@
+"""
+QR label sheets for instruments.
+
+label_sheet() streams a PDF of labels for the instruments matching a
+category, status and serial number range (see instruments.label_layout).
+Instruments are read in serial number order a page at a time, and pages
+are rendered in worker processes: requests share one pool of
+QR_LABEL_WORKERS processes, so concurrent downloads queue for it instead
+of each starting processes of their own, while the print_qr_labels
+command starts a pool of its own sized to the machine.
+
+QR bitmaps are kept in the shared cache under the hash of what they
+encode, so instruments labelled before aren't encoded again.
+"""
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import qr
+from .label_layout import LABELS_PER_PAGE, render_pages, write_sheet
+from .models import Instrument
+
+
+BITMAP_TTL = 30 * 24 * 3600
+
+SHARED_WORKERS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shared_pool():
+    """The process pool shared by label sheet requests, and its size."""
+    global _pool
+    workers = getattr(settings, 'QR_LABEL_WORKERS', None) or SHARED_WORKERS
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the web server's threads and connections stay behind
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool, workers
+
+
+def label_queryset(category=None, status=None, serial_from=None, serial_to=None, queryset=None):
+    """Instruments to label, in serial number order; the serial range is inclusive."""
+    if queryset is None:
+        queryset = Instrument.objects.all()
+    if category:
+        queryset = queryset.filter(category_id=category)
+    if status:
+        queryset = queryset.filter(status=status)
+    if serial_from:
+        queryset = queryset.filter(serial_number__gte=serial_from)
+    if serial_to:
+        queryset = queryset.filter(serial_number__lte=serial_to)
+    return queryset.order_by('serial_number')
+
+
+def _bitmap_key(name, serial_number):
+    return f"qr-bitmap:{qr.content_hash(name, serial_number)}"
+
+
+def _pages(queryset, pending):
+    rows = queryset.values_list('name', 'serial_number', 'category__name')
+    last = None
+    while True:
+        batch = rows.filter(serial_number__gt=last) if last is not None else rows
+        batch = list(batch[:LABELS_PER_PAGE])
+        if not batch:
+            return
+        last = batch[-1][1]
+
+        keys = [_bitmap_key(name, serial) for name, serial, category in batch]
+        cached = cache.get_many(keys)
+        pending.append((keys, cached))
+        yield [
+            (qr.content(name, serial), cached.get(key), name, serial, category)
+            for key, (name, serial, category) in zip(keys, batch)
+        ]
+
+
+def _store_bitmaps(rendered, pending):
+    # Pages come back in the order _pages() made them
+    for content, images in rendered:
+        keys, cached = pending.popleft()
+        new = {key: tuple(image) for key, image in zip(keys, images) if key not in cached}
+        if new:
+            cache.set_many(new, BITMAP_TTL)
+        yield content, images
+
+
+def label_sheet(queryset, workers=None):
+    """
+    Yield the PDF label sheet of `queryset` (from label_queryset()) in
+    chunks, rendered in the shared pool, or in `workers` processes of its
+    own if given.
+    """
+    pool = None
+    if workers is None:
+        pool, workers = shared_pool()
+    pending = deque()
+    return write_sheet(_store_bitmaps(render_pages(_pages(queryset, pending), workers, pool), pending))
@@ -0,0 +1,86 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from clients.models import Client
+from instruments.models import InstrumentCategory
+from instruments.services import AllocationError, allocate_rental
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent rental allocations from one category for the same dates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('client', type=int, help='Client the benchmark orders are created for.')
+        parser.add_argument('category', type=int, help='Category to allocate from.')
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument('--quantity', type=int, default=1, help='Instruments per allocation.')
+        parser.add_argument('--days', type=int, default=14, help='Rental length.')
+        parser.add_argument('--start-in', type=int, default=365,
+                            help='Days from today the rentals start, away from real bookings.')
+
+    def handle(self, *args, **options):
+        try:
+            client = Client.objects.get(pk=options['client'])
+        except Client.DoesNotExist:
+            raise CommandError(f"Client {options['client']} does not exist.")
+        if not InstrumentCategory.objects.filter(pk=options['category']).exists():
+            raise CommandError(f"Category {options['category']} does not exist.")
+
+        start = timezone.localdate() + timedelta(days=options['start_in'])
+        end = start + timedelta(days=options['days'] - 1)
+        results = []
+        failures = []
+        lock = threading.Lock()
+
+        def worker():
+            started = time.perf_counter()
+            try:
+                order, instrument_ids = allocate_rental(client, options['category'], options['quantity'], start, end)
+            except AllocationError as e:
+                with lock:
+                    failures.append((time.perf_counter() - started, str(e)))
+            else:
+                with lock:
+                    results.append((time.perf_counter() - started, order, instrument_ids))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        allocated = [pk for latency, order, instrument_ids in results for pk in instrument_ids]
+        double_booked = len(allocated) - len(set(allocated))
+        latencies = sorted(latency for latency, *rest in results + failures)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else 0
+
+        self.stdout.write(
+            f"{len(results)} allocations, {len(failures)} refused, from {options['threads']} threads "
+            f"in {elapsed:.2f}s (budget {settings.ALLOCATION_BUDGET_SECONDS}s)"
+        )
+        self.stdout.write(
+            f"Latency p50 {percentile(0.5):.0f} ms, p95 {percentile(0.95):.0f} ms, max {percentile(1):.0f} ms"
+        )
+        self.stdout.write(f"Double-booked instruments: {double_booked}")
+        for latency, reason in failures:
+            self.stdout.write(f"Refused after {latency * 1000:.0f} ms: {reason}")
+
+        # Clean up benchmark data
+        for latency, order, instrument_ids in results:
+            order.delete()
+
+        if double_booked:
+            raise CommandError('Benchmark detected double-booked instruments.')
+        self.stdout.write(self.style.SUCCESS('No instrument was booked twice.'))
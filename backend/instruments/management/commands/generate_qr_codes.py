@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from instruments import qr
+from instruments.models import Instrument
+
+
+class Command(BaseCommand):
+    help = "Generate the QR codes of instruments whose code is missing or out of date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, help='Only instruments of this category id.')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the work for the background workers instead of running it here.')
+
+    def handle(self, *args, **options):
+        queryset = Instrument.objects.all()
+        if options['category']:
+            queryset = queryset.filter(category_id=options['category'])
+
+        started = time.perf_counter()
+        ids = list(qr.stale(queryset))
+        if options['background']:
+            qr.schedule(ids)
+            self.stdout.write(self.style.SUCCESS(f"Queued {len(ids)} QR codes."))
+            return
+
+        written = qr.generate(ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {written} of {len(ids)} QR codes in {time.perf_counter() - started:.1f}s."
+        ))
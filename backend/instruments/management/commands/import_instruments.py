@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from instruments.imports import IMPORT_FORMATS, InstrumentImport, guess_format, read_instruments
+
+
+class Command(BaseCommand):
+    help = 'Bulk import instruments from a CSV or XLSX file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Instrument file, or '-' for CSV on standard input.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='File format (guessed from the file name by default).')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--report', help='Write rejected rows to this CSV file.')
+        parser.add_argument('--create-categories', action='store_true',
+                            help='Create categories that do not exist yet instead of rejecting their rows.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or ('csv' if path == '-' else guess_format(path))
+
+        started = time.perf_counter()
+        report = open(options['report'], 'w', newline='') if options['report'] else None
+        try:
+            importer = InstrumentImport(
+                chunk_size=options['chunk_size'],
+                errors=report,
+                create_categories=options['create_categories'],
+            )
+            try:
+                if path == '-':
+                    stats = importer.run(read_instruments(sys.stdin.buffer, import_format))
+                else:
+                    try:
+                        stream = open(path, 'rb')
+                    except OSError as e:
+                        raise CommandError(f"Cannot open instrument file: {e}")
+                    with stream:
+                        stats = importer.run(read_instruments(stream, import_format))
+            except ValueError as e:
+                raise CommandError(f"Cannot read the instrument file: {e}")
+        finally:
+            if report is not None:
+                report.close()
+
+        self.stdout.write(
+            f"{stats.get('rows', 0)} rows: {stats.get('created', 0)} instruments created, "
+            f"{stats.get('rejected', 0)} rejected, {stats.get('categories_created', 0)} categories created "
+            f"in {time.perf_counter() - started:.1f}s."
+        )
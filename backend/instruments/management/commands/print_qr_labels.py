@@ -0,0 +1,38 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from instruments.labels import label_queryset, label_sheet
+from instruments.models import Instrument
+
+
+class Command(BaseCommand):
+    help = "Write a printable PDF sheet of QR labels for the matching instruments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the PDF to write.')
+        parser.add_argument('--category', type=int, help='Category id.')
+        parser.add_argument('--status', choices=[value for value, label in Instrument.STATUS_CHOICES])
+        parser.add_argument('--serial-from', help='First serial number (inclusive).')
+        parser.add_argument('--serial-to', help='Last serial number (inclusive).')
+        parser.add_argument('--workers', type=int, help='Rendering processes (default: CPU count).')
+
+    def handle(self, *args, **options):
+        instruments = label_queryset(
+            category=options['category'],
+            status=options['status'],
+            serial_from=options['serial_from'],
+            serial_to=options['serial_to'],
+        )
+        count = instruments.count()
+        if not count:
+            raise CommandError("No instruments match these filters.")
+
+        started = time.perf_counter()
+        with open(options['output'], 'wb') as output:
+            for chunk in label_sheet(instruments, workers=options['workers'] or os.cpu_count() or 1):
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} labels to {options['output']} in {time.perf_counter() - started:.1f}s."
+        ))
@@ -1,8 +1,5 @@
 from django.db import models
 import uuid
-import qrcode
-from io import BytesIO
-from django.core.files import File
 from PIL import Image
 
 
@@ -55,25 +52,6 @@ class Instrument(models.Model):
     
     def __str__(self):
         return f"{self.name} ({self.serial_number})"
-    
-    def save(self, *args, **kwargs):
-        # Generate QR code if it doesn't exist
-        if not self.qr_code:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(f"Instrument: {self.name}\nSerial: {self.serial_number}")
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = BytesIO()
-            img.save(buffer, format="PNG")
-            self.qr_code.save(f"qr_{self.serial_number}.png", File(buffer), save=False)
-        
-        super().save(*args, **kwargs)
 
 
 class InstrumentMaintenance(models.Model):
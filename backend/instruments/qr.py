@@ -0,0 +1,222 @@
+"""
+Instrument QR codes.
+
+Saving an instrument doesn't draw its QR code: the post_save receiver
+schedules the instruments whose code is missing or out of date, and once
+the transaction commits they are handed to a worker (Celery, or a local
+thread when no broker is reachable) in batches of QR_CODE_BATCH_SIZE.
+
+A code only encodes the instrument's name and serial number, and its file
+name carries a hash of the two. An instrument whose stored file has the
+hash of its current name and serial is up to date, so saves that change
+anything else generate nothing, and a file already stored for the same
+content is reused instead of drawn again.
+
+image() renders other sizes and SVG on request, keeping the most recent
+QR_CODE_CACHE_SIZE renderings in memory.
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from hospital_management.background import submit
+from .models import Instrument
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+MIN_SIZE = 64
+MAX_SIZE = 2048
+
+_pending = threading.local()
+
+
+def content(name, serial_number):
+    """The text a QR code encodes."""
+    return f"Instrument: {name}\nSerial: {serial_number}"
+
+
+def content_hash(name, serial_number):
+    return hashlib.sha256(content(name, serial_number).encode()).hexdigest()[:16]
+
+
+def _code(name, serial_number, box_size=10, border=4):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(content(name, serial_number))
+    qr.make(fit=True)
+    return qr
+
+
+def render(name, serial_number, box_size=10, border=4):
+    """The QR code of an instrument's name and serial number as a PIL image."""
+    return _code(name, serial_number, box_size, border).make_image(fill_color="black", back_color="white")
+
+
+def render_png(name, serial_number, box_size=10, border=4):
+    buffer = BytesIO()
+    render(name, serial_number, box_size, border).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=getattr(settings, 'QR_CODE_CACHE_SIZE', 512))
+def _image(name, serial_number, size, format):
+    qr = _code(name, serial_number)
+    if size:
+        # Whole pixels per module, as close to the requested width as possible
+        qr.box_size = max(1, round(size / (qr.modules_count + 2 * qr.border)))
+    if format == 'svg':
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+def options(size=None, format='png'):
+    """
+    Validated rendering options: a width in pixels, clamped to
+    MIN_SIZE..MAX_SIZE, and a format. SVG scales, so it has no size.
+    """
+    format = (format or 'png').lower()
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}.")
+    if format == 'svg' or size in (None, ''):
+        return None, format
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ValueError("size must be a number of pixels.")
+    return min(max(size, MIN_SIZE), MAX_SIZE), format
+
+
+def image(name, serial_number, size=None, format='png'):
+    """
+    The QR code as bytes in `format`, about `size` pixels wide (None for
+    the stored size). Takes options() output.
+    """
+    return _image(name, serial_number, size, format)
+
+
+def etag(name, serial_number, size=None, format='png'):
+    """A strong ETag for image(): the content hash and the rendering options."""
+    return f'"{content_hash(name, serial_number)}-{size or 0}-{format}"'
+
+
+def _encodes(stored_name, name, serial_number):
+    if not stored_name:
+        return False
+    stem = os.path.splitext(os.path.basename(stored_name))[0]
+    return content_hash(name, serial_number) in stem
+
+
+def is_current(instrument):
+    """Whether the instrument's stored QR code encodes its name and serial number."""
+    return _encodes(instrument.qr_code.name, instrument.name, instrument.serial_number)
+
+
+def schedule(instrument_ids):
+    """Generate the instruments' QR codes in the background once the transaction commits."""
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(instrument_ids)
+    transaction.on_commit(_flush)
+
+
+def _flush():
+    # Every callback of a commit runs this; the first one sends the batches
+    from .tasks import generate_qr_codes
+
+    ids = sorted(getattr(_pending, 'ids', None) or ())
+    _pending.ids = None
+    batch_size = getattr(settings, 'QR_CODE_BATCH_SIZE', BATCH_SIZE)
+    workers = getattr(settings, 'QR_CODE_WORKERS', 2)
+    for start in range(0, len(ids), batch_size):
+        submit(generate_qr_codes, ids[start:start + batch_size], workers=workers)
+
+
+def _store(instrument):
+    field = instrument.qr_code
+    name = field.field.generate_filename(
+        instrument,
+        f"qr_{instrument.serial_number}_{content_hash(instrument.name, instrument.serial_number)}.png",
+    )
+    if field.storage.exists(name):
+        return name, False
+    data = render_png(instrument.name, instrument.serial_number)
+    return field.storage.save(name, ContentFile(data)), True
+
+
+def write(instrument):
+    """
+    Store the QR code of the instrument's current name and serial number
+    and point the instrument at it. Returns False if the instrument changed
+    in the meantime; its save scheduled another run.
+    """
+    old = instrument.qr_code.name if instrument.qr_code else None
+    name, created = _store(instrument)
+    updated = Instrument.objects.filter(
+        pk=instrument.pk, name=instrument.name, serial_number=instrument.serial_number,
+    ).update(qr_code=name)
+
+    storage = instrument.qr_code.storage
+    if not updated:
+        if created:
+            storage.delete(name)
+        return False
+    if old and old != name:
+        storage.delete(old)
+    return True
+
+
+def generate(instrument_ids):
+    """Bring the given instruments' QR codes up to date. Returns how many were written."""
+    instrument_ids = list(instrument_ids)
+    written = 0
+    for start in range(0, len(instrument_ids), BATCH_SIZE):
+        instruments = Instrument.objects.filter(pk__in=instrument_ids[start:start + BATCH_SIZE]).only(
+            'pk', 'name', 'serial_number', 'qr_code',
+        )
+        for instrument in instruments:
+            if is_current(instrument):
+                continue
+            try:
+                written += write(instrument)
+            except Exception:
+                logger.exception("Generating the QR code of instrument %s failed", instrument.pk)
+    return written
+
+
+def stale(queryset=None, batch_size=1000):
+    """Ids of the instruments (of `queryset`) whose QR code is missing or out of date."""
+    queryset = (queryset if queryset is not None else Instrument.objects.all()).order_by('pk')
+    last = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last).values_list('pk', 'name', 'serial_number', 'qr_code')[:batch_size])
+        if not batch:
+            return
+        for pk, name, serial_number, qr_code in batch:
+            if not _encodes(qr_code, name, serial_number):
+                yield pk
+        last = batch[-1][0]
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from clients.models import Client
+from hospital_management.eager_loading import EagerLoadingMixin
+from hospital_management.thumbnails import ThumbnailsField
 from .models import InstrumentCategory, Instrument, InstrumentMaintenance
 
 
@@ -14,14 +17,17 @@ class InstrumentMaintenanceSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class InstrumentSerializer(serializers.ModelSerializer):
+class InstrumentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     category_name = serializers.ReadOnlyField(source='category.name')
     qr_code_url = serializers.SerializerMethodField()
+    image_thumbnails = ThumbnailsField(source='image')
+    
+    select_related_fields = ('category',)
     
     class Meta:
         model = Instrument
         fields = '__all__'
-        extra_fields = ['category_name', 'qr_code_url']
+        extra_fields = ['category_name', 'qr_code_url', 'image_thumbnails']
     
     def get_qr_code_url(self, obj):
         if obj.qr_code:
@@ -33,13 +39,27 @@ class InstrumentDetailSerializer(serializers.ModelSerializer):
     category = InstrumentCategorySerializer(read_only=True)
     maintenance_records = InstrumentMaintenanceSerializer(many=True, read_only=True)
     qr_code_url = serializers.SerializerMethodField()
+    image_thumbnails = ThumbnailsField(source='image')
     
     class Meta:
         model = Instrument
         fields = '__all__'
-        extra_fields = ['maintenance_records', 'qr_code_url']
+        extra_fields = ['maintenance_records', 'qr_code_url', 'image_thumbnails']
     
     def get_qr_code_url(self, obj):
         if obj.qr_code:
             return self.context['request'].build_absolute_uri(obj.qr_code.url)
-        return None 
\ No newline at end of file
+        return None 
+
+
+class InstrumentAllocationSerializer(serializers.Serializer):
+    client = serializers.PrimaryKeyRelatedField(queryset=Client.objects.all())
+    category = serializers.PrimaryKeyRelatedField(queryset=InstrumentCategory.objects.all())
+    quantity = serializers.IntegerField(min_value=1, max_value=500)
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    
+    def validate(self, attrs):
+        if attrs['end_date'] < attrs['start_date']:
+            raise serializers.ValidationError({"end_date": "End date must not be before start date."})
+        return attrs
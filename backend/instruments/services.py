@@ -0,0 +1,242 @@
+"""
+Set-based instrument status changes and rental allocation.
+
+Orders move all of their instruments in one conditional UPDATE instead of
+saving each instrument, so the row is only changed when it is still in the
+expected status. Instruments taken by a concurrent order are reported back
+as conflicts rather than being silently double-booked.
+
+allocate_rental() picks N instruments of a category that are free for a
+date range and books them on a new rental order. Whether an instrument is
+free depends on its bookings, not on its status: an instrument rented in
+January can be allocated for February. Candidates come from the
+availability index, and the bookings of the picked rows are checked
+again in the database once the rows are locked. Rows are locked with
+SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, so
+concurrent allocators take different instruments instead of queueing on
+the same rows; on SQLite allocations in a process are serialized, and
+SQLite's own write lock fails the loser of a race across processes.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from hospital_management.table_versions import touch
+from .availability import UNAVAILABLE_STATUSES, booking_items, index as availability_index
+from .models import Instrument
+
+
+# Status an instrument moves to when it is placed on an order of each type
+ORDER_TYPE_STATUSES = {
+    'sale': 'sold',
+    'rental': 'rented',
+    'storage': 'stored',
+}
+
+StatusTransition = namedtuple('StatusTransition', ['updated', 'conflicts'])
+
+
+def transition_status(instrument_ids, to_status, from_statuses=('available',)):
+    """
+    Move instruments currently in one of `from_statuses` to `to_status`.
+
+    Returns a StatusTransition with the ids that were changed and the ids
+    that were not in an expected status (e.g. rented by another order).
+    """
+    ids = set(instrument_ids)
+    if not ids:
+        return StatusTransition([], [])
+
+    # The timestamp marks the rows changed by this statement
+    marker = timezone.now()
+    count = Instrument.objects.filter(pk__in=ids, status__in=from_statuses).update(
+        status=to_status,
+        updated_at=marker,
+    )
+    if count:
+        touch(Instrument)
+
+    if count == len(ids):
+        return StatusTransition(sorted(ids), [])
+
+    updated = set(
+        Instrument.objects.filter(pk__in=ids, status=to_status, updated_at=marker)
+        .values_list('pk', flat=True)
+    )
+    return StatusTransition(sorted(updated), sorted(ids - updated))
+
+
+def _order_instrument_ids(order):
+    return order.items.values_list('instrument_id', flat=True)
+
+
+def reserve_for_order(order):
+    """Mark the instruments on a new order as sold, rented or stored."""
+    return transition_status(
+        _order_instrument_ids(order),
+        ORDER_TYPE_STATUSES[order.order_type],
+    )
+
+
+def release_for_order(order):
+    """Return the instruments on a cancelled order to the available pool."""
+    return transition_status(
+        _order_instrument_ids(order),
+        'available',
+        from_statuses=(ORDER_TYPE_STATUSES[order.order_type],),
+    )
+
+
+class AllocationError(Exception):
+    """Raised when the requested number of instruments can't be reserved."""
+
+
+class AllocationConflict(Exception):
+    """Instruments picked by an allocation were taken by a concurrent one."""
+
+    def __init__(self, instrument_ids):
+        super().__init__(instrument_ids)
+        self.instrument_ids = instrument_ids
+
+
+# Serializes allocations on databases without SELECT ... FOR UPDATE SKIP LOCKED
+_allocation_lock = threading.Lock()
+
+# Seconds between allocation attempts, doubled per attempt up to the maximum, with jitter
+BACKOFF_BASE = 0.005
+BACKOFF_MAX = 0.1
+
+
+def _rentable(queryset):
+    return queryset.exclude(status__in=UNAVAILABLE_STATUSES)
+
+
+def _free_instruments(category_id, start_date, end_date, exclude):
+    """Ids of rentable instruments in a category with no overlapping booking in the index."""
+    candidates = list(
+        _rentable(Instrument.objects.filter(category_id=category_id))
+        .exclude(pk__in=exclude)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
+    booked = availability_index.booked(candidates, start_date, end_date)
+    return [pk for pk in candidates if pk not in booked]
+
+
+def _booked(instrument_ids, start_date, end_date):
+    """Ids of the given instruments with a booking overlapping the range, read from the database."""
+    from orders.models import OrderItem
+
+    return set(
+        booking_items(OrderItem.objects.filter(instrument_id__in=instrument_ids))
+        .filter(Q(rental_end_date__isnull=True) | Q(rental_end_date__gte=start_date), rental_start_date__lte=end_date)
+        .values_list('instrument_id', flat=True)
+    )
+
+
+def _reserve(client, category_id, quantity, start_date, end_date, created_by, exclude):
+    from orders.models import Order, OrderItem
+
+    free = _free_instruments(category_id, start_date, end_date, exclude)
+    if len(free) < quantity:
+        raise AllocationError(f"Only {len(free)} instruments are available in this category for these dates.")
+
+    locked = _rentable(Instrument.objects.filter(pk__in=free)).order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        # Rows locked by concurrent allocators are skipped, not waited on
+        locked = locked.select_for_update(skip_locked=True, of=('self',))
+    prices = dict(locked.values_list('pk', 'rental_price_per_day')[:quantity])
+    if len(prices) < quantity:
+        raise AllocationConflict(set(free) - set(prices))
+
+    # The index may not have seen a booking committed just before the lock was taken
+    taken = _booked(prices.keys(), start_date, end_date)
+    if taken:
+        raise AllocationConflict(taken)
+
+    if start_date <= timezone.localdate():
+        # The rental is under way; later ones leave the status to the order's lifecycle
+        transition = transition_status(
+            prices.keys(), ORDER_TYPE_STATUSES['rental'], from_statuses=('available', 'rented'),
+        )
+        if transition.conflicts:
+            raise AllocationConflict(set(transition.conflicts))
+
+    duration = (end_date - start_date).days + 1
+    items = []
+    for instrument_id, price in prices.items():
+        item = OrderItem(
+            instrument_id=instrument_id,
+            quantity=1,
+            unit_price=price,
+            rental_start_date=start_date,
+            rental_end_date=end_date,
+            rental_duration_days=duration,
+        )
+        item.subtotal = item.calculate_subtotal('rental')
+        items.append(item)
+
+    order = Order.objects.create(
+        client=client,
+        order_type='rental',
+        status='pending',
+        delivery_date=start_date,
+        total_amount=sum(item.subtotal for item in items),
+        tax_amount=0,
+        created_by=created_by,
+    )
+    for item in items:
+        item.order = order
+    OrderItem.objects.bulk_create(items)
+    touch(OrderItem)
+    return order, sorted(prices)
+
+
+def _back_off(attempt, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise AllocationError('Could not reserve the instruments within the time budget; please retry.')
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+    time.sleep(min(delay, remaining))
+
+
+def allocate_rental(client, category_id, quantity, start_date, end_date, created_by=None, budget=None):
+    """
+    Reserve `quantity` instruments of a category that are free from
+    `start_date` to `end_date` by creating a pending rental order for them.
+
+    Instruments lost to concurrent allocators are skipped and the selection
+    is retried, backing off a little longer each time, until `budget`
+    seconds (ALLOCATION_BUDGET_SECONDS) have passed. Returns the order and
+    the reserved instrument ids.
+    """
+    if budget is None:
+        budget = getattr(settings, 'ALLOCATION_BUDGET_SECONDS', 2.0)
+    deadline = time.monotonic() + budget
+    exclude = set()
+    serialize = not connection.features.has_select_for_update_skip_locked
+
+    attempt = 0
+    while True:
+        try:
+            if serialize:
+                _allocation_lock.acquire()
+            try:
+                with transaction.atomic():
+                    return _reserve(client, category_id, quantity, start_date, end_date, created_by, exclude)
+            finally:
+                if serialize:
+                    _allocation_lock.release()
+        except AllocationConflict as conflict:
+            exclude |= conflict.instrument_ids
+        except OperationalError:
+            # e.g. SQLite "database is locked" while another process allocates
+            pass
+        _back_off(attempt, deadline)
+        attempt += 1
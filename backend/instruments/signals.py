@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import qr
+from .models import Instrument
+
+
+@receiver(post_save, sender=Instrument)
+def schedule_qr_code(sender, instance, raw=False, **kwargs):
+    """Draw the instrument's QR code in the background if it is missing or out of date."""
+    if raw or qr.is_current(instance):
+        return
+    qr.schedule([instance.pk])
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from . import qr
+
+
+@shared_task(name='instruments.generate_qr_codes')
+def generate_qr_codes(instrument_ids):
+    return qr.generate(instrument_ids)
@@ -1,3 +1,322 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.db.models.functions import Lower
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from accounts.models import User
+from clients.models import Client
+from hospital_management import private_files, thumbnails
+from hospital_management.pagination import KeysetPagination
+from hospital_management.testing import QueryCountMixin
+from . import qr
+from .availability import index as availability_index
+from .imports import ERROR_REPORT_DIR
+from .models import Instrument, InstrumentCategory, InstrumentMaintenance
+from .services import AllocationError, allocate_rental
+
+
+class ListQueryCountTests(QueryCountMixin, TestCase):
+    """List endpoints read a page in the same number of queries whatever its size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        for i in range(6):
+            category = InstrumentCategory.objects.create(name=f'Category {i}')
+            instrument = Instrument.objects.create(
+                name=f'Monitor {i}', serial_number=f'SN{i}', category=category, purchase_date=date(2026, 1, 1),
+                purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+            )
+            InstrumentMaintenance.objects.create(
+                instrument=instrument, maintenance_date=date(2026, 3, 1), description='Calibration',
+                performed_by='Technician', cost=Decimal('20'),
+            )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def test_instrument_list(self):
+        self.assertFixedQueryCount(reverse('instrument-list'))
+
+    def test_instrument_list_keyset(self):
+        self.assertFixedQueryCount(reverse('instrument-list') + '?pagination=keyset')
+
+    def test_maintenance_list(self):
+        self.assertFixedQueryCount(reverse('instrument-maintenance-list'))
+
+
+class KeysetNullOrderingTests(TestCase):
+    """Keyset pages over a nullable ordering field cover every row once."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        category = InstrumentCategory.objects.create(name='Imaging')
+        instrument = Instrument.objects.create(
+            name='Monitor', serial_number='SN1', category=category, purchase_date=date(2026, 1, 1),
+            purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+        )
+        for i in range(7):
+            InstrumentMaintenance.objects.create(
+                instrument=instrument, maintenance_date=date(2026, 3, 1), description='Calibration',
+                performed_by='Technician', cost=Decimal('20'),
+                next_maintenance_date=date(2026, 6, i % 3 + 1) if i % 2 else None,
+            )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def walk(self, url):
+        ids = []
+        with mock.patch.object(KeysetPagination, 'page_size', 2):
+            while url:
+                response = self.api.get(url)
+                self.assertEqual(response.status_code, 200)
+                ids.extend(row['id'] for row in response.data['results'])
+                url = response.data['next']
+            return ids
+
+    def test_ascending(self):
+        ids = self.walk(reverse('instrument-maintenance-list') + '?pagination=keyset&ordering=next_maintenance_date')
+        self.assertCountEqual(ids, InstrumentMaintenance.objects.values_list('pk', flat=True))
+        dates = list(InstrumentMaintenance.objects.in_bulk(ids)[pk].next_maintenance_date for pk in ids)
+        self.assertEqual(dates[-4:], [None] * 4)
+
+    def test_descending(self):
+        ids = self.walk(reverse('instrument-maintenance-list') + '?pagination=keyset&ordering=-next_maintenance_date')
+        self.assertCountEqual(ids, InstrumentMaintenance.objects.values_list('pk', flat=True))
+        dates = list(InstrumentMaintenance.objects.in_bulk(ids)[pk].next_maintenance_date for pk in ids)
+        self.assertEqual(dates[:4], [None] * 4)
+
+    def test_previous(self):
+        url = reverse('instrument-maintenance-list') + '?pagination=keyset&ordering=next_maintenance_date'
+        with mock.patch.object(KeysetPagination, 'page_size', 2):
+            pages = []
+            while url:
+                response = self.api.get(url)
+                pages.append([row['id'] for row in response.data['results']])
+                url = response.data['next']
+            previous = self.api.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in previous.data['results']], pages[-2])
+
+
+class KeysetExpressionOrderingTests(TestCase):
+    """Keyset pagination refuses orderings it can't keep in its cursors."""
+
+    def test_expression_ordering(self):
+        request = Request(APIRequestFactory().get('/', {'pagination': 'keyset'}))
+        queryset = Instrument.objects.order_by(Lower('name').asc(), 'pk')
+        with self.assertRaises(ParseError):
+            KeysetPagination().paginate_queryset(queryset, request)
+
+
+class ImportErrorReportTests(TestCase):
+    """Bulk import error reports are private, staff-only and expire."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        InstrumentCategory.objects.create(name='Imaging')
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(PRIVATE_FILES_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def upload(self, serial_number='SN1'):
+        content = (
+            'name,serial_number,category,purchase_date,purchase_price,rental_price_per_day,selling_price\n'
+            f'Monitor,{serial_number},Imaging,2026-01-01,1000,10,1500\n'
+            'Pump,SN2,Unknown,2026-01-01,1000,10,1500\n'
+        )
+        response = self.api.post(reverse('instrument-bulk-import'), {
+            'file': SimpleUploadedFile('instruments.csv', content.encode()),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 1)
+        return response.data['error_report']
+
+    def test_download(self):
+        url = self.upload()
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Unknown category: Unknown', b''.join(response.streaming_content))
+        self.assertEqual(APIClient().get(url).status_code, 401)
+        self.assertEqual(self.api.get(reverse('instrument-import-errors', args=['x' * 32])).status_code, 404)
+
+    def test_expiry(self):
+        url = self.upload()
+        with override_settings(PRIVATE_FILE_MAX_AGE=-1):
+            self.assertEqual(self.api.get(url).status_code, 404)
+            self.upload('SN3')
+        self.assertEqual(len(private_files.storage.listdir(ERROR_REPORT_DIR)[1]), 1)
+
+
+class ThumbnailTests(TestCase):
+    """Renditions are made only for images an instrument still has."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = InstrumentCategory.objects.create(name='Imaging')
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch.object(qr, 'schedule')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.instrument = Instrument.objects.create(
+            name='Monitor', serial_number='SN1', category=self.category, purchase_date=date(2026, 1, 1),
+            purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+            image=self.photo('monitor.jpg'),
+        )
+
+    def photo(self, filename):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), 'navy').save(buffer, 'JPEG')
+        return SimpleUploadedFile(filename, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_rendition(self):
+        name = self.instrument.image.name
+        response = self.client.get(thumbnails.url(name, 'list'))
+
+        self.assertEqual(response.status_code, 302)
+        with default_storage.open(thumbnails.rendition_name(name, 'list')) as f:
+            self.assertEqual(Image.open(f).size, (160, 120))
+
+    def test_replaced_image(self):
+        old_name = self.instrument.image.name
+        old_url = thumbnails.url(old_name, 'list')
+        self.assertEqual(self.client.get(old_url).status_code, 302)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.instrument.image = self.photo('monitor-2.jpg')
+            self.instrument.save()
+
+        self.assertFalse(default_storage.exists(thumbnails.rendition_name(old_name, 'list')))
+        # The old original is still stored, but its renditions aren't made again
+        self.assertTrue(default_storage.exists(old_name))
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+        self.assertFalse(default_storage.exists(thumbnails.rendition_name(old_name, 'list')))
+        self.assertEqual(self.client.get(thumbnails.url(self.instrument.image.name, 'list')).status_code, 302)
+
+
+class AllocationTests(TestCase):
+    """Rental allocation books instruments by date range, not by their current status."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(email='client@example.com', password='password')
+        cls.client_record = Client.objects.create(
+            user=user, hospital_name='Hospital', hospital_type='private', registration_number='REG1',
+        )
+        cls.category = InstrumentCategory.objects.create(name='Ventilators')
+        cls.instruments = [
+            Instrument.objects.create(
+                name=f'Ventilator {i}', serial_number=f'V{i}', category=cls.category, purchase_date=date(2026, 1, 1),
+                purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        availability_index.rebuild()
+
+    def allocate(self, start, end, quantity=2):
+        with self.captureOnCommitCallbacks(execute=True):
+            order, instrument_ids = allocate_rental(self.client_record, self.category.pk, quantity, start, end)
+        return instrument_ids
+
+    def test_non_overlapping_ranges(self):
+        ids = sorted(instrument.pk for instrument in self.instruments)
+        self.assertEqual(self.allocate(date(2027, 1, 1), date(2027, 1, 10)), ids)
+        self.assertEqual(self.allocate(date(2027, 2, 1), date(2027, 2, 10)), ids)
+        self.assertEqual(self.allocate(date(2027, 1, 11), date(2027, 1, 31)), ids)
+        # Future rentals don't change the status
+        self.assertEqual(set(Instrument.objects.values_list('status', flat=True)), {'available'})
+
+    def test_overlapping_ranges(self):
+        self.allocate(date(2027, 1, 1), date(2027, 1, 10), quantity=1)
+        self.assertEqual(len(self.allocate(date(2027, 1, 10), date(2027, 1, 20), quantity=1)), 1)
+        with self.assertRaises(AllocationError):
+            self.allocate(date(2027, 1, 8), date(2027, 1, 12), quantity=1)
+
+    def test_booking_the_index_has_not_seen(self):
+        allocate_rental(self.client_record, self.category.pk, 2, date(2027, 1, 1), date(2027, 1, 10))
+        with self.assertRaises(AllocationError):
+            allocate_rental(self.client_record, self.category.pk, 1, date(2027, 1, 5), date(2027, 1, 6), budget=0.5)
+
+    def test_rented_instrument_free_later(self):
+        Instrument.objects.filter(pk=self.instruments[0].pk).update(status='rented')
+        Instrument.objects.filter(pk=self.instruments[1].pk).update(status='maintenance')
+        self.assertEqual(self.allocate(date(2027, 2, 1), date(2027, 2, 10), quantity=1), [self.instruments[0].pk])
+
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    """Concurrent allocators for the same dates get disjoint instruments within the budget."""
+
+    def test_concurrent_allocators(self):
+        user = User.objects.create_user(email='client@example.com', password='password')
+        client = Client.objects.create(
+            user=user, hospital_name='Hospital', hospital_type='private', registration_number='REG1',
+        )
+        category = InstrumentCategory.objects.create(name='Ventilators')
+        # bulk_create: no QR codes drawn in the background meanwhile
+        Instrument.objects.bulk_create([
+            Instrument(
+                name=f'Ventilator {i}', serial_number=f'V{i}', category=category, purchase_date=date(2026, 1, 1),
+                purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+            )
+            for i in range(16)
+        ])
+        availability_index.rebuild()
+
+        results = []
+        errors = []
+
+        def allocate():
+            started = time.perf_counter()
+            try:
+                order, ids = allocate_rental(client, category.pk, 2, date(2027, 1, 1), date(2027, 1, 14), budget=5)
+                results.append((ids, time.perf_counter() - started))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=allocate) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 2, errors)
+        self.assertTrue(all(isinstance(error, AllocationError) for error in errors))
+        allocated = [pk for ids, elapsed in results for pk in ids]
+        self.assertEqual(len(allocated), 16)
+        self.assertEqual(len(set(allocated)), 16)
+        self.assertLess(max(elapsed for ids, elapsed in results), 5)
@@ -3,16 +3,29 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
-import qrcode
-from io import BytesIO
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+import time
 
 from .models import InstrumentCategory, Instrument, InstrumentMaintenance
 from .serializers import (
     InstrumentCategorySerializer, InstrumentSerializer, 
-    InstrumentDetailSerializer, InstrumentMaintenanceSerializer
+    InstrumentDetailSerializer, InstrumentMaintenanceSerializer,
+    InstrumentAllocationSerializer
 )
+from .services import AllocationError, allocate_rental
+from .availability import index as availability_index, UNAVAILABLE_STATUSES
+from .imports import IMPORT_FORMATS, error_report, guess_format, import_upload
+from .labels import label_queryset, label_sheet
+from . import qr
 from accounts.permissions import IsAdminOrStaff, IsAdminOrStaffOrReadOnly
+from hospital_management.downloads import serve_file
+from hospital_management.eager_loading import eager_load
+from hospital_management.pagination import KeysetOrPageNumberPagination
 
 
 class InstrumentCategoryViewSet(viewsets.ModelViewSet):
@@ -28,6 +41,7 @@ class InstrumentViewSet(viewsets.ModelViewSet):
     queryset = Instrument.objects.all()
     permission_classes = [IsAdminOrStaffOrReadOnly]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['status', 'category']
     search_fields = ['name', 'serial_number', 'description', 'manufacturer']
     ordering_fields = ['name', 'purchase_date', 'purchase_price', 'rental_price_per_day', 'selling_price']
@@ -37,31 +51,195 @@ class InstrumentViewSet(viewsets.ModelViewSet):
             return InstrumentDetailSerializer
         return InstrumentSerializer
     
+    def get_queryset(self):
+        return eager_load(Instrument.objects.all(), self.get_serializer_class())
+    
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({"request": self.request})
         return context
     
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= picks the image format of qr_code, not a renderer
+        return super().perform_content_negotiation(request, force=force or self.action == 'qr_code')
+    
     @action(detail=True, methods=['get'])
     def qr_code(self, request, pk=None):
-        """Generate and return a QR code for the instrument."""
+        """
+        Return the instrument's QR code: the stored PNG, or a rendering
+        about `size` pixels wide and/or in another `format` (png, svg).
+        
+        Responses carry a strong ETag of the code's content, so polling
+        clients get 304 Not Modified until the name or serial changes.
+        """
         instrument = self.get_object()
         
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
+        try:
+            size, image_format = qr.options(request.query_params.get('size'), request.query_params.get('format'))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        etag = qr.etag(instrument.name, instrument.serial_number, size, image_format)
+        
+        if size is None and image_format == 'png' and qr.is_current(instrument):
+            response = serve_file(request, instrument.qr_code, content_type=qr.FORMATS['png'],
+                                  etag=etag, as_attachment=False)
+        else:
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(
+                    qr.image(instrument.name, instrument.serial_number, size, image_format),
+                    content_type=qr.FORMATS[image_format],
+                )
+            response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdminOrStaff])
+    def labels(self, request):
+        """
+        Stream a printable PDF sheet of QR labels for the instruments
+        matching `category` (id), `status` and the serial number range
+        `serial_from`..`serial_to` (inclusive).
+        """
+        params = request.query_params
+        category = params.get('category')
+        status_value = params.get('status')
+        if category and not category.isdigit():
+            return Response({"detail": "category must be a category id."}, status=status.HTTP_400_BAD_REQUEST)
+        if status_value and status_value not in dict(Instrument.STATUS_CHOICES):
+            return Response({"detail": f"Unknown status: {status_value}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        instruments = label_queryset(
+            category=category,
+            status=status_value,
+            serial_from=params.get('serial_from'),
+            serial_to=params.get('serial_to'),
+        )
+        if not instruments.exists():
+            return Response({"detail": "No instruments match these filters."}, status=status.HTTP_404_NOT_FOUND)
+        
+        response = StreamingHttpResponse(label_sheet(instruments), content_type='application/pdf')
+        response['Content-Disposition'] = 'attachment; filename="qr-labels.pdf"'
+        return response
+    
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """
+        List which instruments are free to rent between start_date and end_date.
+        
+        Accepts the list filters (status, category, search) and an optional
+        comma-separated `instruments` list of ids.
+        """
+        try:
+            start_date = parse_date(request.query_params.get('start_date', ''))
+            end_date = parse_date(request.query_params.get('end_date', ''))
+        except ValueError:
+            start_date = end_date = None
+        
+        if not start_date or not end_date or end_date < start_date:
+            return Response(
+                {"detail": "Valid start_date and end_date (YYYY-MM-DD) are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        
+        instrument_ids = request.query_params.get('instruments')
+        if instrument_ids:
+            try:
+                queryset = queryset.filter(pk__in=[int(pk) for pk in instrument_ids.split(',') if pk])
+            except ValueError:
+                return Response(
+                    {"detail": "instruments must be a comma-separated list of ids."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        candidates = list(
+            queryset.exclude(status__in=UNAVAILABLE_STATUSES).order_by('pk').values_list('pk', flat=True)
         )
-        qr.add_data(f"Instrument: {instrument.name}\nSerial: {instrument.serial_number}")
-        qr.make(fit=True)
+        booked = availability_index.booked(candidates, start_date, end_date)
         
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        buffer.seek(0)
+        return Response({
+            'start_date': start_date,
+            'end_date': end_date,
+            'available': [pk for pk in candidates if pk not in booked],
+            'booked': sorted(booked),
+        })
+    
+    @action(detail=False, methods=['post'])
+    def allocate(self, request):
+        """
+        Reserve a number of free instruments from a category for a rental
+        period by creating a pending rental order for the client.
+        """
+        serializer = InstrumentAllocationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        started = time.perf_counter()
+        try:
+            order, instrument_ids = allocate_rental(
+                client=data['client'],
+                category_id=data['category'].pk,
+                quantity=data['quantity'],
+                start_date=data['start_date'],
+                end_date=data['end_date'],
+                created_by=request.user,
+            )
+        except AllocationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
         
-        return HttpResponse(buffer, content_type="image/png")
+        return Response({
+            'order': order.pk,
+            'order_number': order.order_number,
+            'instruments': instrument_ids,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Import instruments from a CSV or XLSX file. Categories are given by
+        name; set `create_categories` to create the missing ones.
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response(
+                {"detail": "No instrument file uploaded."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        import_format = request.data.get('format') or guess_format(upload.name)
+        if import_format not in IMPORT_FORMATS:
+            return Response(
+                {"detail": f"Unsupported import format: {import_format}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        create_categories = str(request.data.get('create_categories', '')).lower() in ('1', 'true', 'yes', 'on')
+        try:
+            stats, report_token = import_upload(upload.file, import_format, create_categories=create_categories)
+        except ValueError as e:
+            return Response(
+                {"detail": f"Cannot read the instrument file: {e}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        report_url = None
+        if report_token:
+            report_url = request.build_absolute_uri(reverse('instrument-import-errors', args=[report_token]))
+        return Response({**stats, 'error_report': report_url})
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated, IsAdminOrStaff],
+            url_path=r'import_errors/(?P<token>[\w-]+)', url_name='import-errors')
+    def import_errors(self, request, token=None):
+        """Download the error report of a bulk import."""
+        report = error_report(token)
+        if report is None:
+            return Response({"detail": "No such error report."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            report, as_attachment=True, filename='instrument-import-errors.csv', content_type='text/csv'
+        )
     
     @action(detail=True, methods=['get'])
     def maintenance_history(self, request, pk=None):
@@ -77,6 +255,7 @@ class InstrumentMaintenanceViewSet(viewsets.ModelViewSet):
     serializer_class = InstrumentMaintenanceSerializer
     permission_classes = [IsAdminOrStaff]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['instrument', 'maintenance_date']
     search_fields = ['description', 'performed_by']
     ordering_fields = ['maintenance_date', 'next_maintenance_date', 'cost']
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification, EmailNotification, SMSNotification
+from .models import Notification, EmailNotification, SMSNotification, SweepWatermark
 
 
 @admin.register(Notification)
@@ -66,3 +66,9 @@ class SMSNotificationAdmin(admin.ModelAdmin):
             'fields': ('created_at',)
         }),
     )
+
+
+@admin.register(SweepWatermark)
+class SweepWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'position', 'updated_at')
+    readonly_fields = ('updated_at',)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from notifications.sweepers import (
+    OVERDUE_INVOICES, RENTAL_EXPIRY, reset_watermark, sweep_overdue_invoices, sweep_rental_expiry,
+)
+
+
+class Command(BaseCommand):
+    help = "Run the rental expiry and overdue invoice sweeps without Celery."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=[RENTAL_EXPIRY, OVERDUE_INVOICES],
+                            help='Run a single sweep.')
+        parser.add_argument('--date', help='Run as of this date (YYYY-MM-DD) instead of today.')
+        parser.add_argument('--since', help='Start the rental expiry window at this date (YYYY-MM-DD) instead of yesterday.')
+        parser.add_argument('--notice-days', type=int,
+                            help='Days ahead to warn about ending rentals (default RENTAL_EXPIRY_NOTICE_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def parse(self, value, option):
+        if value is None:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"{option} must be a date in YYYY-MM-DD format.")
+        return parsed
+
+    def handle(self, *args, **options):
+        today = self.parse(options['date'], '--date')
+        since = self.parse(options['since'], '--since')
+        sweeps = [options['only']] if options['only'] else [RENTAL_EXPIRY, OVERDUE_INVOICES]
+
+        if since is not None:
+            for name in sweeps:
+                reset_watermark(name, since)
+
+        if RENTAL_EXPIRY in sweeps:
+            created = sweep_rental_expiry(today, options['notice_days'], options['batch_size'])
+            self.stdout.write(f"Created {created} rental expiry notifications.")
+
+        if OVERDUE_INVOICES in sweeps:
+            marked = sweep_overdue_invoices(today, options['batch_size'])
+            self.stdout.write(f"Marked {marked} invoices overdue.")
+
+        self.stdout.write(self.style.SUCCESS("Sweeps complete."))
@@ -35,6 +35,10 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Notifications already sent about an object (notifications.sweepers)
+            models.Index(fields=['notification_type', 'related_object_id']),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.user.email}"
@@ -95,3 +99,14 @@ class SMSNotification(models.Model):
     
     def __str__(self):
         return f"SMS to {self.recipient_number}"
+
+
+class SweepWatermark(models.Model):
+    """Date up to which a periodic sweep (see notifications.sweepers) has run."""
+    
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
@@ -0,0 +1,212 @@
+"""
+Periodic sweeps for rental expiry and overdue invoices.
+
+Each run re-scans only the open window through an index, so a run costs
+the same whatever the size of the order history:
+
+- rental expiry: rentals ending from yesterday up to today plus the
+  notice period (OrderItem.rental_end_date). Rentals created or moved
+  into the window after an earlier run are found by the next one; those
+  already notified for the same end date are skipped. The sweep's
+  SweepWatermark row holds the last horizon, so after a gap in the runs
+  the window starts where the previous run stopped.
+- overdue invoices: sent invoices past their due date (Invoice status
+  and due_date). Marked invoices leave the window, however late they were
+  sent.
+
+Statuses are changed with set-based UPDATEs and the matching
+notifications are written with bulk_create.
+
+The sweeps run from Celery beat (notifications.tasks) or synchronously
+with the run_sweepers management command. The watermark row is locked
+for the duration of a sweep, so overlapping runs don't notify twice.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from hospital_management.table_versions import touch
+from orders.models import Invoice, Order, OrderItem
+from .models import Notification, SweepWatermark
+
+
+RENTAL_EXPIRY = 'rental_expiry'
+OVERDUE_INVOICES = 'overdue_invoices'
+
+# Orders whose rentals no longer need reminders
+CLOSED_ORDER_STATUSES = ('completed', 'cancelled')
+
+# Order payment statuses that become overdue with their invoice
+UNPAID_STATUSES = ('pending', 'partial')
+
+
+def lock_watermark(name, default):
+    """Lock and return the watermark of a sweep, creating it at `default`."""
+    SweepWatermark.objects.get_or_create(name=name, defaults={'position': default})
+    return SweepWatermark.objects.select_for_update().get(name=name)
+
+
+def reset_watermark(name, position):
+    """Move a sweep's watermark, e.g. to rescan history after a backfill."""
+    SweepWatermark.objects.update_or_create(name=name, defaults={'position': position})
+
+
+def _recipients(client_user_id, created_by_id):
+    return {user_id for user_id in (client_user_id, created_by_id) if user_id is not None}
+
+
+def _rental_title(order_number, end_date):
+    return f"Rental {order_number} ends {end_date:%d %b %Y}"
+
+
+def _notified_rentals(order_ids, batch_size):
+    """(order id, title) of the rental expiry notifications of the given orders."""
+    order_ids = list(order_ids)
+    notified = set()
+    for start in range(0, len(order_ids), batch_size):
+        notified.update(Notification.objects.filter(
+            notification_type='rental_expiry',
+            related_object_type='order',
+            related_object_id__in=order_ids[start:start + batch_size],
+        ).values_list('related_object_id', 'title'))
+    return notified
+
+
+def sweep_rental_expiry(today=None, notice_days=None, batch_size=1000):
+    """
+    Notify clients and order owners of rentals ending within `notice_days`.
+
+    Rentals ending from yesterday (or the previous run's horizon, if
+    earlier) up to today + notice_days get one notification per order and
+    end date. Returns the number of notifications created.
+    """
+    today = today or timezone.localdate()
+    if notice_days is None:
+        notice_days = getattr(settings, 'RENTAL_EXPIRY_NOTICE_DAYS', 3)
+    horizon = today + timedelta(days=notice_days)
+
+    with transaction.atomic():
+        watermark = lock_watermark(RENTAL_EXPIRY, today - timedelta(days=1))
+        start = min(watermark.position, today - timedelta(days=1))
+
+        items = (
+            OrderItem.objects.filter(
+                rental_end_date__gt=start,
+                rental_end_date__lte=horizon,
+                order__order_type='rental',
+            )
+            .exclude(order__status__in=CLOSED_ORDER_STATUSES)
+            .order_by('rental_end_date', 'pk')
+            .values_list(
+                'order_id', 'order__order_number', 'order__client__user_id',
+                'order__created_by_id', 'rental_end_date',
+            )
+        )
+
+        # One notification per order and end date, however many items it has
+        rentals = {}
+        for order_id, order_number, client_user_id, created_by_id, end_date in items.iterator(chunk_size=batch_size):
+            rental = rentals.setdefault((order_id, end_date), {
+                'order_number': order_number,
+                'recipients': _recipients(client_user_id, created_by_id),
+                'count': 0,
+            })
+            rental['count'] += 1
+
+        # The window overlaps earlier runs'
+        notified = _notified_rentals({order_id for order_id, end_date in rentals}, batch_size)
+
+        notifications = []
+        for (order_id, end_date), rental in rentals.items():
+            title = _rental_title(rental['order_number'], end_date)
+            if (order_id, title) in notified:
+                continue
+            for user_id in rental['recipients']:
+                notifications.append(Notification(
+                    user_id=user_id,
+                    title=title,
+                    message=(
+                        f"{rental['count']} instrument(s) on rental order {rental['order_number']} "
+                        f"are due back on {end_date:%d %b %Y}."
+                    ),
+                    notification_type='rental_expiry',
+                    priority='high' if end_date <= today else 'medium',
+                    related_object_type='order',
+                    related_object_id=order_id,
+                ))
+        Notification.objects.bulk_create(notifications, batch_size=batch_size)
+
+        watermark.position = horizon
+        watermark.save()
+
+    return len(notifications)
+
+
+def sweep_overdue_invoices(today=None, batch_size=1000):
+    """
+    Mark sent invoices past their due date as overdue, along with the
+    payment status of their unpaid orders, and notify clients and order
+    owners. Returns the number of invoices marked overdue.
+
+    Every run looks at all sent invoices due before today, so an invoice
+    sent after its due date is still marked.
+    """
+    today = today or timezone.localdate()
+    marked = 0
+
+    with transaction.atomic():
+        # Only a lock here, and the date of the last run
+        watermark = lock_watermark(OVERDUE_INVOICES, today)
+        due = (
+            Invoice.objects.filter(status='sent', due_date__lt=today)
+            .order_by('due_date', 'pk')
+            .values_list(
+                'pk', 'invoice_number', 'due_date', 'order_id', 'order__balance_due',
+                'order__client__user_id', 'order__created_by_id',
+            )
+        )
+
+        while True:
+            # Marked invoices drop out of `due`, so each batch is the next one
+            rows = list(due[:batch_size])
+            if not rows:
+                break
+
+            invoice_ids = [row[0] for row in rows]
+            updated = Invoice.objects.filter(pk__in=invoice_ids, status='sent').update(
+                status='overdue',
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                break
+            marked += updated
+
+            Order.objects.filter(
+                pk__in={row[3] for row in rows},
+                payment_status__in=UNPAID_STATUSES,
+            ).update(payment_status='overdue', updated_at=timezone.now())
+            touch(Invoice, Order)
+
+            notifications = []
+            for invoice_id, invoice_number, due_date, order_id, balance_due, client_user_id, created_by_id in rows:
+                for user_id in _recipients(client_user_id, created_by_id):
+                    notifications.append(Notification(
+                        user_id=user_id,
+                        title=f"Invoice {invoice_number} is overdue",
+                        message=(
+                            f"Invoice {invoice_number} was due on {due_date:%d %b %Y}. "
+                            f"Outstanding balance: {balance_due}."
+                        ),
+                        notification_type='payment_due',
+                        priority='high',
+                        related_object_type='invoice',
+                        related_object_id=invoice_id,
+                    ))
+            Notification.objects.bulk_create(notifications, batch_size=batch_size)
+
+        watermark.position = today
+        watermark.save()
+
+    return marked
@@ -0,0 +1,13 @@
+from celery import shared_task
+
+from .sweepers import sweep_overdue_invoices, sweep_rental_expiry
+
+
+@shared_task(name='notifications.sweep_rental_expiry')
+def sweep_rental_expiry_task():
+    return sweep_rental_expiry()
+
+
+@shared_task(name='notifications.sweep_overdue_invoices')
+def sweep_overdue_invoices_task():
+    return sweep_overdue_invoices()
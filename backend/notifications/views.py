@@ -11,6 +11,7 @@ from .serializers import (
     SMSNotificationSerializer, SMSNotificationCreateSerializer
 )
 from accounts.permissions import IsAdminUser, IsStaffUser, IsClientUser
+from hospital_management.pagination import KeysetOrPageNumberPagination
 
 
 class NotificationViewSet(viewsets.ModelViewSet):
@@ -18,6 +19,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     API endpoint for managing notifications.
     """
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['user', 'notification_type', 'priority', 'is_read']
     search_fields = ['title', 'message']
     ordering_fields = ['created_at', 'priority']
@@ -74,6 +76,7 @@ class EmailNotificationViewSet(viewsets.ModelViewSet):
     API endpoint for managing email notifications.
     """
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['status', 'recipient_email']
     search_fields = ['subject', 'message', 'recipient_email']
     ordering_fields = ['created_at', 'sent_at']
@@ -138,6 +141,7 @@ class SMSNotificationViewSet(viewsets.ModelViewSet):
     API endpoint for managing SMS notifications.
     """
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['status', 'recipient_number']
     search_fields = ['message', 'recipient_number']
     ordering_fields = ['created_at', 'sent_at']
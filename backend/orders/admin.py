@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem, Payment, Invoice
+from .models import Order, OrderItem, Payment, Invoice, NumberSequence, RevenueRollup
 
 
 class OrderItemInline(admin.TabularInline):
@@ -19,7 +19,9 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ('order_number', 'client', 'order_type', 'status', 'payment_status', 'order_date', 'grand_total')
     list_filter = ('order_type', 'status', 'payment_status', 'order_date')
     search_fields = ('order_number', 'client__hospital_name', 'notes')
-    readonly_fields = ('order_number', 'grand_total', 'created_at', 'updated_at')
+    readonly_fields = (
+        'order_number', 'payment_status', 'grand_total', 'amount_paid', 'balance_due', 'created_at', 'updated_at',
+    )
     inlines = [OrderItemInline, PaymentInline]
     fieldsets = (
         (None, {
@@ -29,7 +31,7 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('order_date', 'delivery_date')
         }),
         ('Financial Details', {
-            'fields': ('total_amount', 'tax_amount', 'discount_amount', 'grand_total')
+            'fields': ('total_amount', 'tax_amount', 'discount_amount', 'grand_total', 'amount_paid', 'balance_due')
         }),
         ('Additional Information', {
             'fields': ('notes', 'created_by')
@@ -62,7 +64,7 @@ class InvoiceAdmin(admin.ModelAdmin):
     list_display = ('invoice_number', 'order', 'status', 'invoice_date', 'due_date')
     list_filter = ('status', 'invoice_date', 'due_date')
     search_fields = ('invoice_number', 'order__order_number', 'notes')
-    readonly_fields = ('invoice_number', 'created_at', 'updated_at')
+    readonly_fields = ('invoice_number', 'pdf_hash', 'created_at', 'updated_at')
     fieldsets = (
         (None, {
             'fields': ('invoice_number', 'order', 'status')
@@ -74,10 +76,28 @@ class InvoiceAdmin(admin.ModelAdmin):
             'fields': ('billing_address', 'shipping_address')
         }),
         ('Additional Information', {
-            'fields': ('terms_and_conditions', 'notes', 'pdf_file')
+            'fields': ('terms_and_conditions', 'notes', 'pdf_file', 'pdf_hash')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(NumberSequence)
+class NumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'period', 'last_value', 'updated_at')
+    list_filter = ('prefix',)
+    search_fields = ('prefix', 'period')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(RevenueRollup)
+class RevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'client', 'order_type', 'category', 'orders', 'items', 'booked', 'collected')
+    list_filter = ('order_type', 'category', 'day')
+    search_fields = ('client__hospital_name',)
+    date_hierarchy = 'day'
+    readonly_fields = ('updated_at',)
+
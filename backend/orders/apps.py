@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'orders'
+    
+    def ready(self):
+        import orders.signals
+        
+        post_migrate.connect(install_search_index, sender=self)
+
+
+def install_search_index(using, **kwargs):
+    from django.db import connections
+    from orders.search import install
+    
+    install(connections[using])
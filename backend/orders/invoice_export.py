@@ -0,0 +1,83 @@
+"""
+Bulk export of invoice PDFs as a streamed ZIP archive.
+
+The archive is written entry by entry into a small buffer that is drained
+after every file, so the response starts right away and memory use stays
+at one PDF whatever the number of invoices. PDFs that are missing or out
+of date are rendered on the way by orders.invoice_pdf: requests use the
+process pool shared by every render in the web process, so an export
+never starts processes of its own. An index.csv listing the exported
+invoices closes the archive.
+"""
+import csv
+import io
+import zipfile
+from datetime import date
+
+from .invoice_pdf import render_invoices
+
+
+INDEX_FIELDS = ['invoice_number', 'order_number', 'client', 'invoice_date', 'due_date', 'status', 'grand_total', 'file']
+
+
+class ZipSink:
+    """Write-only file object collecting the bytes zipfile produces."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def month_range(month):
+    """First day of a YYYY-MM month and first day of the month after."""
+    try:
+        year, number = (int(part) for part in month.split('-'))
+        start = date(year, number, 1)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError('Month must be in YYYY-MM format.')
+    end = date(year + 1, 1, 1) if number == 12 else date(year, number + 1, 1)
+    return start, end
+
+
+def invoice_zip(invoices, workers=None):
+    """
+    Yield the bytes of a ZIP archive holding the PDFs of `invoices`,
+    rendering missing ones first in the shared pool, or in `workers`
+    processes of its own if given.
+    """
+    sink = ZipSink()
+    index = io.StringIO()
+    writer = csv.DictWriter(index, fieldnames=INDEX_FIELDS)
+    writer.writeheader()
+
+    # Stored, not deflated: PDFs are already compressed
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for invoice, rendered in render_invoices(invoices, workers=workers):
+            name = f"{invoice.invoice_number}.pdf"
+            with invoice.pdf_file.open('rb') as pdf:
+                archive.writestr(zipfile.ZipInfo(name, date_time=invoice.invoice_date.timetuple()[:6]), pdf.read())
+            writer.writerow({
+                'invoice_number': invoice.invoice_number,
+                'order_number': invoice.order.order_number,
+                'client': invoice.order.client.hospital_name,
+                'invoice_date': invoice.invoice_date,
+                'due_date': invoice.due_date,
+                'status': invoice.status,
+                'grand_total': invoice.order.grand_total,
+                'file': name,
+            })
+            yield sink.drain()
+
+        archive.writestr('index.csv', index.getvalue())
+    yield sink.drain()
@@ -0,0 +1,109 @@
+"""
+Invoice PDF layout.
+
+Works on the plain documents built by orders.invoice_pdf and imports
+nothing from Django, so it can run in pool worker processes.
+"""
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+# Bump when the layout changes so every invoice is rendered again
+LAYOUT_VERSION = 1
+
+
+def render_pdf(document):
+    """Render an invoice document to PDF bytes."""
+
+    styles = getSampleStyleSheet()
+    order = document['order']
+    buffer = BytesIO()
+    pdf = SimpleDocTemplate(
+        buffer, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=15 * mm,
+        title=f"Invoice {document['invoice_number']}",
+    )
+
+    def lines(text):
+        return '<br/>'.join(escape(line) for line in text.splitlines())
+
+    grid = TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+
+    story = [
+        Paragraph(f"Invoice {document['invoice_number']}", styles['Title']),
+        Paragraph(
+            f"Order {order['order_number']} ({order['order_type']}) &middot; "
+            f"Invoice date {document['invoice_date']} &middot; Due {document['due_date']} &middot; "
+            f"{document['status']}",
+            styles['Normal'],
+        ),
+        Spacer(1, 6 * mm),
+        Table(
+            [
+                ['Bill to', 'Ship to'],
+                [
+                    Paragraph(f"{escape(document['client'])}<br/>{lines(document['billing_address'])}", styles['Normal']),
+                    Paragraph(lines(document['shipping_address']), styles['Normal']),
+                ],
+            ],
+            colWidths=[90 * mm, 90 * mm],
+            style=grid,
+        ),
+        Spacer(1, 6 * mm),
+    ]
+
+    item_rows = [['Instrument', 'Serial', 'Qty', 'Unit price', 'Rental period', 'Subtotal']]
+    for item in document['items']:
+        period = ''
+        if item['rental_start_date']:
+            period = f"{item['rental_start_date']} to {item['rental_end_date'] or 'open'}"
+        item_rows.append([
+            Paragraph(escape(item['instrument']), styles['Normal']), item['serial_number'], item['quantity'],
+            item['unit_price'], period, item['subtotal'],
+        ])
+    story += [Table(item_rows, repeatRows=1, style=grid), Spacer(1, 6 * mm)]
+
+    totals = [
+        ['Total', order['total_amount']],
+        ['Tax', order['tax_amount']],
+        ['Discount', order['discount_amount']],
+        ['Grand total', order['grand_total']],
+        ['Paid', order['amount_paid']],
+        ['Balance due', order['balance_due']],
+    ]
+    story += [Table(totals, colWidths=[40 * mm, 30 * mm], hAlign='RIGHT', style=TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('LINEABOVE', (0, 3), (-1, 3), 0.5, colors.grey),
+    ])), Spacer(1, 6 * mm)]
+
+    if document['payments']:
+        payment_rows = [['Date', 'Method', 'Transaction', 'Amount']]
+        payment_rows += [
+            [payment['payment_date'], payment['payment_method'], payment['transaction_id'], payment['amount']]
+            for payment in document['payments']
+        ]
+        story += [Paragraph('Payments', styles['Heading3']), Table(payment_rows, repeatRows=1, style=grid)]
+
+    for heading, key in (('Terms and conditions', 'terms_and_conditions'), ('Notes', 'notes')):
+        if document[key]:
+            story += [Paragraph(heading, styles['Heading3']), Paragraph(lines(document[key]), styles['Normal'])]
+
+    pdf.build(story)
+    return buffer.getvalue()
+
+
+def render_job(job):
+    """Process pool entry point: (invoice id, hash, document) -> (id, hash, pdf)."""
+    invoice_id, digest, document = job
+    return invoice_id, digest, render_pdf(document)
@@ -0,0 +1,232 @@
+"""
+Invoice PDF rendering.
+
+An invoice is first reduced to a plain document (strings, lists and
+dicts) holding everything printed on it: the order and its totals, the
+items, the completed payments and the addresses. The SHA-256 of that
+document is stored on the invoice next to the rendered file, so an
+invoice whose content hasn't changed is never rendered twice.
+
+Documents are picklable and the layout (orders.invoice_layout) doesn't
+import Django, so batches are rendered in worker processes: everything
+in one process (background renders, exports) shares one spawned pool of
+INVOICE_PDF_WORKERS processes, while the render_invoices command starts
+a pool of its own sized to the machine. Requests never render inline: schedule_render() hands the work to the Celery worker, or
+to a local background thread when no broker is reachable (see
+hospital_management.background).
+"""
+import hashlib
+import json
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+
+from hospital_management.background import submit
+from .invoice_layout import LAYOUT_VERSION, render_job
+from .models import Invoice, OrderItem, Payment
+
+
+SHARED_WORKERS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shared_pool():
+    """The process pool shared by the invoice renders of this process, and its size."""
+    global _pool
+    workers = getattr(settings, 'INVOICE_PDF_WORKERS', None) or SHARED_WORKERS
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the web server's threads and connections stay behind
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool, workers
+
+
+def invoice_queryset(queryset=None):
+    """Invoices with everything invoice_document() reads loaded up front."""
+    if queryset is None:
+        queryset = Invoice.objects.all()
+    return queryset.select_related('order', 'order__client').prefetch_related(
+        Prefetch('order__items', queryset=OrderItem.objects.select_related('instrument').order_by('pk')),
+        Prefetch(
+            'order__payments',
+            queryset=Payment.objects.filter(status='completed').order_by('payment_date', 'pk'),
+            to_attr='completed_payments',
+        ),
+    )
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+def invoice_document(invoice):
+    """Everything printed on an invoice, as plain picklable data."""
+    order = invoice.order
+    if hasattr(order, 'completed_payments'):
+        completed_payments = order.completed_payments
+    else:
+        completed_payments = order.payments.filter(status='completed').order_by('payment_date', 'pk')
+    return {
+        'layout': LAYOUT_VERSION,
+        'invoice_number': invoice.invoice_number,
+        'invoice_date': _text(invoice.invoice_date),
+        'due_date': _text(invoice.due_date),
+        'status': invoice.get_status_display(),
+        'billing_address': _text(invoice.billing_address),
+        'shipping_address': _text(invoice.shipping_address),
+        'terms_and_conditions': _text(invoice.terms_and_conditions),
+        'notes': _text(invoice.notes),
+        'client': order.client.hospital_name,
+        'order': {
+            'order_number': order.order_number,
+            'order_type': order.get_order_type_display(),
+            'order_date': f"{order.order_date:%Y-%m-%d}",
+            'total_amount': _text(order.total_amount),
+            'tax_amount': _text(order.tax_amount),
+            'discount_amount': _text(order.discount_amount),
+            'grand_total': _text(order.grand_total),
+            'amount_paid': _text(order.amount_paid),
+            'balance_due': _text(order.balance_due),
+        },
+        'items': [
+            {
+                'instrument': item.instrument.name,
+                'serial_number': item.instrument.serial_number,
+                'quantity': item.quantity,
+                'unit_price': _text(item.unit_price),
+                'rental_start_date': _text(item.rental_start_date),
+                'rental_end_date': _text(item.rental_end_date),
+                'rental_duration_days': _text(item.rental_duration_days),
+                'subtotal': _text(item.subtotal),
+            }
+            for item in order.items.all()
+        ],
+        'payments': [
+            {
+                'payment_date': f"{payment.payment_date:%Y-%m-%d}",
+                'payment_method': payment.get_payment_method_display(),
+                'transaction_id': _text(payment.transaction_id),
+                'amount': _text(payment.amount),
+            }
+            for payment in completed_payments
+        ],
+    }
+
+
+def content_hash(document):
+    payload = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_current(invoice, digest):
+    return bool(invoice.pdf_file) and invoice.pdf_hash == digest
+
+
+def store_pdf(invoice, digest, content):
+    """Save rendered bytes for an invoice and record their content hash."""
+    old_name = invoice.pdf_file.name if invoice.pdf_file else None
+    name = default_storage.save(
+        f"invoices/{invoice.invoice_number}-{digest[:12]}.pdf",
+        ContentFile(content),
+    )
+    Invoice.objects.filter(pk=invoice.pk).update(pdf_file=name, pdf_hash=digest)
+    invoice.pdf_file.name = name
+    invoice.pdf_hash = digest
+    if old_name and old_name != name:
+        default_storage.delete(old_name)
+    return name
+
+
+def _render(jobs, pool, workers):
+    """render_job() results for `jobs` in order, at most two jobs per worker in flight."""
+    if pool is None:
+        yield from map(render_job, jobs)
+        return
+    in_flight = deque()
+    try:
+        for job in jobs:
+            in_flight.append(pool.submit(render_job, job))
+            while len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def render_invoices(queryset=None, workers=None, force=False, batch_size=200):
+    """
+    Render the PDFs of out-of-date invoices in `queryset` (all invoices by
+    default) in the shared pool, or in `workers` processes of its own if
+    given. Yields (invoice, rendered) as soon as each invoice's PDF is
+    current.
+    """
+    invoices = invoice_queryset(queryset).order_by('pk')
+
+    pool = None
+    own_pool = workers is not None
+    if not own_pool:
+        workers = getattr(settings, 'INVOICE_PDF_WORKERS', None) or SHARED_WORKERS
+        if workers > 1:
+            pool, workers = shared_pool()
+    try:
+        last_pk = 0
+        while True:
+            # Batches keep the prefetches bounded
+            batch = list(invoices.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            by_id = {}
+            jobs = []
+            for invoice in batch:
+                document = invoice_document(invoice)
+                digest = content_hash(document)
+                if not force and is_current(invoice, digest):
+                    yield invoice, False
+                else:
+                    by_id[invoice.pk] = invoice
+                    jobs.append((invoice.pk, digest, document))
+
+            # A pool of its own is started on the first batch with more than one invoice to render
+            if own_pool and pool is None and workers > 1 and len(jobs) > 1:
+                pool = ProcessPoolExecutor(max_workers=workers)
+            for invoice_id, digest, content in _render(jobs, pool, workers):
+                invoice = by_id[invoice_id]
+                store_pdf(invoice, digest, content)
+                yield invoice, True
+    finally:
+        if own_pool and pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def current_pdf(invoice):
+    """The stored PDF of an invoice if it matches its current content, else None."""
+    invoice = invoice_queryset(Invoice.objects.filter(pk=invoice.pk)).get()
+    if is_current(invoice, content_hash(invoice_document(invoice))):
+        return invoice.pdf_file
+    return None
+
+
+def _dispatch(invoice_ids):
+    from .tasks import render_invoice_pdfs
+
+    submit(render_invoice_pdfs, invoice_ids)
+
+
+def schedule_render(invoice_ids):
+    """Render the given invoices in the background once the transaction commits."""
+    invoice_ids = sorted(set(invoice_ids))
+    if invoice_ids:
+        transaction.on_commit(lambda: _dispatch(invoice_ids))
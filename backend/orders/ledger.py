@@ -0,0 +1,135 @@
+"""
+Running payment totals on orders.
+
+Order.amount_paid and Order.balance_due are adjusted with F() increments
+whenever a payment is created, changes status or amount, or is deleted,
+so posting a payment never re-aggregates the order's payment history.
+The reconcile_payments management command recomputes the totals from the
+payments table and reports any drift.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+
+from hospital_management.table_versions import touch
+from .models import Order, Payment, Invoice
+
+
+PaymentState = namedtuple('PaymentState', ['order_id', 'status', 'amount'])
+
+# Payments counted towards amount_paid
+PAID_STATUSES = ('completed',)
+
+
+def payment_state(payment):
+    """Snapshot of the fields of a payment that affect the ledger."""
+    if payment is None:
+        return None
+    return PaymentState(payment.order_id, payment.status, payment.amount)
+
+
+def contribution(state):
+    """Amount a payment adds to its order's amount_paid."""
+    if state is None or state.status not in PAID_STATUSES:
+        return Decimal('0')
+    return state.amount
+
+
+def payment_status_expression(amount_paid, unpaid_status=None):
+    """
+    Order payment_status for a given amount_paid expression.
+
+    Orders with nothing paid keep an overdue or refunded status unless
+    `unpaid_status` is given.
+    """
+    whens = [
+        When(GreaterThanOrEqual(amount_paid, F('grand_total')), then=Value('paid')),
+        When(GreaterThan(amount_paid, 0), then=Value('partial')),
+    ]
+    if unpaid_status:
+        return Case(*whens, default=Value(unpaid_status))
+
+    whens.append(When(Q(payment_status__in=['overdue', 'refunded']), then=F('payment_status')))
+    return Case(*whens, default=Value('pending'))
+
+
+def mark_paid_invoices(orders):
+    """Mark the invoices of fully paid orders in `orders` as paid."""
+    if Invoice.objects.filter(order__in=orders, order__payment_status='paid').exclude(
+        status__in=['paid', 'cancelled']
+    ).update(status='paid'):
+        touch(Invoice)
+
+
+def adjust_order(order_id, delta, unpaid_status=None):
+    """Add `delta` to an order's amount_paid in a single UPDATE."""
+    if not delta:
+        return
+
+    amount_paid = F('amount_paid') + delta
+    # payment_status is assigned first: MySQL evaluates SET assignments left
+    # to right, so one after amount_paid would see the new value and count
+    # delta twice. Other databases read the old row either way.
+    Order.objects.filter(pk=order_id).update(
+        payment_status=payment_status_expression(amount_paid, unpaid_status),
+        amount_paid=amount_paid,
+        balance_due=F('balance_due') - delta,
+    )
+    touch(Order)
+
+    mark_paid_invoices(Order.objects.filter(pk=order_id))
+
+
+def post_payment_change(before, after):
+    """
+    Apply the change between two payment states to the affected orders.
+
+    `before` is None for a new payment and `after` is None for a deleted one.
+    """
+    unpaid_status = 'refunded' if after is not None and after.status == 'refunded' else None
+
+    if before is not None and after is not None and before.order_id == after.order_id:
+        adjust_order(after.order_id, contribution(after) - contribution(before), unpaid_status)
+        return
+
+    if before is not None:
+        adjust_order(before.order_id, -contribution(before))
+    if after is not None:
+        adjust_order(after.order_id, contribution(after), unpaid_status)
+
+
+def paid_total_subquery():
+    """Sum of counted payments for the order in the outer query."""
+    totals = (
+        Payment.objects.filter(order=OuterRef('pk'), status__in=PAID_STATUSES)
+        .order_by()
+        .values('order')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals), Value(Decimal('0')), output_field=Order._meta.get_field('amount_paid'))
+
+
+def reconcile_orders(queryset):
+    """
+    Recompute amount_paid, balance_due and payment_status from the payments
+    table for every order in `queryset` with one UPDATE. Returns the number
+    of orders updated.
+    """
+    actual = paid_total_subquery()
+    updated = queryset.update(
+        amount_paid=actual,
+        balance_due=F('grand_total') - actual,
+        payment_status=payment_status_expression(actual),
+    )
+    touch(Order)
+    return updated
+
+
+def reconcile_order(order_id):
+    """Recompute one order's payment totals from its payments."""
+    reconcile_orders(Order.objects.filter(pk=order_id))
+    mark_paid_invoices(Order.objects.filter(pk=order_id))
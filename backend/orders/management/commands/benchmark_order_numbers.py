@@ -0,0 +1,91 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from orders.models import NumberSequence, Order
+from orders.sequences import next_value
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent order number allocation and order inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--per-thread', type=int, default=200)
+        parser.add_argument('--block-size', type=int, default=1,
+                            help='Values reserved per counter update (1 disables block reservation).')
+        parser.add_argument('--client', type=int,
+                            help='Insert real orders for this client id instead of only allocating numbers.')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        per_thread = options['per_thread']
+        block_size = options['block_size']
+        client_id = options['client']
+
+        if client_id is not None:
+            from clients.models import Client
+            if not Client.objects.filter(pk=client_id).exists():
+                raise CommandError(f"Client {client_id} does not exist.")
+
+        prefix = 'BENCH'
+        period = timezone.now().strftime('%Y%m%d')
+        numbers = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            allocated = []
+            try:
+                for _ in range(per_thread):
+                    value = next_value(prefix, period, block_size=block_size)
+                    number = f"{prefix}{period}{value:06d}"
+                    if client_id is not None:
+                        with transaction.atomic():
+                            Order.objects.create(
+                                order_number=number,
+                                client_id=client_id,
+                                order_type='sale',
+                                total_amount=0,
+                                tax_amount=0,
+                                notes='benchmark_order_numbers',
+                            )
+                    allocated.append(number)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            finally:
+                connection.close()
+            with lock:
+                numbers.extend(allocated)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        duplicates = len(numbers) - len(set(numbers))
+        rate = len(numbers) / elapsed if elapsed else 0
+
+        self.stdout.write(
+            f"{len(numbers)} numbers from {threads} threads in {elapsed:.2f}s "
+            f"({rate:.0f}/s, block size {block_size})"
+        )
+        self.stdout.write(f"Duplicates: {duplicates}")
+        for error in errors:
+            self.stderr.write(f"Worker failed: {error}")
+
+        # Clean up benchmark data
+        if client_id is not None:
+            Order.objects.filter(order_number__in=numbers).delete()
+        NumberSequence.objects.filter(prefix=prefix, period=period).delete()
+
+        if duplicates or errors:
+            raise CommandError('Benchmark detected duplicate numbers or worker failures.')
+        self.stdout.write(self.style.SUCCESS('No duplicate numbers allocated.'))
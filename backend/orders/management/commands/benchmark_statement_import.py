@@ -0,0 +1,87 @@
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from orders import rollups, search
+from orders.ledger import mark_paid_invoices, reconcile_orders
+from orders.models import Order, Payment
+from orders.statements import StatementImport, read_statement
+
+
+class Command(BaseCommand):
+    help = 'Benchmark statement import throughput and memory on a synthetic NDJSON statement.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--unmatched-ratio', type=float, default=0.1,
+                            help='Share of rows referencing unknown orders.')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the generated payments instead of deleting them.')
+
+    def handle(self, *args, **options):
+        order_numbers = list(Order.objects.values_list('order_number', flat=True)[:1000])
+        if not order_numbers:
+            raise CommandError('The benchmark needs at least one existing order.')
+
+        rows = options['rows']
+        ratio = options['unmatched_ratio']
+        prefix = f"BENCH-{int(time.time())}-"
+
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as statement:
+            for index in range(rows):
+                order_number = order_numbers[index % len(order_numbers)]
+                if random.random() < ratio:
+                    order_number = f"UNKNOWN{index}"
+                statement.write(json.dumps({
+                    'transaction_id': f"{prefix}{index}",
+                    'order_number': order_number,
+                    'amount': '1.00',
+                    'payment_method': 'upi',
+                }) + '\n')
+            path = statement.name
+
+        try:
+            with open(path, 'rb') as stream, open(os.devnull, 'w') as report:
+                importer = StatementImport(chunk_size=options['chunk_size'], unmatched=report)
+                tracemalloc.start()
+                started = time.perf_counter()
+                stats = importer.run(read_statement(stream, 'ndjson'))
+                elapsed = time.perf_counter() - started
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        finally:
+            os.unlink(path)
+
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s), peak traced memory {peak / 1024 / 1024:.1f} MiB"
+        )
+        self.stdout.write(
+            f"created {stats.get('created', 0)}, completed {stats.get('completed', 0)}, "
+            f"unmatched {stats.get('unmatched', 0)}"
+        )
+
+        if not options['keep']:
+            payments = Payment.objects.filter(transaction_id__startswith=prefix)
+            affected_ids = list(payments.values_list('order_id', flat=True).distinct())
+            with transaction.atomic():
+                payment_ids = list(payments.values_list('pk', flat=True))
+                rollups.mark_payments(payment_ids)
+                search.remove_ids('payment', payment_ids)
+                # Delete without loading every payment; totals are recomputed below
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"DELETE FROM {connection.ops.quote_name(Payment._meta.db_table)} "
+                        "WHERE transaction_id LIKE %s",
+                        [f"{prefix}%"]
+                    )
+                orders = Order.objects.filter(pk__in=affected_ids)
+                reconcile_orders(orders)
+                mark_paid_invoices(orders)
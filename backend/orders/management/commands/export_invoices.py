@@ -0,0 +1,43 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.invoice_export import invoice_zip, month_range
+from orders.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Write the PDFs of a month's invoices to a ZIP archive, rendering missing ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('month', help='Invoice month, YYYY-MM.')
+        parser.add_argument('--output', help='Archive path (default invoices-<month>.zip).')
+        parser.add_argument('--status', action='append',
+                            help='Only invoices with this status; may be repeated.')
+        parser.add_argument('--workers', type=int,
+                            help='Renderer processes (default: CPU count).')
+
+    def handle(self, *args, **options):
+        month = options['month']
+        try:
+            start, end = month_range(month)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        invoices = Invoice.objects.filter(invoice_date__gte=start, invoice_date__lt=end)
+        if options['status']:
+            invoices = invoices.filter(status__in=options['status'])
+
+        output = options['output'] or f"invoices-{month}.zip"
+        started = time.perf_counter()
+        size = 0
+        with open(output, 'wb') as archive:
+            for chunk in invoice_zip(invoices, workers=options['workers'] or os.cpu_count() or 1):
+                archive.write(chunk)
+                size += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {invoices.count()} invoices ({size / 1048576:.1f} MB) to {output} in {elapsed:.1f}s."
+        ))
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.statements import STATEMENT_FORMATS, StatementImport, guess_format, read_statement
+
+
+class Command(BaseCommand):
+    help = 'Import a CSV or NDJSON bank/UPI statement as payments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Statement file, or '-' for standard input.")
+        parser.add_argument('--format', choices=STATEMENT_FORMATS,
+                            help='Statement format (guessed from the file name by default).')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--report', help='Write unmatched rows to this CSV file.')
+        parser.add_argument('--method', default='bank_transfer',
+                            help='Payment method for rows that do not specify one.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        statement_format = options['format'] or guess_format(path)
+
+        report = open(options['report'], 'w', newline='') if options['report'] else None
+        try:
+            importer = StatementImport(
+                chunk_size=options['chunk_size'],
+                unmatched=report,
+                default_method=options['method'],
+            )
+            try:
+                if path == '-':
+                    stats = importer.run(read_statement(sys.stdin.buffer, statement_format))
+                else:
+                    try:
+                        stream = open(path, 'rb')
+                    except OSError as e:
+                        raise CommandError(f"Cannot open statement: {e}")
+                    with stream:
+                        stats = importer.run(read_statement(stream, statement_format))
+            except ValueError as e:
+                raise CommandError(f"Cannot read statement: {e}")
+        finally:
+            if report is not None:
+                report.close()
+
+        self.stdout.write(
+            f"{stats.get('rows', 0)} rows: {stats.get('created', 0)} payments created, "
+            f"{stats.get('completed', 0)} pending payments completed, "
+            f"{stats.get('unmatched', 0)} unmatched."
+        )
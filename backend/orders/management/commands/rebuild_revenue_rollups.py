@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils.dateparse import parse_date
+
+from orders import rollups
+from orders.models import Order, Payment
+
+
+class Command(BaseCommand):
+    help = "Rebuild the revenue rollup tables from orders and payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD, default: first order or payment).')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD, default: last order or payment).')
+        parser.add_argument('--step-days', type=int, default=31,
+                            help='Days rebuilt per transaction.')
+
+    def parse(self, value, option):
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"{option} must be a date in YYYY-MM-DD format.")
+        return parsed
+
+    def handle(self, *args, **options):
+        orders = Order.objects.aggregate(first=Min('order_date'), last=Max('order_date'))
+        payments = Payment.objects.aggregate(first=Min('payment_date'), last=Max('payment_date'))
+        known = [value for value in (*orders.values(), *payments.values()) if value is not None]
+
+        start = self.parse(options['start'], '--start') if options['start'] else None
+        end = self.parse(options['end'], '--end') if options['end'] else None
+        if start is None or end is None:
+            if not known:
+                self.stdout.write("No orders or payments to roll up.")
+                return
+            start = start or rollups.local_day(min(known))
+            end = end or rollups.local_day(max(known))
+
+        started = time.perf_counter()
+        written = rollups.rebuild(start, end, step_days=options['step_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} rollup rows for {start} to {end} in {time.perf_counter() - started:.1f}s."
+        ))
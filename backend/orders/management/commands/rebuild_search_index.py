@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders import search
+from orders.models import SearchEntry
+
+
+class Command(BaseCommand):
+    help = "Create the full-text search index and rebuild it from orders, invoices and payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', choices=list(search.SOURCES),
+                            help='Only rebuild entries of this kind; may be repeated.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = search.install()
+        if backend is None:
+            self.stdout.write(self.style.WARNING(
+                "This database has no full-text index; searches will use LIKE queries."
+            ))
+
+        for kind in options['kind'] or list(search.SOURCES):
+            started = time.perf_counter()
+            with transaction.atomic():
+                SearchEntry.objects.filter(kind=kind).delete()
+                count = search.index_objects(kind, batch_size=options['batch_size'])
+            self.stdout.write(f"Indexed {count} {kind}s in {time.perf_counter() - started:.1f}s.")
+
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
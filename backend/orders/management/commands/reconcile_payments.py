@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from orders.ledger import mark_paid_invoices, paid_total_subquery, reconcile_orders
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "Recompute order payment totals from the payments table and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without correcting it.')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every order, not only those that drifted.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        drifted = (
+            Order.objects.annotate(actual_paid=paid_total_subquery())
+            .filter(
+                ~Q(amount_paid=F('actual_paid'))
+                | ~Q(balance_due=F('grand_total') - F('actual_paid'))
+            )
+            .order_by('pk')
+            .values_list('pk', 'order_number', 'amount_paid', 'actual_paid')
+        )
+
+        drifted_ids = []
+        for pk, order_number, recorded, actual in drifted.iterator(chunk_size=batch_size):
+            drifted_ids.append(pk)
+            self.stdout.write(f"{order_number}: recorded {recorded}, payments total {actual}")
+
+        self.stdout.write(f"{len(drifted_ids)} orders drifted from their payments.")
+
+        if options['dry_run']:
+            return
+
+        if options['all']:
+            with transaction.atomic():
+                updated = reconcile_orders(Order.objects.all())
+                mark_paid_invoices(Order.objects.all())
+        else:
+            updated = 0
+            for start in range(0, len(drifted_ids), batch_size):
+                orders = Order.objects.filter(pk__in=drifted_ids[start:start + batch_size])
+                with transaction.atomic():
+                    updated += reconcile_orders(orders)
+                    mark_paid_invoices(orders)
+
+        self.stdout.write(self.style.SUCCESS(f"Recomputed payment totals for {updated} orders."))
@@ -0,0 +1,40 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.invoice_pdf import render_invoices
+from orders.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Render invoice PDFs whose content changed since they were last rendered."
+
+    def add_arguments(self, parser):
+        parser.add_argument('invoice_numbers', nargs='*', help='Only these invoices (default: all).')
+        parser.add_argument('--workers', type=int,
+                            help='Renderer processes (default: CPU count).')
+        parser.add_argument('--force', action='store_true',
+                            help='Render again even if the stored PDF is current.')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.all()
+        if options['invoice_numbers']:
+            invoices = invoices.filter(invoice_number__in=options['invoice_numbers'])
+
+        started = time.perf_counter()
+        total = rendered_count = 0
+        workers = options['workers'] or os.cpu_count() or 1
+        results = render_invoices(invoices, workers, options['force'], options['batch_size'])
+        for invoice, rendered in results:
+            total += 1
+            if rendered:
+                rendered_count += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{invoice.invoice_number}: {invoice.pdf_file.name}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered_count} of {total} invoices in {elapsed:.1f}s; the rest were already current."
+        ))
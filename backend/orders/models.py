@@ -1,8 +1,60 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.utils import timezone
 from accounts.models import User
 from clients.models import Client
-from instruments.models import Instrument
+from instruments.models import Instrument, InstrumentCategory
+from .sequences import next_order_number, next_invoice_number
+
+
+class NumberSequenceManager(models.Manager):
+    """Manager handing out values from NumberSequence counters."""
+    
+    def reserve(self, prefix, period, count=1, seed=None):
+        """
+        Atomically reserve `count` consecutive values for a prefix and period
+        and return the first one.
+        
+        `seed` is called once, when the counter row is first created, to
+        continue numbering from values that were issued before the counter
+        existed.
+        """
+        with transaction.atomic(using=self.db):
+            counter = self.filter(prefix=prefix, period=period)
+            increment = {'last_value': F('last_value') + count, 'updated_at': timezone.now()}
+            
+            if not counter.update(**increment):
+                start = seed() if seed else 0
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.create(prefix=prefix, period=period, last_value=start + count)
+                    return start + 1
+                except IntegrityError:
+                    # Another worker created the counter first
+                    counter.update(**increment)
+            
+            last_value = counter.values_list('last_value', flat=True).get()
+        
+        return last_value - count + 1
+
+
+class NumberSequence(models.Model):
+    """Counter row backing order and invoice number allocation."""
+    
+    prefix = models.CharField(max_length=20)
+    period = models.CharField(max_length=8)
+    last_value = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = NumberSequenceManager()
+    
+    class Meta:
+        unique_together = ['prefix', 'period']
+        ordering = ['-period', 'prefix']
+    
+    def __str__(self):
+        return f"{self.prefix}{self.period} ({self.last_value})"
 
 
 class Order(models.Model):
@@ -41,13 +93,22 @@ class Order(models.Model):
     tax_amount = models.DecimalField(max_digits=10, decimal_places=2)
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     grand_total = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    balance_due = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True)
     notes = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_orders')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Maintained by orders.ledger with atomic updates, never written by save()
+    # unless named in update_fields
+    LEDGER_FIELDS = ('amount_paid', 'balance_due', 'payment_status')
+    
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            models.Index(fields=['client', 'order_date']),
+        ]
     
     def __str__(self):
         return f"{self.order_number} - {self.client.hospital_name}"
@@ -55,22 +116,32 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         # Generate order number if not provided
         if not self.order_number:
-            prefix = 'S' if self.order_type == 'sale' else 'R' if self.order_type == 'rental' else 'ST'
-            date_str = timezone.now().strftime('%Y%m%d')
-            last_order = Order.objects.filter(order_number__startswith=f"{prefix}{date_str}").order_by('-order_number').first()
-            
-            if last_order:
-                last_number = int(last_order.order_number[9:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-                
-            self.order_number = f"{prefix}{date_str}{new_number:04d}"
+            self.order_number = next_order_number(self.order_type)
         
         # Calculate grand total
         self.grand_total = self.total_amount + self.tax_amount - self.discount_amount
         
+        if self._state.adding:
+            self.balance_due = self.grand_total - self.amount_paid
+            super().save(*args, **kwargs)
+            return
+        
+        # Don't overwrite payments posted concurrently with stale values
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.LEDGER_FIELDS
+            ]
         super().save(*args, **kwargs)
+        
+        if 'grand_total' in kwargs['update_fields']:
+            from .ledger import payment_status_expression
+            
+            # Neither expression reads a column this UPDATE sets, so the SET order doesn't matter
+            Order.objects.filter(pk=self.pk).update(
+                balance_due=F('grand_total') - F('amount_paid'),
+                payment_status=payment_status_expression(F('amount_paid')),
+            )
 
 
 class OrderItem(models.Model):
@@ -81,7 +152,7 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     rental_start_date = models.DateField(blank=True, null=True)
-    rental_end_date = models.DateField(blank=True, null=True)
+    rental_end_date = models.DateField(blank=True, null=True, db_index=True)
     rental_duration_days = models.PositiveIntegerField(blank=True, null=True)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -93,12 +164,15 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.instrument.name} - {self.order.order_number}"
     
+    def calculate_subtotal(self, order_type):
+        """Return the subtotal for this item on an order of the given type."""
+        if order_type == 'rental' and self.rental_duration_days:
+            return self.unit_price * self.quantity * self.rental_duration_days
+        return self.unit_price * self.quantity
+    
     def save(self, *args, **kwargs):
         # Calculate subtotal
-        if self.order.order_type == 'rental' and self.rental_duration_days:
-            self.subtotal = self.unit_price * self.quantity * self.rental_duration_days
-        else:
-            self.subtotal = self.unit_price * self.quantity
+        self.subtotal = self.calculate_subtotal(self.order.order_type)
         
         super().save(*args, **kwargs)
 
@@ -125,7 +199,7 @@ class Payment(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payments')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    transaction_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     payment_date = models.DateTimeField(default=timezone.now)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     notes = models.TextField(blank=True, null=True)
@@ -135,6 +209,9 @@ class Payment(models.Model):
     
     class Meta:
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['payment_date']),
+        ]
     
     def __str__(self):
         return f"Payment for {self.order.order_number} - {self.amount}"
@@ -154,18 +231,24 @@ class Invoice(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='invoice')
     invoice_number = models.CharField(max_length=50, unique=True)
     invoice_date = models.DateField(default=timezone.now)
-    due_date = models.DateField()
+    due_date = models.DateField(db_index=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     billing_address = models.TextField()
     shipping_address = models.TextField(blank=True, null=True)
     terms_and_conditions = models.TextField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
     pdf_file = models.FileField(upload_to='invoices/', blank=True, null=True)
+    # SHA-256 of the content pdf_file was rendered from (see orders.invoice_pdf)
+    pdf_hash = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-invoice_date']
+        indexes = [
+            # Overdue sweep (notifications.sweepers)
+            models.Index(fields=['status', 'due_date']),
+        ]
     
     def __str__(self):
         return f"Invoice {self.invoice_number} for {self.order.order_number}"
@@ -173,15 +256,73 @@ class Invoice(models.Model):
     def save(self, *args, **kwargs):
         # Generate invoice number if not provided
         if not self.invoice_number:
-            date_str = timezone.now().strftime('%Y%m%d')
-            last_invoice = Invoice.objects.filter(invoice_number__startswith=f"INV{date_str}").order_by('-invoice_number').first()
-            
-            if last_invoice:
-                last_number = int(last_invoice.invoice_number[11:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-                
-            self.invoice_number = f"INV{date_str}{new_number:04d}"
+            self.invoice_number = next_invoice_number()
         
         super().save(*args, **kwargs)
+
+
+class SearchEntry(models.Model):
+    """Search text of an order, invoice or payment, kept up to date by orders.search."""
+    
+    KIND_CHOICES = (
+        ('order', 'Order'),
+        ('invoice', 'Invoice'),
+        ('payment', 'Payment'),
+    )
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    # Order, invoice and transaction numbers, lowercased without punctuation
+    number = models.CharField(max_length=255, blank=True, default='')
+    body = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('kind', 'object_id')
+        verbose_name_plural = 'Search entries'
+    
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+class RevenueRollup(models.Model):
+    """
+    Revenue of one client on one day for one order type, maintained by
+    orders.rollups.
+    
+    Rows with a category break item subtotals down by instrument category.
+    The row without a category holds the order-level figures: order count,
+    grand totals and completed payments received that day.
+    """
+    
+    day = models.DateField()
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='revenue_rollups')
+    order_type = models.CharField(max_length=10, choices=Order.ORDER_TYPES)
+    category = models.ForeignKey(
+        InstrumentCategory, on_delete=models.CASCADE, null=True, blank=True, related_name='revenue_rollups'
+    )
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    booked = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    collected = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-day']
+        # Also serves lookups by client and day
+        unique_together = ('client', 'day', 'order_type', 'category')
+        constraints = [
+            # NULLs never clash in unique_together, so the order-level rows need their own
+            models.UniqueConstraint(
+                fields=['client', 'day', 'order_type'],
+                condition=models.Q(category__isnull=True),
+                name='revenue_rollup_order_level_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'order_type']),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.client_id} {self.order_type} {self.category_id or '-'}"
+
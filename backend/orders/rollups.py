@@ -0,0 +1,255 @@
+"""
+Revenue rollups.
+
+RevenueRollup keeps the revenue of every client, day and order type,
+broken down by instrument category, so revenue reports and dashboards sum
+a handful of pre-aggregated rows instead of scanning orders, items and
+payments.
+
+Writes mark the (day, client) buckets they touch; once the transaction
+commits, each marked bucket is recomputed from its own orders and
+payments, which are found through the (client, order_date) and
+payment_date indexes. Recomputing a bucket is idempotent, so a bucket
+marked twice, or marked by a transaction that rolled back, is simply
+recomputed again. The rebuild_revenue_rollups command rebuilds whole date
+ranges for backfills, under the same per-client locks.
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from clients.models import Client
+from hospital_management.table_versions import touch
+from .models import Order, OrderItem, Payment, RevenueRollup
+
+
+# Orders that don't count towards revenue
+EXCLUDED_ORDER_STATUSES = ('cancelled',)
+
+_pending = threading.local()
+
+
+def local_day(value):
+    """The day a datetime falls on in the current time zone."""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _days_q(field, days):
+    condition = Q()
+    for day in days:
+        start, end = day_range(day)
+        condition |= Q(**{f"{field}__gte": start, f"{field}__lt": end})
+    return condition
+
+
+def mark(buckets):
+    """
+    Recompute the given (day, client_id) buckets once the current
+    transaction commits.
+    """
+    buckets = {bucket for bucket in buckets if None not in bucket}
+    if not buckets:
+        return
+    pending = getattr(_pending, 'buckets', None)
+    if pending is None:
+        pending = _pending.buckets = set()
+    pending.update(buckets)
+    transaction.on_commit(_flush)
+
+
+def mark_orders(order_ids):
+    """Mark the buckets of the given orders."""
+    rows = Order.objects.filter(pk__in=order_ids).values_list('order_date', 'client_id')
+    mark((local_day(order_date), client_id) for order_date, client_id in rows)
+
+
+def mark_payments(payment_ids):
+    """Mark the buckets the given payments were received in."""
+    rows = Payment.objects.filter(pk__in=payment_ids).values_list('payment_date', 'order__client_id')
+    mark((local_day(payment_date), client_id) for payment_date, client_id in rows)
+
+
+def mark_payment_orders(payments):
+    """Mark buckets for (payment_date, order_id) pairs, e.g. of deleted payments."""
+    clients = dict(
+        Order.objects.filter(pk__in={order_id for payment_date, order_id in payments})
+        .values_list('pk', 'client_id')
+    )
+    mark((local_day(payment_date), clients.get(order_id)) for payment_date, order_id in payments)
+
+
+def _flush():
+    # Every callback of a commit runs this; the first one does the work
+    buckets = getattr(_pending, 'buckets', None)
+    _pending.buckets = None
+    if buckets:
+        refresh(buckets)
+
+
+def aggregate(orders, items, payments):
+    """
+    Rollup rows for the given order, order item and payment querysets,
+    which must cover whole (day, client) buckets.
+    """
+    rows = {}
+
+    def row(day, client_id, order_type, category_id=None):
+        key = (day, client_id, order_type, category_id)
+        if key not in rows:
+            rows[key] = RevenueRollup(
+                day=day, client_id=client_id, order_type=order_type, category_id=category_id,
+                orders=0, items=0, booked=Decimal('0'), collected=Decimal('0'),
+            )
+        return rows[key]
+
+    totals = (
+        orders.exclude(status__in=EXCLUDED_ORDER_STATUSES)
+        .annotate(day=TruncDate('order_date'))
+        .values('day', 'client_id', 'order_type')
+        .annotate(count=Count('pk'), total=Sum('grand_total'))
+        .order_by()
+    )
+    for values in totals:
+        bucket = row(values['day'], values['client_id'], values['order_type'])
+        bucket.orders = values['count']
+        bucket.booked = values['total'] or Decimal('0')
+
+    breakdown = (
+        items.exclude(order__status__in=EXCLUDED_ORDER_STATUSES)
+        .annotate(day=TruncDate('order__order_date'))
+        .values('day', 'order__client_id', 'order__order_type', 'instrument__category_id')
+        .annotate(count=Sum('quantity'), total=Sum('subtotal'))
+        .order_by()
+    )
+    for values in breakdown:
+        bucket = row(
+            values['day'], values['order__client_id'], values['order__order_type'],
+            values['instrument__category_id'],
+        )
+        bucket.items = values['count'] or 0
+        bucket.booked = values['total'] or Decimal('0')
+        row(values['day'], values['order__client_id'], values['order__order_type']).items += bucket.items
+
+    received = (
+        payments.filter(status='completed')
+        .annotate(day=TruncDate('payment_date'))
+        .values('day', 'order__client_id', 'order__order_type')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for values in received:
+        bucket = row(values['day'], values['order__client_id'], values['order__order_type'])
+        bucket.collected = values['total'] or Decimal('0')
+
+    return list(rows.values())
+
+
+def _key(rollup):
+    return rollup.client_id, rollup.day, rollup.order_type, rollup.category_id
+
+
+def _write(rows, existing):
+    """
+    Make the rollup rows in `existing` match `rows`: rows are upserted on
+    their bucket key and rows no longer produced are deleted.
+
+    The order-level rows have a NULL category, which ON CONFLICT can't
+    target portably, so the existing keys are read and matched here; the
+    caller holds the client locks, and the unique constraints turn any
+    writer that doesn't into an error instead of double-counted rows.
+    """
+    current = {_key(rollup): rollup.pk for rollup in existing.only('pk', 'client', 'day', 'order_type', 'category')}
+    now = timezone.now()
+    to_update = []
+    to_create = []
+    for rollup in rows:
+        rollup.pk = current.pop(_key(rollup), None)
+        rollup.updated_at = now
+        (to_create if rollup.pk is None else to_update).append(rollup)
+
+    RevenueRollup.objects.filter(pk__in=current.values()).delete()
+    RevenueRollup.objects.bulk_update(
+        to_update, ['orders', 'items', 'booked', 'collected', 'updated_at'], batch_size=1000,
+    )
+    RevenueRollup.objects.bulk_create(to_create, batch_size=1000)
+    touch(RevenueRollup)
+
+
+def refresh(buckets):
+    """Recompute the given (day, client_id) buckets from the source tables."""
+    by_client = defaultdict(set)
+    for day, client_id in buckets:
+        by_client[client_id].add(day)
+
+    for client_id, days in by_client.items():
+        with transaction.atomic():
+            # Serializes concurrent refreshes of the same client's buckets
+            if not Client.objects.select_for_update().filter(pk=client_id).exists():
+                continue
+            rows = aggregate(
+                Order.objects.filter(_days_q('order_date', days), client_id=client_id),
+                OrderItem.objects.filter(_days_q('order__order_date', days), order__client_id=client_id),
+                Payment.objects.filter(_days_q('payment_date', days), order__client_id=client_id),
+            )
+            _write(rows, RevenueRollup.objects.filter(client_id=client_id, day__in=days))
+
+
+def rebuild(start, end, step_days=31):
+    """
+    Rebuild the rollups of every day from `start` to `end` inclusive, one
+    `step_days` window per transaction. Returns the number of rows written.
+    """
+    written = 0
+    day = start
+    while day <= end:
+        last = min(day + timedelta(days=step_days - 1), end)
+        window_start, window_end = day_range(day)[0], day_range(last)[1]
+        with transaction.atomic():
+            # The locks refresh() takes, in pk order so two rebuilds can't deadlock
+            list(Client.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+            rows = aggregate(
+                Order.objects.filter(order_date__gte=window_start, order_date__lt=window_end),
+                OrderItem.objects.filter(order__order_date__gte=window_start, order__order_date__lt=window_end),
+                Payment.objects.filter(payment_date__gte=window_start, payment_date__lt=window_end),
+            )
+            _write(rows, RevenueRollup.objects.filter(day__gte=day, day__lte=last))
+        written += len(rows)
+        day = last + timedelta(days=1)
+    return written
+
+
+def revenue(start, end, group_by=('day',), by_category=False, **filters):
+    """
+    Revenue between `start` and `end` (inclusive dates) summed per
+    `group_by` fields of RevenueRollup, e.g. ('day',), ('client',) or
+    ('order_type', 'category').
+
+    Order-level figures (orders, booked grand totals, collected) come from
+    the rows without a category; with `by_category` the per-category item
+    subtotals are summed instead. `filters` are applied to the rollup rows,
+    e.g. order_type='rental' or client=5.
+    """
+    rows = RevenueRollup.objects.filter(day__gte=start, day__lte=end, category__isnull=not by_category, **filters)
+    return (
+        rows.values(*group_by)
+        .annotate(
+            orders=Sum('orders'),
+            items=Sum('items'),
+            booked=Sum('booked'),
+            collected=Sum('collected'),
+        )
+        .order_by(*group_by)
+    )
@@ -0,0 +1,302 @@
+"""
+Full-text search over orders, invoices and payments.
+
+Each searchable object has a SearchEntry row holding its numbers and the
+text users search for (client name, notes, ...), written when the object
+is saved. The database's own inverted index sits on top of that table:
+
+- SQLite: an external-content FTS5 table kept in sync by triggers,
+  ranked with bm25().
+- PostgreSQL: a generated, weighted tsvector column with a GIN index,
+  ranked with ts_rank(), plus a trigram index for matching inside
+  numbers.
+
+Numbers get a higher weight than the other text, and every term is
+matched as a prefix, so "INV2026" finds all invoices of that year. The
+indexes are created after migrate (see OrdersConfig.ready) and by the
+rebuild_search_index command. On other databases IndexedSearchFilter
+falls back to DRF's SearchFilter.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+from .models import Invoice, Order, Payment, SearchEntry
+
+
+TERM_RE = re.compile(r'\w+')
+
+# Annotation holding the rank of ranked results, lowest first
+RANK_FIELD = 'search_rank'
+
+
+def normalize_number(value):
+    """Lowercase a document number and drop its punctuation."""
+    return re.sub(r'[\W_]+', '', str(value or '')).lower()
+
+
+def _join(*values):
+    return ' '.join(str(value) for value in values if value)
+
+
+def _order_entry(pk, order_number, client, order_type, notes):
+    return SearchEntry(
+        kind='order', object_id=pk,
+        number=normalize_number(order_number),
+        body=_join(order_number, client, order_type, notes),
+    )
+
+
+def _invoice_entry(pk, invoice_number, order_number, client, notes):
+    return SearchEntry(
+        kind='invoice', object_id=pk,
+        number=_join(normalize_number(invoice_number), normalize_number(order_number)),
+        body=_join(invoice_number, order_number, client, notes),
+    )
+
+
+def _payment_entry(pk, transaction_id, order_number, client, payment_method, notes):
+    return SearchEntry(
+        kind='payment', object_id=pk,
+        number=_join(normalize_number(transaction_id), normalize_number(order_number)),
+        body=_join(transaction_id, order_number, client, payment_method, notes),
+    )
+
+
+# kind -> (model, fields read with values_list, entry builder)
+SOURCES = {
+    'order': (
+        Order,
+        ('pk', 'order_number', 'client__hospital_name', 'order_type', 'notes'),
+        _order_entry,
+    ),
+    'invoice': (
+        Invoice,
+        ('pk', 'invoice_number', 'order__order_number', 'order__client__hospital_name', 'notes'),
+        _invoice_entry,
+    ),
+    'payment': (
+        Payment,
+        ('pk', 'transaction_id', 'order__order_number', 'order__client__hospital_name', 'payment_method', 'notes'),
+        _payment_entry,
+    ),
+}
+
+
+def index_objects(kind, queryset=None, batch_size=1000):
+    """Write the search entries of `queryset` (all objects of `kind` by default)."""
+    model, fields, build = SOURCES[kind]
+    if queryset is None:
+        queryset = model.objects.all()
+
+    rows = queryset.order_by().values_list(*fields)
+    batch = []
+    count = 0
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(build(*row))
+        if len(batch) >= batch_size:
+            count += _write(batch)
+            batch = []
+    if batch:
+        count += _write(batch)
+    return count
+
+
+def _write(entries):
+    if connection.features.supports_update_conflicts_with_target:
+        SearchEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['kind', 'object_id'],
+            update_fields=['number', 'body', 'updated_at'],
+        )
+        return len(entries)
+
+    # MySQL can't name the conflicting key in an upsert; replace the rows instead
+    with transaction.atomic():
+        for kind in {entry.kind for entry in entries}:
+            SearchEntry.objects.filter(
+                kind=kind, object_id__in=[entry.object_id for entry in entries if entry.kind == kind],
+            ).delete()
+        SearchEntry.objects.bulk_create(entries)
+    return len(entries)
+
+
+def index_ids(kind, ids):
+    model = SOURCES[kind][0]
+    return index_objects(kind, model.objects.filter(pk__in=ids))
+
+
+def remove_ids(kind, ids):
+    SearchEntry.objects.filter(kind=kind, object_id__in=ids).delete()
+
+
+class SQLiteSearch:
+    table = 'orders_searchentry_fts'
+
+    def install(self, cursor):
+        entries = SearchEntry._meta.db_table
+        cursor.execute(f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{self.table}'")
+        exists = cursor.fetchone() is not None
+
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"number, body, content='{entries}', content_rowid='id')"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_ai AFTER INSERT ON {entries} BEGIN "
+            f"INSERT INTO {self.table}(rowid, number, body) VALUES (new.id, new.number, new.body); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_ad AFTER DELETE ON {entries} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, number, body) "
+            f"VALUES ('delete', old.id, old.number, old.body); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_au AFTER UPDATE ON {entries} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, number, body) "
+            f"VALUES ('delete', old.id, old.number, old.body); "
+            f"INSERT INTO {self.table}(rowid, number, body) VALUES (new.id, new.number, new.body); END"
+        )
+        if not exists:
+            # Index entries written before the FTS table existed
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def _match(self, terms, number):
+        clauses = [' AND '.join(f'"{term}"*' for term in terms)]
+        if number:
+            clauses.append(f'number : "{number}"*')
+        return ' OR '.join(f"({clause})" for clause in clauses)
+
+    def match(self, kind, terms, number):
+        entries = SearchEntry._meta.db_table
+        return (
+            f"SELECT e.object_id FROM {self.table} f JOIN {entries} e ON e.id = f.rowid "
+            f"WHERE {self.table} MATCH %s AND e.kind = %s",
+            [self._match(terms, number), kind],
+        )
+
+    def rank(self, kind, terms, number, column):
+        # bm25() is negative, best match lowest
+        entries = SearchEntry._meta.db_table
+        return (
+            f"SELECT bm25({self.table}, 10.0, 1.0) FROM {self.table} "
+            f"WHERE {self.table} MATCH %s AND rowid = "
+            f"(SELECT id FROM {entries} WHERE kind = %s AND object_id = {column})",
+            [self._match(terms, number), kind],
+        )
+
+
+class PostgresSearch:
+
+    def install(self, cursor):
+        entries = SearchEntry._meta.db_table
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            f"ALTER TABLE {entries} ADD COLUMN IF NOT EXISTS document tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('simple', number), 'A') || setweight(to_tsvector('simple', body), 'B')"
+            f") STORED"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {entries}_document_idx ON {entries} USING GIN (document)")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {entries}_number_trgm_idx ON {entries} USING GIN (number gin_trgm_ops)"
+        )
+
+    def _query(self, terms):
+        return ' & '.join(f"{term}:*" for term in terms)
+
+    def match(self, kind, terms, number):
+        entries = SearchEntry._meta.db_table
+        condition = "document @@ to_tsquery('simple', %s)"
+        params = [self._query(terms)]
+        if len(number) >= 3:
+            # Trigram index: numbers containing the typed digits anywhere
+            condition = f"({condition} OR number LIKE %s)"
+            params.append(f"%{number}%")
+        return f"SELECT object_id FROM {entries} WHERE {condition} AND kind = %s", params + [kind]
+
+    def rank(self, kind, terms, number, column):
+        # Negated, so the best match sorts first like bm25()
+        entries = SearchEntry._meta.db_table
+        rank = "ts_rank(document, to_tsquery('simple', %s))"
+        params = [self._query(terms)]
+        if len(number) >= 3:
+            rank += " + similarity(number, %s)"
+            params.append(number)
+        return (
+            f"SELECT -({rank}) FROM {entries} WHERE kind = %s AND object_id = {column}",
+            params + [kind],
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearch,
+    'postgresql': PostgresSearch,
+}
+
+
+def get_backend(using=connection):
+    backend = BACKENDS.get(using.vendor)
+    return backend() if backend else None
+
+
+def install(using=connection):
+    """Create the database-side search index if this database has one."""
+    backend = get_backend(using)
+    if backend is not None:
+        with using.cursor() as cursor:
+            backend.install(cursor)
+    return backend
+
+
+def search(queryset, kind, text, ranked=True):
+    """
+    The objects of `queryset` (of `kind`) matching `text`, best match first
+    when `ranked`. None when the database has no search index.
+
+    The match is a subquery of `queryset`, so its own filters and
+    pagination apply to every match; the rank only orders them. It is
+    annotated as RANK_FIELD, so keyset pagination can continue from it.
+    """
+    backend = get_backend()
+    terms = [term.lower() for term in TERM_RE.findall(text)]
+    if backend is None or not terms:
+        return None
+    number = normalize_number(text)
+
+    sql, params = backend.match(kind, terms, number)
+    queryset = queryset.filter(pk__in=RawSQL(sql, params))
+    if not ranked:
+        return queryset
+
+    opts = queryset.model._meta
+    column = f"{connection.ops.quote_name(opts.db_table)}.{connection.ops.quote_name(opts.pk.column)}"
+    sql, params = backend.rank(kind, terms, number, column)
+    queryset = queryset.annotate(**{RANK_FIELD: RawSQL(sql, params, output_field=FloatField())})
+    return queryset.order_by(RANK_FIELD, 'pk')
+
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter answered from the search index of the view's `search_kind`.
+
+    Results are ordered by rank unless the client asks for an ordering, so
+    this backend goes after OrderingFilter. Databases without a search
+    index use the view's `search_fields` like SearchFilter does.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        kind = getattr(view, 'search_kind', None)
+        if not kind or not terms:
+            return super().filter_queryset(request, queryset, view)
+
+        ranked = not request.query_params.get(api_settings.ORDERING_PARAM)
+        result = search(queryset, kind, ' '.join(terms), ranked=ranked)
+        if result is None:
+            return super().filter_queryset(request, queryset, view)
+        return result
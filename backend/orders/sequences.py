@@ -0,0 +1,117 @@
+"""
+Allocation of order and invoice numbers.
+
+Numbers come from a NumberSequence counter row per prefix and day that is
+incremented atomically, so creating an order never scans the orders table
+for the highest number issued so far and concurrent creates cannot collide.
+
+Workers can reserve values in blocks (DOCUMENT_NUMBER_BLOCK_SIZE) to avoid
+touching the counter row on every insert. Numbers handed out from a block
+are unique but may leave gaps when a worker restarts.
+"""
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+ORDER_PREFIXES = {
+    'sale': 'S',
+    'rental': 'R',
+    'storage': 'ST',
+}
+
+INVOICE_PREFIX = 'INV'
+
+
+class SequenceBlock:
+    """Process-local pool of values already reserved from a counter row."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ranges = deque()
+
+    def take(self):
+        with self.lock:
+            while self.ranges:
+                values = self.ranges[0]
+                if values:
+                    self.ranges[0] = values[1:]
+                    return values[0]
+                self.ranges.popleft()
+        return None
+
+    def install(self, values):
+        if values:
+            with self.lock:
+                self.ranges.append(values)
+
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _get_block(prefix, period):
+    with _blocks_lock:
+        # Drop pools left over from previous periods
+        for key in [key for key in _blocks if key[0] == prefix and key[1] != period]:
+            del _blocks[key]
+        return _blocks.setdefault((prefix, period), SequenceBlock())
+
+
+def reserve_block(prefix, period, size, seed=None):
+    """Reserve `size` consecutive values and return them as a range."""
+    from .models import NumberSequence
+
+    first = NumberSequence.objects.reserve(prefix, period, count=size, seed=seed)
+    return range(first, first + size)
+
+
+def next_value(prefix, period, seed=None, block_size=None):
+    """Return the next unused value for a prefix and period."""
+    if block_size is None:
+        block_size = getattr(settings, 'DOCUMENT_NUMBER_BLOCK_SIZE', 1)
+
+    if block_size <= 1:
+        return reserve_block(prefix, period, 1, seed=seed)[0]
+
+    block = _get_block(prefix, period)
+    value = block.take()
+    if value is not None:
+        return value
+
+    values = reserve_block(prefix, period, block_size, seed=seed)
+    # The rest of the block is only shared once the reservation is committed;
+    # if the surrounding transaction rolls back the counter does too.
+    transaction.on_commit(lambda: block.install(values[1:]))
+    return values[0]
+
+
+def _highest_issued(model, field, stem):
+    """Highest numeric suffix already issued for `stem`, used to seed new counters."""
+    numbers = model.objects.filter(**{f'{field}__startswith': stem}).values_list(field, flat=True)
+    suffixes = (number[len(stem):] for number in numbers)
+    return max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=0)
+
+
+def next_order_number(order_type):
+    """Return a new order number such as S202401150001."""
+    from .models import Order
+
+    prefix = ORDER_PREFIXES.get(order_type, 'ST')
+    period = timezone.now().strftime('%Y%m%d')
+    stem = f"{prefix}{period}"
+    value = next_value(prefix, period, seed=lambda: _highest_issued(Order, 'order_number', stem))
+    return f"{stem}{value:04d}"
+
+
+def next_invoice_number():
+    """Return a new invoice number such as INV202401150001."""
+    from .models import Invoice
+
+    period = timezone.now().strftime('%Y%m%d')
+    stem = f"{INVOICE_PREFIX}{period}"
+    value = next_value(INVOICE_PREFIX, period, seed=lambda: _highest_issued(Invoice, 'invoice_number', stem))
+    return f"{stem}{value:04d}"
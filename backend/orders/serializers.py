@@ -1,22 +1,32 @@
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import Order, OrderItem, Payment, Invoice
 from accounts.serializers import UserSerializer
 from clients.serializers import ClientSerializer
 from instruments.serializers import InstrumentSerializer
+from hospital_management.eager_loading import EagerLoadingMixin
+from hospital_management.table_versions import touch
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     instrument_details = InstrumentSerializer(source='instrument', read_only=True)
     
+    select_related_fields = ('instrument',) + InstrumentSerializer.nested_select_related('instrument')
+    
     class Meta:
         model = OrderItem
         fields = '__all__'
         read_only_fields = ('subtotal', 'created_at', 'updated_at')
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     created_by_details = UserSerializer(source='created_by', read_only=True)
     
+    select_related_fields = ('created_by',) + UserSerializer.nested_select_related('created_by')
+    
     class Meta:
         model = Payment
         fields = '__all__'
@@ -27,59 +37,89 @@ class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = '__all__'
-        read_only_fields = ('invoice_number', 'created_at', 'updated_at')
+        read_only_fields = ('invoice_number', 'pdf_file', 'pdf_hash', 'created_at', 'updated_at')
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     client_details = ClientSerializer(source='client', read_only=True)
     created_by_details = UserSerializer(source='created_by', read_only=True)
     
+    select_related_fields = (
+        ('client', 'created_by')
+        + ClientSerializer.nested_select_related('client')
+        + UserSerializer.nested_select_related('created_by')
+    )
+    prefetch_related_fields = ClientSerializer.nested_prefetch_related('client')
+    
     class Meta:
         model = Order
         fields = '__all__'
-        read_only_fields = ('order_number', 'grand_total', 'created_at', 'updated_at')
+        read_only_fields = ('order_number', 'grand_total', 'amount_paid', 'balance_due', 'payment_status', 'created_at', 'updated_at')
 
 
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderDetailSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     client_details = ClientSerializer(source='client', read_only=True)
     created_by_details = UserSerializer(source='created_by', read_only=True)
     items = OrderItemSerializer(many=True, read_only=True)
     payments = PaymentSerializer(many=True, read_only=True)
     invoice = InvoiceSerializer(read_only=True)
     
+    select_related_fields = OrderSerializer.select_related_fields + ('invoice',)
+    prefetch_related_fields = OrderSerializer.prefetch_related_fields + (
+        Prefetch('items', queryset=OrderItemSerializer.setup_eager_loading(OrderItem.objects.all())),
+        Prefetch('payments', queryset=PaymentSerializer.setup_eager_loading(Payment.objects.all())),
+    )
+    
     class Meta:
         model = Order
         fields = '__all__'
-        read_only_fields = ('order_number', 'grand_total', 'created_at', 'updated_at')
+        read_only_fields = ('order_number', 'grand_total', 'amount_paid', 'balance_due', 'payment_status', 'created_at', 'updated_at')
+
+
+class OrderItemWriteSerializer(serializers.ModelSerializer):
+    """Nested order item input; `id` identifies existing items on update."""
+    id = serializers.IntegerField(required=False)
+    
+    class Meta:
+        model = OrderItem
+        exclude = ('order', 'subtotal', 'created_at', 'updated_at')
 
 
 class OrderCreateSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
+    items = OrderItemWriteSerializer(many=True)
+    
+    # Fields written by the item diff in update()
+    ITEM_UPDATE_FIELDS = [
+        'instrument', 'quantity', 'unit_price', 'rental_start_date',
+        'rental_end_date', 'rental_duration_days', 'subtotal', 'updated_at',
+    ]
     
     class Meta:
         model = Order
         fields = '__all__'
-        read_only_fields = ('order_number', 'grand_total', 'created_at', 'updated_at', 'created_by')
+        read_only_fields = ('order_number', 'grand_total', 'amount_paid', 'balance_due', 'payment_status', 'created_at', 'updated_at', 'created_by')
     
     def create(self, validated_data):
         items_data = validated_data.pop('items')
+        order_type = validated_data.get('order_type')
         
-        # Calculate total amount from items
-        total_amount = sum(item.get('unit_price', 0) * item.get('quantity', 1) for item in items_data)
-        
-        # For rental items, multiply by duration
-        for item in items_data:
-            if validated_data.get('order_type') == 'rental' and item.get('rental_duration_days'):
-                total_amount += item.get('unit_price', 0) * item.get('quantity', 1) * item.get('rental_duration_days')
-        
-        validated_data['total_amount'] = total_amount
+        # Build items and their subtotals in memory
+        items = []
+        for item_data in items_data:
+            item_data.pop('id', None)
+            item = OrderItem(**item_data)
+            item.subtotal = item.calculate_subtotal(order_type)
+            items.append(item)
         
-        # Create order
-        order = Order.objects.create(**validated_data)
+        validated_data['total_amount'] = sum((item.subtotal for item in items), Decimal('0'))
         
-        # Create order items
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
+        with transaction.atomic():
+            order = Order.objects.create(**validated_data)
+            
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+            touch(OrderItem)
         
         return order
     
@@ -90,26 +130,53 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         
-        if items_data is not None:
-            # Delete existing items
-            instance.items.all().delete()
+        with transaction.atomic():
+            if items_data is not None:
+                instance.total_amount = self._sync_items(instance, items_data)
             
-            # Create new items
-            for item_data in items_data:
-                OrderItem.objects.create(order=instance, **item_data)
-            
-            # Recalculate total amount
-            total_amount = sum(item.get('unit_price', 0) * item.get('quantity', 1) for item in items_data)
+            instance.save()
+        
+        return instance
+    
+    def _sync_items(self, order, items_data):
+        """
+        Apply the submitted items to the order as an insert/update/delete diff
+        keyed by item id and return the new total amount.
+        """
+        existing = {item.id: item for item in order.items.all()}
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        
+        for item_data in items_data:
+            item_id = item_data.pop('id', None)
             
-            # For rental items, multiply by duration
-            for item in items_data:
-                if instance.order_type == 'rental' and item.get('rental_duration_days'):
-                    total_amount += item.get('unit_price', 0) * item.get('quantity', 1) * item.get('rental_duration_days')
+            if item_id is None:
+                item = OrderItem(order=order, **item_data)
+                to_create.append(item)
+            elif item_id in existing:
+                item = existing.pop(item_id)
+                for attr, value in item_data.items():
+                    setattr(item, attr, value)
+                item.updated_at = now
+                to_update.append(item)
+            else:
+                raise serializers.ValidationError(
+                    {"items": [f"Item {item_id} does not belong to this order."]}
+                )
             
-            instance.total_amount = total_amount
+            item.subtotal = item.calculate_subtotal(order.order_type)
         
-        instance.save()
-        return instance
+        # Items left over were removed from the order
+        if existing:
+            OrderItem.objects.filter(pk__in=existing.keys()).delete()
+        if to_update:
+            OrderItem.objects.bulk_update(to_update, self.ITEM_UPDATE_FIELDS)
+        if to_create:
+            OrderItem.objects.bulk_create(to_create)
+        touch(OrderItem)
+        
+        return sum((item.subtotal for item in to_update + to_create), Decimal('0'))
 
 
 class PaymentCreateSerializer(serializers.ModelSerializer):
@@ -123,4 +190,4 @@ class InvoiceCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = '__all__'
-        read_only_fields = ('invoice_number', 'created_at', 'updated_at') 
\ No newline at end of file
+        read_only_fields = ('invoice_number', 'pdf_file', 'pdf_hash', 'created_at', 'updated_at') 
\ No newline at end of file
@@ -0,0 +1,183 @@
+import logging
+
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from instruments.availability import index as availability_index
+from clients.models import Client
+from . import rollups, search
+from .ledger import PaymentState, payment_state, post_payment_change, reconcile_order
+from .models import Invoice, Order, OrderItem, Payment
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_state(sender, instance, **kwargs):
+    """
+    Keep the loaded state of a payment so saves can post only the change.
+    """
+    values = instance.__dict__
+    if all(field in values for field in PaymentState._fields):
+        instance._ledger_state = payment_state(instance)
+    else:
+        # Deferred fields; the previous state is unknown
+        instance._ledger_state = None
+
+
+@receiver(post_save, sender=Payment)
+def post_payment_to_ledger(sender, instance, created, raw=False, **kwargs):
+    """
+    Update the order's running payment totals after a payment is saved.
+    """
+    if raw:
+        return
+    
+    after = payment_state(instance)
+    if created:
+        post_payment_change(None, after)
+    elif instance._ledger_state is not None:
+        post_payment_change(instance._ledger_state, after)
+    else:
+        reconcile_order(instance.order_id)
+    instance._ledger_state = after
+
+
+@receiver(post_delete, sender=Payment)
+def reverse_payment_from_ledger(sender, instance, **kwargs):
+    """
+    Remove a deleted payment from the order's running payment totals.
+    """
+    if instance._ledger_state is not None:
+        post_payment_change(instance._ledger_state, None)
+    else:
+        reconcile_order(instance.order_id)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_item_availability(sender, instance, **kwargs):
+    """
+    Update the rental availability index once the item change is committed.
+    """
+    item_id = instance.pk
+    transaction.on_commit(lambda: availability_index.refresh_items([item_id]))
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_availability(sender, instance, raw=False, **kwargs):
+    """
+    Re-index an order's items after it changes, e.g. when it is cancelled or
+    its items were written in bulk.
+    """
+    if raw:
+        return
+    
+    order_id = instance.pk
+    transaction.on_commit(lambda: availability_index.refresh_order(order_id))
+
+
+SEARCH_KINDS = {
+    Order: 'order',
+    Invoice: 'invoice',
+    Payment: 'payment',
+}
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Payment)
+def index_for_search(sender, instance, raw=False, **kwargs):
+    """
+    Update the object's search entry in the same transaction as the save.
+    A failing index write is logged and leaves the entry stale (see the
+    rebuild_search_index command) rather than failing the save.
+    """
+    if raw:
+        return
+    try:
+        # Savepoint, so a failed write doesn't abort the save's transaction
+        with transaction.atomic():
+            search.index_ids(SEARCH_KINDS[sender], [instance.pk])
+    except DatabaseError:
+        logger.exception("Indexing %s %s for search failed", SEARCH_KINDS[sender], instance.pk)
+
+
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Payment)
+def remove_from_search(sender, instance, **kwargs):
+    search.remove_ids(SEARCH_KINDS[sender], [instance.pk])
+
+
+@receiver(post_save, sender=Client)
+def reindex_client_documents(sender, instance, created, raw=False, **kwargs):
+    """
+    Client names are part of the search text of their orders, invoices and
+    payments.
+    """
+    if raw or created:
+        return
+    search.index_objects('order', Order.objects.filter(client=instance))
+    search.index_objects('invoice', Invoice.objects.filter(order__client=instance))
+    search.index_objects('payment', Payment.objects.filter(order__client=instance))
+
+
+@receiver(post_init, sender=Order)
+def remember_order_bucket(sender, instance, **kwargs):
+    """
+    Keep the revenue bucket a loaded order was in, in case it moves.
+    """
+    values = instance.__dict__
+    if 'order_date' in values and 'client_id' in values and values['order_date'] is not None:
+        instance._rollup_bucket = (rollups.local_day(values['order_date']), values['client_id'])
+    else:
+        instance._rollup_bucket = None
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_bucket(sender, instance, **kwargs):
+    values = instance.__dict__
+    if 'payment_date' in values and 'order_id' in values and values['payment_date'] is not None:
+        instance._rollup_bucket = (values['payment_date'], values['order_id'])
+    else:
+        instance._rollup_bucket = None
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def roll_up_order(sender, instance, raw=False, **kwargs):
+    """
+    Recompute the revenue rollups of the order's day and client, before and
+    after the change, once it is committed.
+    """
+    if raw:
+        return
+    buckets = {(rollups.local_day(instance.order_date), instance.client_id)}
+    if instance._rollup_bucket is not None:
+        buckets.add(instance._rollup_bucket)
+    rollups.mark(buckets)
+    instance._rollup_bucket = (rollups.local_day(instance.order_date), instance.client_id)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def roll_up_order_item(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rollups.mark_orders([instance.order_id])
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def roll_up_payment(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    payments = {(instance.payment_date, instance.order_id)}
+    if instance._rollup_bucket is not None:
+        payments.add(instance._rollup_bucket)
+    rollups.mark_payment_orders(payments)
+    instance._rollup_bucket = (instance.payment_date, instance.order_id)
+
@@ -0,0 +1,294 @@
+"""
+Bulk import of bank and UPI statements into payments.
+
+Statements are read row by row from CSV or NDJSON and processed in fixed
+size chunks, so memory use does not grow with the file. For each chunk:
+
+- rows whose transaction_id matches a pending payment of the same amount
+  (and order, when the row names one) complete it,
+- rows matching an order by order_number become new payments, written
+  with one bulk_create,
+- everything else is written to the unmatched report with a reason.
+
+Rows that aren't objects are rejected like any other bad row. A file
+that can't be read any further (bad encoding, broken CSV quoting) ends
+the import there, with the reason in the report.
+
+A row is recognised as already imported by its transaction_id or, when
+it has none, by its order, amount, date and method, so importing the
+same statement twice doesn't post its payments twice.
+
+Order totals and payment_status for the affected orders are then
+recomputed with set-based UPDATEs from orders.ledger, the new payments
+are added to the search index and their revenue rollups are refreshed.
+"""
+import csv
+import io
+import json
+from collections import Counter
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from hospital_management.table_versions import touch
+from . import rollups, search
+from .ledger import mark_paid_invoices, reconcile_orders
+from .models import Order, Payment
+
+
+STATEMENT_FIELDS = ['transaction_id', 'order_number', 'amount', 'payment_method', 'payment_date', 'notes']
+UNMATCHED_FIELDS = STATEMENT_FIELDS + ['reason']
+STATEMENT_FORMATS = ('csv', 'ndjson')
+
+# Private files directory (hospital_management.private_files) of uploaded statements' reports
+UNMATCHED_REPORT_DIR = 'statements/unmatched'
+
+PAYMENT_METHODS = {method for method, label in Payment.PAYMENT_METHODS}
+
+
+def read_csv(stream):
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    yield from csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    for line in stream:
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                yield {'notes': line.decode('utf-8', errors='replace').strip(), '_error': 'Line is not valid UTF-8'}
+                continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield {'notes': line, '_error': 'Invalid JSON line'}
+            continue
+        if not isinstance(row, dict):
+            yield {'notes': line, '_error': 'Line is not a JSON object'}
+            continue
+        yield row
+
+
+def read_statement(stream, statement_format):
+    """Iterate over the rows of a statement file as dicts."""
+    if statement_format == 'csv':
+        return read_csv(stream)
+    if statement_format == 'ndjson':
+        return read_ndjson(stream)
+    raise ValueError(f"Unsupported statement format: {statement_format}")
+
+
+def guess_format(filename):
+    return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class StatementImport:
+    """
+    Imports statement rows as payments.
+
+    `unmatched` is an optional text stream that receives a CSV report of
+    the rows that were not imported.
+    """
+
+    def __init__(self, created_by=None, chunk_size=1000, unmatched=None, default_method='bank_transfer'):
+        self.created_by = created_by
+        self.chunk_size = chunk_size
+        self.default_method = default_method
+        self.stats = Counter()
+        self.report = None
+        if unmatched is not None:
+            self.report = csv.DictWriter(unmatched, fieldnames=UNMATCHED_FIELDS, extrasaction='ignore')
+            self.report.writeheader()
+
+    def run(self, rows):
+        """
+        Import `rows` and return the stats. Raises ValueError if the file
+        can't be read at all; nothing was imported then.
+        """
+        for chunk in chunked(self.read(rows), self.chunk_size):
+            self.import_chunk(chunk)
+        return dict(self.stats)
+
+    def read(self, rows):
+        rows = iter(rows)
+        started = False
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            except (ValueError, csv.Error) as e:
+                if not started:
+                    raise ValueError(str(e)) from e
+                # Earlier chunks are already imported; report where reading stopped
+                self.stats['rows'] += 1
+                self.reject({}, f"Cannot read the statement from here on: {e}")
+                return
+            started = True
+            yield row
+
+    def reject(self, row, reason):
+        self.stats['unmatched'] += 1
+        if self.report is not None:
+            self.report.writerow({**{field: row.get(field) for field in STATEMENT_FIELDS}, 'reason': reason})
+
+    def parse_row(self, row):
+        if row.get('_error'):
+            raise ValueError(row['_error'])
+
+        try:
+            amount = Decimal(str(row.get('amount') or '').replace(',', ''))
+        except InvalidOperation:
+            raise ValueError('Invalid amount')
+        if amount <= 0:
+            raise ValueError('Amount must be positive')
+
+        raw_date = str(row.get('payment_date') or '').strip()
+        if raw_date:
+            parsed = parse_datetime(raw_date)
+            if parsed is None:
+                date = parse_date(raw_date)
+                if date is None:
+                    raise ValueError('Invalid payment date')
+                parsed = datetime.combine(date, time.min)
+            payment_date = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+        elif str(row.get('transaction_id') or '').strip():
+            payment_date = timezone.now()
+        else:
+            # Nothing would tell a second import of the row from a new payment
+            raise ValueError('A row without a transaction_id needs a payment_date')
+
+        method = str(row.get('payment_method') or '').strip()
+        return {
+            'transaction_id': str(row.get('transaction_id') or '').strip() or None,
+            'order_number': str(row.get('order_number') or '').strip(),
+            'amount': amount,
+            'payment_method': method if method in PAYMENT_METHODS else self.default_method,
+            'payment_date': payment_date,
+            'notes': row.get('notes') or None,
+        }
+
+    def recorded_without_id(self, rows, orders):
+        """(order id, amount, date, method) of the payments without a transaction_id matching `rows`."""
+        order_ids = {orders[data['order_number']] for data in rows if data['order_number'] in orders}
+        if not order_ids:
+            return set()
+        return set(
+            Payment.objects.filter(
+                Q(transaction_id__isnull=True) | Q(transaction_id=''),
+                order_id__in=order_ids,
+                payment_date__in={data['payment_date'] for data in rows},
+            ).values_list('order_id', 'amount', 'payment_date', 'payment_method')
+        )
+
+    def import_chunk(self, rows):
+        parsed = []
+        for row in rows:
+            self.stats['rows'] += 1
+            try:
+                parsed.append((row, self.parse_row(row)))
+            except ValueError as e:
+                self.reject(row, str(e))
+
+        transaction_ids = {data['transaction_id'] for row, data in parsed if data['transaction_id']}
+        existing = {
+            transaction_id: (status, amount, order_number)
+            for transaction_id, status, amount, order_number in Payment.objects.filter(
+                transaction_id__in=transaction_ids,
+            ).values_list('transaction_id', 'status', 'amount', 'order__order_number')
+        }
+        orders = dict(
+            Order.objects.filter(order_number__in={data['order_number'] for row, data in parsed})
+            .values_list('order_number', 'pk')
+        )
+        recorded = self.recorded_without_id(
+            [data for row, data in parsed if not data['transaction_id']], orders,
+        )
+
+        to_create = []
+        to_complete = set()
+        seen = set()
+
+        for row, data in parsed:
+            transaction_id = data['transaction_id']
+
+            if transaction_id:
+                if transaction_id in seen:
+                    self.reject(row, 'Duplicate transaction in statement')
+                    continue
+                seen.add(transaction_id)
+
+                if transaction_id in existing:
+                    status, amount, order_number = existing[transaction_id]
+                    if status != 'pending':
+                        self.reject(row, 'Transaction already recorded')
+                    elif amount != data['amount']:
+                        self.reject(row, 'Amount differs from the pending payment')
+                    elif data['order_number'] and data['order_number'] != order_number:
+                        self.reject(row, 'Order differs from the pending payment')
+                    else:
+                        to_complete.add(transaction_id)
+                    continue
+
+            order_id = orders.get(data['order_number'])
+            if order_id is None:
+                self.reject(row, 'No matching order')
+                continue
+
+            if not transaction_id:
+                identity = (order_id, data['amount'], data['payment_date'], data['payment_method'])
+                if identity in seen or identity in recorded:
+                    self.reject(row, 'Payment already recorded')
+                    continue
+                seen.add(identity)
+
+            to_create.append(Payment(
+                order_id=order_id,
+                payment_method=data['payment_method'],
+                amount=data['amount'],
+                transaction_id=transaction_id,
+                payment_date=data['payment_date'],
+                status='completed',
+                notes=data['notes'],
+                created_by=self.created_by,
+            ))
+
+        with transaction.atomic():
+            Payment.objects.bulk_create(to_create)
+            touch(Payment)
+            search.index_ids('payment', [payment.pk for payment in to_create])
+            rollups.mark_payments([payment.pk for payment in to_create])
+            order_ids = {payment.order_id for payment in to_create}
+
+            if to_complete:
+                pending = Payment.objects.filter(transaction_id__in=to_complete, status='pending')
+                order_ids.update(pending.values_list('order_id', flat=True))
+                rollups.mark_payments(pending.values_list('pk', flat=True))
+                completed = pending.update(status='completed', updated_at=timezone.now())
+                self.stats['completed'] += completed
+
+            if order_ids:
+                affected = Order.objects.filter(pk__in=order_ids)
+                reconcile_orders(affected)
+                mark_paid_invoices(affected)
+
+        self.stats['created'] += len(to_create)
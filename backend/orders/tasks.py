@@ -0,0 +1,10 @@
+from celery import shared_task
+
+from .invoice_pdf import render_invoices
+from .models import Invoice
+
+
+@shared_task(name='orders.render_invoice_pdfs')
+def render_invoice_pdfs(invoice_ids):
+    results = render_invoices(Invoice.objects.filter(pk__in=invoice_ids))
+    return [invoice.pk for invoice, rendered in results if rendered]
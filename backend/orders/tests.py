@@ -1,3 +1,417 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import IntegrityError, connection, transaction
+from django.conf import settings as settings_module
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from clients.models import Client, ClientAddress, ClientContact
+from hospital_management.pagination import KeysetPagination
+from hospital_management.testing import QueryCountMixin
+from instruments.models import Instrument, InstrumentCategory
+from . import invoice_pdf, rollups
+from .ledger import adjust_order
+from .models import Invoice, Order, OrderItem, Payment, RevenueRollup
+
+
+class ListQueryCountTests(QueryCountMixin, TestCase):
+    """List endpoints read a page in the same number of queries whatever its size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        category = InstrumentCategory.objects.create(name='Imaging')
+
+        for i in range(6):
+            user = User.objects.create_user(email=f'client{i}@example.com', password='password')
+            client = Client.objects.create(
+                user=user, hospital_name=f'Hospital {i}', hospital_type='private', registration_number=f'REG{i}',
+            )
+            ClientContact.objects.create(
+                client=client, name='Contact', position='Manager', email=f'contact{i}@example.com', phone='123',
+            )
+            ClientAddress.objects.create(
+                client=client, street_address='1 Main Road', city='Pune', state='MH', postal_code='411001',
+            )
+            instrument = Instrument.objects.create(
+                name=f'Monitor {i}', serial_number=f'SN{i}', category=category, purchase_date=date(2026, 1, 1),
+                purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+            )
+            order = Order.objects.create(
+                order_number=f'ORD{i}', client=client, order_type='rental', total_amount=Decimal('100'),
+                tax_amount=Decimal('0'), grand_total=Decimal('100'), created_by=cls.admin,
+            )
+            OrderItem.objects.create(
+                order=order, instrument=instrument, unit_price=Decimal('10'), subtotal=Decimal('100'),
+                rental_start_date=date(2026, 2, 1), rental_end_date=date(2026, 2, 1) + timedelta(days=10),
+                rental_duration_days=10,
+            )
+            Payment.objects.create(
+                order=order, payment_method='cash', amount=Decimal('50'), status='completed', created_by=cls.admin,
+            )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def test_order_list(self):
+        self.assertFixedQueryCount(reverse('order-list'))
+
+    def test_order_list_keyset(self):
+        self.assertFixedQueryCount(reverse('order-list') + '?pagination=keyset')
+
+    def test_order_item_list(self):
+        self.assertFixedQueryCount(reverse('order-item-list'))
+
+    def test_payment_list(self):
+        self.assertFixedQueryCount(reverse('payment-list'))
+
+
+class AdjustOrderTests(TestCase):
+    """adjust_order() works out payment_status from the amount paid before the update."""
+
+    @classmethod
+    def setUpTestData(cls):
+        admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        user = User.objects.create_user(email='client@example.com', password='password')
+        client = Client.objects.create(
+            user=user, hospital_name='Hospital', hospital_type='private', registration_number='REG1',
+        )
+        cls.order = Order.objects.create(
+            order_number='ORD1', client=client, order_type='sale', total_amount=Decimal('100'),
+            tax_amount=Decimal('0'), grand_total=Decimal('100'), created_by=admin,
+        )
+
+    def test_payment_status_set_before_amount_paid(self):
+        with CaptureQueriesContext(connection) as queries:
+            adjust_order(self.order.pk, Decimal('60'))
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "orders_order"'))
+        self.assertLess(update.index('"payment_status" ='), update.index('"amount_paid" ='))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount_paid, Decimal('60'))
+        self.assertEqual(self.order.payment_status, 'partial')
+
+    def test_save_keeps_ledger_fields(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        adjust_order(self.order.pk, Decimal('100'))
+        stale.notes = 'Delivered'
+        stale.save()
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.amount_paid, self.order.payment_status), (Decimal('100'), 'paid'))
+        self.assertEqual(self.order.notes, 'Delivered')
+
+    def test_save_recomputes_status_with_grand_total(self):
+        adjust_order(self.order.pk, Decimal('100'))
+        order = Order.objects.get(pk=self.order.pk)
+        order.total_amount = Decimal('150')
+        order.save()
+
+        order.refresh_from_db()
+        self.assertEqual((order.balance_due, order.payment_status), (Decimal('50'), 'partial'))
+
+
+class RevenueRollupWriteTests(TestCase):
+    """Refreshing and rebuilding rollups update one row per bucket key."""
+
+    @classmethod
+    def setUpTestData(cls):
+        admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        user = User.objects.create_user(email='client@example.com', password='password')
+        cls.client_record = Client.objects.create(
+            user=user, hospital_name='Hospital', hospital_type='private', registration_number='REG1',
+        )
+        cls.category = InstrumentCategory.objects.create(name='Imaging')
+        instrument = Instrument.objects.create(
+            name='Monitor', serial_number='SN1', category=cls.category, purchase_date=date(2026, 1, 1),
+            purchase_price=Decimal('1000'), rental_price_per_day=Decimal('10'), selling_price=Decimal('1500'),
+        )
+        cls.order = Order.objects.create(
+            order_number='ORD1', client=cls.client_record, order_type='sale', total_amount=Decimal('100'),
+            tax_amount=Decimal('0'), grand_total=Decimal('100'), created_by=admin,
+        )
+        OrderItem.objects.create(
+            order=cls.order, instrument=instrument, unit_price=Decimal('100'), subtotal=Decimal('100'),
+        )
+        cls.day = rollups.local_day(Order.objects.get(pk=cls.order.pk).order_date)
+
+    def test_refresh_and_rebuild_update_in_place(self):
+        rollups.refresh({(self.day, self.client_record.pk)})
+        ids = set(RevenueRollup.objects.values_list('pk', flat=True))
+        self.assertEqual(len(ids), 2)
+
+        Order.objects.filter(pk=self.order.pk).update(grand_total=Decimal('120'))
+        rollups.refresh({(self.day, self.client_record.pk)})
+        rollups.rebuild(self.day, self.day)
+
+        self.assertEqual(set(RevenueRollup.objects.values_list('pk', flat=True)), ids)
+        self.assertEqual(RevenueRollup.objects.get(category__isnull=True).booked, Decimal('120'))
+
+    def test_order_level_rows_are_unique(self):
+        rollups.refresh({(self.day, self.client_record.pk)})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RevenueRollup.objects.create(day=self.day, client=self.client_record, order_type='sale')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RevenueRollup.objects.create(
+                day=self.day, client=self.client_record, order_type='sale', category=self.category,
+            )
+
+
+class StatementImportTests(TestCase):
+    """Statement imports reject bad rows, stop at unreadable data and keep their reports private."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        user = User.objects.create_user(email='client@example.com', password='password')
+        client = Client.objects.create(
+            user=user, hospital_name='Hospital', hospital_type='private', registration_number='REG1',
+        )
+        cls.order = Order.objects.create(
+            order_number='ORD1', client=client, order_type='sale', total_amount=Decimal('100'),
+            tax_amount=Decimal('0'), grand_total=Decimal('100'), created_by=cls.admin,
+        )
+        Payment.objects.create(
+            order=cls.order, payment_method='upi', amount=Decimal('30'), status='pending',
+            transaction_id='UPI1', created_by=cls.admin,
+        )
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(PRIVATE_FILES_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def upload(self, name, content):
+        return self.api.post(reverse('payment-import-statement'), {
+            'file': SimpleUploadedFile(name, content),
+        }, format='multipart')
+
+    def test_unmatched_report_is_private(self):
+        response = self.upload('statement.csv', (
+            b'transaction_id,order_number,amount,payment_method,payment_date\n'
+            b'BANK1,ORD1,40,bank_transfer,2026-03-01\n'
+            b'BANK2,ORD404,40,bank_transfer,2026-03-01\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['unmatched']), (1, 1))
+        url = response.data['unmatched_report']
+        self.assertNotIn(settings_module.MEDIA_URL, url)
+
+        report = self.api.get(url)
+        self.assertEqual(report.status_code, 200)
+        self.assertIn(b'No matching order', b''.join(report.streaming_content))
+        self.assertEqual(APIClient().get(url).status_code, 401)
+        self.assertEqual(self.api.get(reverse('payment-unmatched-report', args=['x' * 32])).status_code, 404)
+
+    def test_pending_payments(self):
+        response = self.upload('statement.csv', (
+            b'transaction_id,order_number,amount\n'
+            b'UPI1,ORD1,35\n'
+            b'UPI1,ORD1,30\n'
+        ))
+        self.assertEqual((response.data.get('completed', 0), response.data['unmatched']), (0, 2))
+        response = self.upload('statement.csv', b'transaction_id,order_number,amount\nUPI1,ORD1,30\n')
+        self.assertEqual(response.data['completed'], 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.amount_paid, Decimal('30'))
+
+    def test_rows_without_transaction_id_import_once(self):
+        content = b'order_number,amount,payment_method,payment_date\nORD1,20,cash,2026-03-01\n'
+        self.assertEqual(self.upload('statement.csv', content).data['created'], 1)
+        response = self.upload('statement.csv', content)
+        self.assertEqual((response.data.get('created', 0), response.data['unmatched']), (0, 1))
+
+    def test_ndjson_rows_that_are_not_objects(self):
+        response = self.upload('statement.ndjson', (
+            b'[1, 2]\n'
+            b'"text"\n'
+            b'{"order_number": "ORD1", "amount": "10", "transaction_id": "\xff"}\n'
+            b'{"order_number": "ORD1", "amount": "10", "transaction_id": "BANK3"}\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['unmatched']), (1, 3))
+
+    def test_unreadable_csv(self):
+        self.assertEqual(self.upload('statement.csv', b'order_number,amount\n\xff\xfe,10\n').status_code, 400)
+
+        rows = b''.join(b'BANK%d,ORD1,1,bank_transfer\n' % i for i in range(1000))
+        response = self.upload('statement.csv', (
+            b'transaction_id,order_number,amount,payment_method\n' + rows + b'BAD,ORD1,1,\xff\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['created'], 0)
+        self.assertEqual(response.data['unmatched'], 1)
+        report = b''.join(self.api.get(response.data['unmatched_report']).streaming_content)
+        self.assertIn(b'Cannot read the statement from here on', report)
+
+
+class InvoicePdfTests(TestCase):
+    """Invoice PDFs are rendered when their content changes, in one pool per process."""
+
+    @classmethod
+    def setUpTestData(cls):
+        admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        user = User.objects.create_user(email='client@example.com', password='password')
+        client = Client.objects.create(
+            user=user, hospital_name='Hospital', hospital_type='private', registration_number='REG1',
+        )
+        cls.invoices = []
+        for i in range(2):
+            order = Order.objects.create(
+                order_number=f'ORD{i}', client=client, order_type='sale', total_amount=Decimal('100'),
+                tax_amount=Decimal('0'), grand_total=Decimal('100'), created_by=admin,
+            )
+            cls.invoices.append(Invoice.objects.create(
+                order=order, invoice_number=f'INV{i}', due_date=date(2026, 4, 1), billing_address='1 Main Road',
+            ))
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root, INVOICE_PDF_WORKERS=1)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def rendered(self):
+        return {invoice.invoice_number: rendered for invoice, rendered in invoice_pdf.render_invoices()}
+
+    def test_renders_changed_invoices_only(self):
+        self.assertEqual(self.rendered(), {'INV0': True, 'INV1': True})
+        self.assertEqual(self.rendered(), {'INV0': False, 'INV1': False})
+
+        Invoice.objects.filter(pk=self.invoices[1].pk).update(notes='Net 30')
+        self.assertEqual(self.rendered(), {'INV0': False, 'INV1': True})
+        self.assertTrue(Invoice.objects.get(pk=self.invoices[1].pk).pdf_file.read().startswith(b'%PDF'))
+
+    def test_shared_pool(self):
+        with mock.patch.object(invoice_pdf, '_pool', None), override_settings(INVOICE_PDF_WORKERS=3):
+            pool, workers = invoice_pdf.shared_pool()
+            self.addCleanup(pool.shutdown)
+            self.assertEqual(workers, 3)
+            self.assertIs(invoice_pdf.shared_pool()[0], pool)
+
+    def test_export_uses_shared_pool(self):
+        api = APIClient()
+        api.force_authenticate(User.objects.get(email='admin@example.com'))
+        pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        month = f"{self.invoices[0].invoice_date:%Y-%m}"
+        with override_settings(INVOICE_PDF_WORKERS=2), \
+                mock.patch.object(invoice_pdf, 'shared_pool', return_value=(pool, 2)) as shared_pool, \
+                mock.patch.object(invoice_pdf, 'ProcessPoolExecutor', side_effect=AssertionError):
+            response = api.get(reverse('invoice-export'), {'month': month})
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        shared_pool.assert_called_once()
+        self.assertEqual(archive.namelist(), ['INV0.pdf', 'INV1.pdf', 'index.csv'])
+        self.assertTrue(archive.read('INV1.pdf').startswith(b'%PDF'))
+
+
+class SearchTests(TestCase):
+    """Searches are answered from the index, ranked, and stay inside the user's own records."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        cls.users = []
+        cls.orders = []
+        cls.invoices = []
+        cls.payments = []
+        for i, name in enumerate(['Sunrise Clinic', 'Lakeside Hospital']):
+            user = User.objects.create_user(email=f'client{i}@example.com', password='password')
+            client = Client.objects.create(
+                user=user, hospital_name=name, hospital_type='private', registration_number=f'REG{i}',
+            )
+            order = Order.objects.create(
+                order_number=f'ORD-2026-{i + 1:04d}', client=client, order_type='rental',
+                total_amount=Decimal('100'), tax_amount=Decimal('0'), grand_total=Decimal('100'),
+                notes='Ventilator rental', created_by=cls.admin,
+            )
+            cls.users.append(user)
+            cls.orders.append(order)
+            cls.invoices.append(Invoice.objects.create(
+                order=order, invoice_number=f'INV-2026-{i + 1:04d}', due_date=date(2026, 4, 1),
+                billing_address='1 Main Road',
+            ))
+            cls.payments.append(Payment.objects.create(
+                order=order, payment_method='bank_transfer', amount=Decimal('50'), status='completed',
+                transaction_id=f'TXN{i}ABC', created_by=cls.admin,
+            ))
+        # Mentions the second order, whose own number should still rank first
+        cls.orders[0].notes = 'Follow-up of ORD-2026-0002'
+        cls.orders[0].save()
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def search(self, name, text, user=None):
+        if user is not None:
+            self.api.force_authenticate(user)
+        response = self.api.get(reverse(name), {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_each_kind(self):
+        self.assertEqual(self.search('order-list', 'sunrise'), [self.orders[0].pk])
+        self.assertEqual(self.search('invoice-list', 'INV-2026-0002'), [self.invoices[1].pk])
+        # Prefixes of numbers, with or without their punctuation
+        self.assertEqual(
+            sorted(self.search('invoice-list', 'INV2026')), sorted(invoice.pk for invoice in self.invoices),
+        )
+        self.assertEqual(self.search('payment-list', 'txn1'), [self.payments[1].pk])
+        self.assertEqual(self.search('payment-list', 'lakeside'), [self.payments[1].pk])
+
+    def test_ranking(self):
+        self.assertEqual(self.search('order-list', 'ORD-2026-0002'), [self.orders[1].pk, self.orders[0].pk])
+
+    def test_keyset_pages_follow_the_rank(self):
+        url = reverse('order-list') + '?pagination=keyset&search=ORD-2026-0002'
+        ids = []
+        with mock.patch.object(KeysetPagination, 'page_size', 1):
+            while url:
+                response = self.api.get(url)
+                self.assertEqual(response.status_code, 200)
+                ids.extend(row['id'] for row in response.data['results'])
+                url = response.data['next']
+        self.assertEqual(ids, [self.orders[1].pk, self.orders[0].pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        order = self.orders[1]
+        order.notes = 'Dialysis machines'
+        order.save()
+        self.assertEqual(self.search('order-list', 'dialysis'), [order.pk])
+        self.assertEqual(self.search('order-list', 'ventilator'), [])
+
+        client = order.client
+        client.hospital_name = 'Riverside Hospital'
+        client.save()
+        self.assertEqual(self.search('invoice-list', 'riverside'), [self.invoices[1].pk])
+        self.assertEqual(self.search('invoice-list', 'lakeside'), [])
+
+        self.payments[1].delete()
+        self.assertEqual(self.search('payment-list', 'txn1'), [])
+        self.invoices[1].delete()
+        self.assertEqual(self.search('invoice-list', 'riverside'), [])
+
+    def test_client_sees_own_records_only(self):
+        client = self.users[0]
+        self.assertEqual(self.search('order-list', 'ORD2026', user=client), [self.orders[0].pk])
+        self.assertEqual(self.search('order-list', 'lakeside', user=client), [])
+        self.assertEqual(self.search('invoice-list', 'INV2026', user=client), [self.invoices[0].pk])
+        self.assertEqual(self.search('payment-list', 'TXN', user=client), [self.payments[0].pk])
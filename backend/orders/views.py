@@ -1,18 +1,31 @@
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import viewsets, permissions, status, filters, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Sum
+from django.db import transaction
 from django.utils import timezone
+from django.core.files import File
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated
+import tempfile
 from .models import Order, OrderItem, Payment, Invoice
+from .invoice_export import invoice_zip, month_range
+from .invoice_pdf import current_pdf, schedule_render
+from .search import IndexedSearchFilter
+from .statements import STATEMENT_FORMATS, UNMATCHED_REPORT_DIR, StatementImport, guess_format, read_statement
 from .serializers import (
     OrderSerializer, OrderDetailSerializer, OrderCreateSerializer,
     OrderItemSerializer, PaymentSerializer, PaymentCreateSerializer,
     InvoiceSerializer, InvoiceCreateSerializer
 )
 from accounts.permissions import IsAdminUser, IsStaffUser, IsClientUser
-from instruments.models import Instrument
+from hospital_management import private_files
+from hospital_management.pagination import KeysetOrPageNumberPagination
+from hospital_management.eager_loading import eager_load
+from instruments.services import reserve_for_order, release_for_order
 
 
 class OrderViewSet(viewsets.ModelViewSet):
@@ -20,10 +33,19 @@ class OrderViewSet(viewsets.ModelViewSet):
     API endpoint for managing orders.
     """
     queryset = Order.objects.all()
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['client', 'order_type', 'status', 'payment_status', 'order_date']
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, IndexedSearchFilter]
+    pagination_class = KeysetOrPageNumberPagination
+    filterset_fields = {
+        'client': ['exact'],
+        'order_type': ['exact'],
+        'status': ['exact'],
+        'payment_status': ['exact'],
+        'order_date': ['exact'],
+        'balance_due': ['exact', 'gt', 'gte', 'lt', 'lte'],
+    }
     search_fields = ['order_number', 'client__hospital_name', 'notes']
-    ordering_fields = ['order_date', 'grand_total', 'created_at']
+    search_kind = 'order'
+    ordering_fields = ['order_date', 'grand_total', 'balance_due', 'created_at']
     ordering = ['-order_date']
     
     def get_serializer_class(self):
@@ -41,7 +63,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
     
     def get_queryset(self):
-        queryset = Order.objects.all()
+        queryset = eager_load(Order.objects.all(), self.get_serializer_class())
         
         if self.request.user.is_client:
             try:
@@ -54,22 +76,17 @@ class OrderViewSet(viewsets.ModelViewSet):
         return queryset
     
     def perform_create(self, serializer):
-        # Set created_by to current user
-        serializer.save(created_by=self.request.user)
-        
-        # Update instrument status based on order type
-        order = serializer.instance
-        for item in order.items.all():
-            instrument = item.instrument
+        with transaction.atomic():
+            # Set created_by to current user
+            serializer.save(created_by=self.request.user)
+            
+            # Update instrument status based on order type
+            transition = reserve_for_order(serializer.instance)
             
-            if order.order_type == 'sale':
-                instrument.status = 'sold'
-            elif order.order_type == 'rental':
-                instrument.status = 'rented'
-            elif order.order_type == 'storage':
-                instrument.status = 'stored'
-                
-            instrument.save()
+            if transition.conflicts:
+                raise serializers.ValidationError({
+                    "items": [f"Instruments no longer available: {transition.conflicts}"]
+                })
     
     @action(detail=True, methods=['post'])
     def generate_invoice(self, request, pk=None):
@@ -125,6 +142,7 @@ class OrderViewSet(viewsets.ModelViewSet):
                 shipping_address=shipping_address_text if shipping_address_text else billing_address_text,
                 terms_and_conditions="Payment is due within 30 days of invoice date. Late payments are subject to a 2% monthly interest charge."
             )
+            schedule_render([invoice.pk])
             
             serializer = InvoiceSerializer(invoice)
             return Response(serializer.data)
@@ -148,15 +166,13 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update order status
-        order.status = 'cancelled'
-        order.save()
-        
-        # Update instrument status
-        for item in order.items.all():
-            instrument = item.instrument
-            instrument.status = 'available'
-            instrument.save()
+        with transaction.atomic():
+            # Update order status
+            order.status = 'cancelled'
+            order.save()
+            
+            # Update instrument status
+            release_for_order(order)
         
         serializer = self.get_serializer(order)
         return Response(serializer.data)
@@ -168,11 +184,12 @@ class OrderItemViewSet(viewsets.ModelViewSet):
     """
     serializer_class = OrderItemSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['order', 'instrument']
     search_fields = ['order__order_number', 'instrument__name', 'instrument__serial_number']
     
     def get_queryset(self):
-        queryset = OrderItem.objects.all()
+        queryset = eager_load(OrderItem.objects.all(), self.serializer_class)
         
         if self.request.user.is_client:
             try:
@@ -196,9 +213,11 @@ class PaymentViewSet(viewsets.ModelViewSet):
     """
     API endpoint for managing payments.
     """
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, IndexedSearchFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['order', 'payment_method', 'status', 'payment_date']
     search_fields = ['order__order_number', 'transaction_id', 'notes']
+    search_kind = 'payment'
     ordering_fields = ['payment_date', 'amount', 'created_at']
     ordering = ['-payment_date']
     
@@ -208,7 +227,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return PaymentSerializer
     
     def get_queryset(self):
-        queryset = Payment.objects.all()
+        queryset = eager_load(Payment.objects.all(), self.get_serializer_class())
         
         if self.request.user.is_client:
             try:
@@ -221,46 +240,76 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return queryset
     
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action == 'unmatched_report':
+            permission_classes = [IsAuthenticated, IsAdminUser | IsStaffUser]
+        elif self.action in ['create', 'update', 'partial_update', 'destroy', 'import_statement']:
             permission_classes = [IsAdminUser | IsStaffUser]
         else:
             permission_classes = [IsAdminUser | IsStaffUser | IsClientUser]
         return [permission() for permission in permission_classes]
     
     def perform_create(self, serializer):
-        # Set created_by to current user
-        serializer.save(created_by=self.request.user)
-        
-        # Update order payment status
-        payment = serializer.instance
-        order = payment.order
-        
-        # Calculate total paid amount
-        total_paid = Payment.objects.filter(
-            order=order,
-            status='completed'
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Add current payment if it's completed
-        if payment.status == 'completed':
-            total_paid += payment.amount
+        # Set created_by to current user; the order's payment totals are
+        # updated by the ledger signal handlers in the same transaction
+        with transaction.atomic():
+            serializer.save(created_by=self.request.user)
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+    
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def import_statement(self, request):
+        """
+        Import a CSV or NDJSON bank/UPI statement as payments.
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response(
+                {"detail": "No statement file uploaded."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Update order payment status
-        if total_paid >= order.grand_total:
-            order.payment_status = 'paid'
-        elif total_paid > 0:
-            order.payment_status = 'partial'
-        else:
-            order.payment_status = 'pending'
+        statement_format = request.data.get('format') or guess_format(upload.name)
+        if statement_format not in STATEMENT_FORMATS:
+            return Response(
+                {"detail": f"Unsupported statement format: {statement_format}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        order.save()
+        with tempfile.TemporaryFile('w+', newline='') as report:
+            importer = StatementImport(created_by=request.user, unmatched=report)
+            try:
+                stats = importer.run(read_statement(upload.file, statement_format))
+            except ValueError as e:
+                return Response(
+                    {"detail": f"Cannot read the statement: {e}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            report_url = None
+            if stats.get('unmatched'):
+                report.seek(0)
+                # Bank and UPI transactions: a private file, only served by unmatched_report
+                token = private_files.save(UNMATCHED_REPORT_DIR, File(report))
+                report_url = request.build_absolute_uri(reverse('payment-unmatched-report', args=[token]))
         
-        # Update invoice status if it exists
-        if hasattr(order, 'invoice'):
-            invoice = order.invoice
-            if order.payment_status == 'paid':
-                invoice.status = 'paid'
-                invoice.save()
+        return Response({**stats, 'unmatched_report': report_url})
+    
+    @action(detail=False, methods=['get'], url_path=r'unmatched_report/(?P<token>[\w-]+)',
+            url_name='unmatched-report')
+    def unmatched_report(self, request, token=None):
+        """Download the unmatched rows of a statement import."""
+        report = private_files.open_file(UNMATCHED_REPORT_DIR, token)
+        if report is None:
+            return Response({"detail": "No such report."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            report, as_attachment=True, filename='statement-unmatched.csv', content_type='text/csv'
+        )
 
 
 class InvoiceViewSet(viewsets.ModelViewSet):
@@ -268,9 +317,11 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     API endpoint for managing invoices.
     """
     serializer_class = InvoiceSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, IndexedSearchFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['order', 'status', 'invoice_date', 'due_date']
     search_fields = ['invoice_number', 'order__order_number', 'notes']
+    search_kind = 'invoice'
     ordering_fields = ['invoice_date', 'due_date', 'created_at']
     ordering = ['-invoice_date']
     
@@ -288,12 +339,33 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         return queryset
     
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'export']:
             permission_classes = [IsAdminUser | IsStaffUser]
         else:
             permission_classes = [IsAdminUser | IsStaffUser | IsClientUser]
         return [permission() for permission in permission_classes]
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream a ZIP of the PDFs of every invoice dated in `month` (YYYY-MM),
+        rendering missing PDFs on the way in the process's shared renderer
+        pool. The list filters also apply.
+        """
+        month = request.query_params.get('month', '')
+        try:
+            start, end = month_range(month)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        invoices = self.filter_queryset(self.get_queryset()).filter(
+            invoice_date__gte=start,
+            invoice_date__lt=end
+        )
+        response = StreamingHttpResponse(invoice_zip(invoices), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="invoices-{month}.zip"'
+        return response
+    
     @action(detail=True, methods=['post'])
     def send(self, request, pk=None):
         """
@@ -302,6 +374,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         invoice = self.get_object()
         invoice.status = 'sent'
         invoice.save()
+        schedule_render([invoice.pk])
         
         serializer = self.get_serializer(invoice)
         return Response(serializer.data)
@@ -318,7 +391,35 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         # Update order payment status
         order = invoice.order
         order.payment_status = 'paid'
-        order.save()
+        order.save(update_fields=['payment_status', 'updated_at'])
+        schedule_render([invoice.pk])
         
         serializer = self.get_serializer(invoice)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def pdf(self, request, pk=None):
+        """
+        Download the invoice PDF, or queue it for rendering if its content
+        changed since it was last rendered.
+        """
+        invoice = self.get_object()
+        pdf_file = current_pdf(invoice)
+        
+        if pdf_file is None:
+            schedule_render([invoice.pk])
+            response = Response(
+                {"detail": "The invoice PDF is being generated. Please try again shortly."},
+                status=status.HTTP_202_ACCEPTED
+            )
+            response['Retry-After'] = '5'
+            return response
+        
+        response = FileResponse(
+            pdf_file.open('rb'),
+            as_attachment=True,
+            filename=f"{invoice.invoice_number}.pdf",
+            content_type='application/pdf'
+        )
+        response['ETag'] = f'"{pdf_file.instance.pdf_hash}"'
+        return response
@@ -4,10 +4,13 @@ from .models import Report, Dashboard, Widget
 
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
-    list_display = ('title', 'report_type', 'format', 'created_by', 'created_at')
-    list_filter = ('report_type', 'format', 'created_at')
+    list_display = ('title', 'report_type', 'format', 'status', 'progress', 'row_count', 'rows_per_second', 'created_by', 'created_at')
+    list_filter = ('report_type', 'format', 'status', 'created_at')
     search_fields = ('title', 'description')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = (
+        'row_count', 'duration', 'rows_per_second', 'status', 'progress', 'error',
+        'cache_key', 'data_watermark', 'started_at', 'finished_at', 'created_at', 'updated_at',
+    )
     fieldsets = (
         (None, {
             'fields': ('title', 'report_type', 'description')
@@ -16,7 +19,10 @@ class ReportAdmin(admin.ModelAdmin):
             'fields': ('parameters', 'start_date', 'end_date', 'format')
         }),
         ('File', {
-            'fields': ('file',)
+            'fields': ('file', 'row_count', 'duration', 'rows_per_second')
+        }),
+        ('Job', {
+            'fields': ('status', 'progress', 'error', 'started_at', 'finished_at', 'cache_key', 'data_watermark')
         }),
         ('Metadata', {
             'fields': ('created_by', 'created_at', 'updated_at')
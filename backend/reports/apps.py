@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
+    
+    def ready(self):
+        from reports.widget_data import track_sources
+        
+        track_sources()
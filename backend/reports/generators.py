@@ -0,0 +1,377 @@
+"""
+Report generators, one per Report.REPORT_TYPES entry.
+
+A generator describes a report as a list of columns and a queryset read
+with values_list().iterator(), so rows are fetched from the database in
+chunks and handed to a writer (reports.writers) one at a time. Revenue
+figures come from the revenue rollups (orders.rollups) rather than from
+the order tables.
+
+Generators register themselves with @register; run() picks the
+generator for a Report, writes its file and records how many rows were
+written and how fast.
+
+A generator's watermark() summarises the state of the rows it reads (row
+counts and latest updated_at values), so reports.jobs can tell whether an
+earlier file of the same report is still current.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime, time as day_time, timedelta
+
+from django.core.files import File
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from clients.models import Client
+from instruments.models import Instrument
+from orders.models import OrderItem, RevenueRollup
+from orders.rollups import revenue
+from staff.models import Attendance, StaffMember
+from .writers import WRITERS
+
+
+GENERATORS = {}
+
+
+class ReportError(Exception):
+    """Raised when a report can't be generated with the given parameters."""
+
+
+def register(generator):
+    GENERATORS[generator.report_type] = generator
+    return generator
+
+
+def get_generator(report_type):
+    try:
+        return GENERATORS[report_type]
+    except KeyError:
+        raise ReportError(f"There is no generator for '{report_type}' reports.")
+
+
+class ReportGenerator:
+    report_type = None
+    # (header, values_list lookup) pairs
+    columns = ()
+    # Field the report's date range applies to, if any
+    date_field = None
+    date_field_is_datetime = False
+    # Fields whose latest values change whenever the report's rows do
+    watermark_fields = ('updated_at',)
+    chunk_size = 2000
+
+    def __init__(self, start_date=None, end_date=None, parameters=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.parameters = parameters or {}
+
+    def get_columns(self):
+        return self.columns
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def filter_dates(self, queryset):
+        if not self.date_field:
+            return queryset
+        if self.start_date:
+            queryset = queryset.filter(**{f"{self.date_field}__gte": self.bound(self.start_date)})
+        if self.end_date:
+            queryset = queryset.filter(**{f"{self.date_field}__lt": self.bound(self.end_date + timedelta(days=1))})
+        return queryset
+
+    def bound(self, day):
+        if self.date_field_is_datetime:
+            # Whole days in the current time zone
+            return timezone.make_aware(datetime.combine(day, day_time.min))
+        return day
+
+    def rows(self):
+        lookups = [lookup for header, lookup in self.get_columns()]
+        queryset = self.filter_dates(self.get_queryset()).values_list(*lookups)
+        return queryset.iterator(chunk_size=self.chunk_size)
+
+    def count(self):
+        return self.filter_dates(self.get_queryset()).count()
+
+    def watermark_sources(self):
+        """(queryset, fields) pairs covering every table the report reads."""
+        return [(self.filter_dates(self.get_queryset()), self.watermark_fields)]
+
+    def watermark(self):
+        parts = []
+        for queryset, fields in self.watermark_sources():
+            latest = {f"latest_{position}": Max(field) for position, field in enumerate(fields)}
+            values = queryset.order_by().aggregate(rows=Count('pk'), **latest)
+            parts.append(values['rows'])
+            parts.extend(values[name] for name in sorted(latest))
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+@register
+class SalesReport(ReportGenerator):
+    report_type = 'sales'
+    date_field = 'order__order_date'
+    date_field_is_datetime = True
+    columns = (
+        ('Order', 'order__order_number'),
+        ('Order date', 'order__order_date'),
+        ('Status', 'order__status'),
+        ('Client', 'order__client__hospital_name'),
+        ('Instrument', 'instrument__name'),
+        ('Serial number', 'instrument__serial_number'),
+        ('Category', 'instrument__category__name'),
+        ('Quantity', 'quantity'),
+        ('Unit price', 'unit_price'),
+        ('Subtotal', 'subtotal'),
+    )
+    watermark_fields = ('updated_at', 'order__updated_at', 'order__client__updated_at', 'instrument__updated_at')
+    order_type = 'sale'
+
+    def get_queryset(self):
+        queryset = OrderItem.objects.filter(order__order_type=self.order_type).order_by('order__order_date', 'pk')
+        if self.parameters.get('status'):
+            queryset = queryset.filter(order__status=self.parameters['status'])
+        if self.parameters.get('client'):
+            queryset = queryset.filter(order__client_id=self.parameters['client'])
+        return queryset
+
+
+@register
+class RentalsReport(SalesReport):
+    report_type = 'rentals'
+    columns = (
+        ('Order', 'order__order_number'),
+        ('Order date', 'order__order_date'),
+        ('Status', 'order__status'),
+        ('Client', 'order__client__hospital_name'),
+        ('Instrument', 'instrument__name'),
+        ('Serial number', 'instrument__serial_number'),
+        ('Category', 'instrument__category__name'),
+        ('Rental start', 'rental_start_date'),
+        ('Rental end', 'rental_end_date'),
+        ('Days', 'rental_duration_days'),
+        ('Daily rate', 'unit_price'),
+        ('Subtotal', 'subtotal'),
+    )
+    order_type = 'rental'
+
+
+@register
+class InventoryReport(ReportGenerator):
+    report_type = 'inventory'
+    date_field = 'purchase_date'
+    columns = (
+        ('Serial number', 'serial_number'),
+        ('Name', 'name'),
+        ('Category', 'category__name'),
+        ('Status', 'status'),
+        ('Manufacturer', 'manufacturer'),
+        ('Purchase date', 'purchase_date'),
+        ('Purchase price', 'purchase_price'),
+        ('Rental price per day', 'rental_price_per_day'),
+        ('Selling price', 'selling_price'),
+        ('Warranty expiry', 'warranty_expiry'),
+    )
+    watermark_fields = ('updated_at', 'category__updated_at')
+
+    def get_queryset(self):
+        queryset = Instrument.objects.order_by('category__name', 'name', 'pk')
+        if self.parameters.get('status'):
+            queryset = queryset.filter(status=self.parameters['status'])
+        if self.parameters.get('category'):
+            queryset = queryset.filter(category_id=self.parameters['category'])
+        return queryset
+
+
+@register
+class RevenueReport(ReportGenerator):
+    """Revenue summed from the rollups, grouped by `parameters['group_by']`."""
+    report_type = 'revenue'
+
+    GROUPS = {
+        'day': (('Day', 'day'),),
+        'client': (('Client', 'client__hospital_name'),),
+        'order_type': (('Order type', 'order_type'),),
+        'category': (('Category', 'category__name'),),
+    }
+    default_group_by = ('day', 'order_type')
+
+    def group_by(self):
+        group_by = self.parameters.get('group_by') or self.default_group_by
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        unknown = set(group_by) - set(self.GROUPS)
+        if unknown:
+            raise ReportError(f"Unknown group_by values: {', '.join(sorted(unknown))}.")
+        return list(group_by)
+
+    def get_columns(self):
+        columns = [column for name in self.group_by() for column in self.GROUPS[name]]
+        if 'category' in self.group_by():
+            columns += [('Items', 'items'), ('Item subtotals', 'booked')]
+        else:
+            columns += [('Orders', 'orders'), ('Items', 'items'), ('Booked', 'booked'), ('Collected', 'collected')]
+        return columns
+
+    def summary(self):
+        start = self.start_date or RevenueRollup.objects.order_by('day').values_list('day', flat=True).first()
+        end = self.end_date or timezone.localdate()
+        group_fields = [lookup for name in self.group_by() for header, lookup in self.GROUPS[name]]
+        filters = {}
+        for name in ('client', 'order_type', 'category'):
+            if self.parameters.get(name):
+                filters[name] = self.parameters[name]
+        return revenue(start, end, group_by=group_fields, by_category='category' in self.group_by(), **filters)
+
+    def watermark_sources(self):
+        rows = RevenueRollup.objects.all()
+        if self.start_date:
+            rows = rows.filter(day__gte=self.start_date)
+        if self.end_date:
+            rows = rows.filter(day__lte=self.end_date)
+        return [(rows, ('updated_at', 'client__updated_at', 'category__updated_at'))]
+
+    def rows(self):
+        if self.start_date is None and not RevenueRollup.objects.exists():
+            return iter(())
+        lookups = [lookup for header, lookup in self.get_columns()]
+        return self.summary().values_list(*lookups).iterator(chunk_size=self.chunk_size)
+
+    def count(self):
+        if self.start_date is None and not RevenueRollup.objects.exists():
+            return 0
+        return self.summary().count()
+
+
+@register
+class ClientsReport(ReportGenerator):
+    """Clients with their order and payment totals over the report period."""
+    report_type = 'clients'
+    columns = (
+        ('Hospital', 'hospital_name'),
+        ('Type', 'hospital_type'),
+        ('Registration number', 'registration_number'),
+        ('Active', 'is_active'),
+        ('Orders', 'period_orders'),
+        ('Booked', 'period_booked'),
+        ('Collected', 'period_collected'),
+    )
+
+    def get_queryset(self):
+        rollup = Q(revenue_rollups__category__isnull=True)
+        if self.start_date:
+            rollup &= Q(revenue_rollups__day__gte=self.start_date)
+        if self.end_date:
+            rollup &= Q(revenue_rollups__day__lte=self.end_date)
+
+        queryset = Client.objects.annotate(
+            period_orders=Sum('revenue_rollups__orders', filter=rollup),
+            period_booked=Sum('revenue_rollups__booked', filter=rollup),
+            period_collected=Sum('revenue_rollups__collected', filter=rollup),
+        ).order_by('hospital_name', 'pk')
+        if 'is_active' in self.parameters:
+            queryset = queryset.filter(is_active=self.parameters['is_active'])
+        return queryset
+
+    def watermark_sources(self):
+        rollups = RevenueRollup.objects.filter(category__isnull=True)
+        if self.start_date:
+            rollups = rollups.filter(day__gte=self.start_date)
+        if self.end_date:
+            rollups = rollups.filter(day__lte=self.end_date)
+        return [(Client.objects.all(), ('updated_at',)), (rollups, ('updated_at',))]
+
+
+@register
+class StaffReport(ReportGenerator):
+    """Staff members with their attendance over the report period."""
+    report_type = 'staff'
+    columns = (
+        ('Employee ID', 'employee_id'),
+        ('First name', 'user__first_name'),
+        ('Last name', 'user__last_name'),
+        ('Email', 'user__email'),
+        ('Department', 'department__name'),
+        ('Role', 'role'),
+        ('Joined', 'date_of_joining'),
+        ('Active', 'is_active'),
+        ('Present', 'days_present'),
+        ('Half days', 'days_half'),
+        ('Absent', 'days_absent'),
+        ('On leave', 'days_leave'),
+    )
+
+    def get_queryset(self):
+        period = Q()
+        if self.start_date:
+            period &= Q(attendance_records__date__gte=self.start_date)
+        if self.end_date:
+            period &= Q(attendance_records__date__lte=self.end_date)
+
+        def days(status):
+            return Count('attendance_records', filter=period & Q(attendance_records__status=status))
+
+        queryset = StaffMember.objects.annotate(
+            days_present=days('present'),
+            days_half=days('half_day'),
+            days_absent=days('absent'),
+            days_leave=days('leave'),
+        ).order_by('employee_id')
+        if self.parameters.get('department'):
+            queryset = queryset.filter(department_id=self.parameters['department'])
+        return queryset
+
+    def watermark_sources(self):
+        attendance = Attendance.objects.all()
+        if self.start_date:
+            attendance = attendance.filter(date__gte=self.start_date)
+        if self.end_date:
+            attendance = attendance.filter(date__lte=self.end_date)
+        return [
+            (StaffMember.objects.all(), ('updated_at', 'department__updated_at')),
+            (attendance, ('updated_at',)),
+        ]
+
+
+def run(report, progress=None):
+    """
+    Generate `report`'s file with the generator for its type and record
+    the row count and throughput on it. `progress(rows_written)` is called
+    after every chunk.
+    """
+    generator_class = get_generator(report.report_type)
+    writer_class = WRITERS[report.format]
+    generator = generator_class(report.start_date, report.end_date, report.parameters)
+    columns = generator.get_columns()
+
+    handle, path = tempfile.mkstemp(suffix=f".{writer_class.extension}")
+    os.close(handle)
+    try:
+        started = time.perf_counter()
+        writer = writer_class(path, report.title, [header for header, lookup in columns])
+        rows = 0
+        try:
+            for row in generator.rows():
+                writer.writerow(row)
+                rows += 1
+                if progress is not None and rows % generator.chunk_size == 0:
+                    progress(rows)
+        finally:
+            writer.close()
+        elapsed = time.perf_counter() - started
+
+        name = f"{report.report_type}-{report.pk}-{timezone.now():%Y%m%d%H%M%S}.{writer_class.extension}"
+        with open(path, 'rb') as output:
+            report.file.save(name, File(output), save=False)
+    finally:
+        os.remove(path)
+
+    report.row_count = rows
+    report.duration = elapsed
+    report.rows_per_second = rows / elapsed if elapsed else None
+    report.save(update_fields=['file', 'row_count', 'duration', 'rows_per_second', 'updated_at'])
+    return report
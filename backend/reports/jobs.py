@@ -0,0 +1,154 @@
+"""
+Report jobs.
+
+Report requests don't generate anything inline: generate() records a
+queued Report and hands it to a worker (Celery, or a local thread when no
+broker is reachable), and clients poll the report's status and progress.
+
+Each request has a cache key, the SHA-256 of its type, format, dates and
+parameters. An identical report that is still queued or running is
+returned rather than started a second time. A completed report with the
+same key and data watermark holds exactly the file a job would produce,
+so it is returned instead of queueing one. Watermarks aggregate over the
+report's rows, so a request only takes one when a completed report with
+its key exists. The worker takes the watermark again before reading
+anything, and reuses an earlier file if the data still hasn't changed.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from hospital_management.background import submit
+from .generators import get_generator, run
+from .models import Report
+
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(report_type, format, start_date, end_date, parameters):
+    request = [
+        report_type,
+        format,
+        start_date.isoformat() if start_date else None,
+        end_date.isoformat() if end_date else None,
+        parameters or {},
+    ]
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def in_progress(key):
+    """A still fresh queued or running report with the given cache key."""
+    # Jobs whose worker died never finish; don't wait on them forever
+    timeout = getattr(settings, 'REPORT_JOB_TIMEOUT', 3600)
+    fresh = timezone.now() - timedelta(seconds=timeout)
+    return Report.objects.filter(
+        cache_key=key, status__in=('queued', 'running'), created_at__gte=fresh,
+    ).order_by('-created_at').first()
+
+
+def reusable(key, watermark):
+    """A completed report with the given cache key, generated from the same data."""
+    reports = Report.objects.filter(cache_key=key, data_watermark=watermark, status='completed')
+    return reports.exclude(file='').exclude(file__isnull=True).order_by('-finished_at').first()
+
+
+def _generator(attrs):
+    return get_generator(attrs['report_type'])(attrs.get('start_date'), attrs.get('end_date'), attrs.get('parameters'))
+
+
+def create(user=None, **attrs):
+    """
+    A queued Report for the given attributes. Raises ReportError if the
+    report can't be generated.
+    """
+    # Checks the parameters before anything is queued
+    _generator(attrs).get_columns()
+    return Report(
+        created_by=user,
+        status='queued',
+        cache_key=cache_key(
+            attrs['report_type'], attrs.get('format', 'pdf'), attrs.get('start_date'), attrs.get('end_date'),
+            attrs.get('parameters'),
+        ),
+        **attrs
+    )
+
+
+def generate(user=None, **attrs):
+    """
+    Return (report, created): a report for the same request that is
+    still being generated, a completed one generated from the current
+    data, or a new report queued for generation.
+    """
+    report = create(user, **attrs)
+    existing = in_progress(report.cache_key)
+    if existing is not None:
+        return existing, False
+
+    completed = Report.objects.filter(cache_key=report.cache_key, status='completed').exclude(file='')
+    if completed.exclude(file__isnull=True).exists():
+        earlier = reusable(report.cache_key, _generator(attrs).watermark())
+        if earlier is not None:
+            return earlier, False
+
+    report.save()
+    schedule(report.pk)
+    return report, True
+
+
+def schedule(report_id):
+    """Generate the report in the background once the transaction commits."""
+    from .tasks import generate_report
+
+    workers = getattr(settings, 'REPORT_WORKERS', 2)
+    transaction.on_commit(lambda: submit(generate_report, report_id, workers=workers))
+
+
+def execute(report_id):
+    """
+    Generate a queued report's file, recording its progress as rows are
+    written, or reuse the file of an identical report of the same data.
+    Returns the report, or None if it wasn't queued.
+    """
+    reports = Report.objects.filter(pk=report_id)
+    if not reports.filter(status='queued').update(status='running', progress=0, started_at=timezone.now()):
+        return None
+    report = reports.get()
+
+    try:
+        generator = get_generator(report.report_type)(report.start_date, report.end_date, report.parameters)
+        # Taken before reading, so a later change always gives a new watermark
+        watermark = generator.watermark()
+        earlier = reusable(report.cache_key, watermark) if report.cache_key else None
+        if earlier is not None:
+            report.file = earlier.file.name
+            report.row_count = earlier.row_count
+            report.duration = earlier.duration
+            report.rows_per_second = earlier.rows_per_second
+            report.save(update_fields=['file', 'row_count', 'duration', 'rows_per_second', 'updated_at'])
+        else:
+            total = generator.count()
+
+            def progress(rows):
+                if total:
+                    reports.update(progress=min(99, rows * 100 // total))
+
+            run(report, progress)
+    except Exception as e:
+        logger.exception("Generating report %s failed", report_id)
+        reports.update(status='failed', error=str(e), finished_at=timezone.now())
+        raise
+
+    report.status = 'completed'
+    report.progress = 100
+    report.error = None
+    report.finished_at = timezone.now()
+    report.data_watermark = watermark
+    report.save(update_fields=['status', 'progress', 'error', 'finished_at', 'data_watermark', 'updated_at'])
+    return report
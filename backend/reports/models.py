@@ -22,6 +22,13 @@ class Report(models.Model):
         ('csv', 'CSV'),
     )
     
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
     title = models.CharField(max_length=200)
     report_type = models.CharField(max_length=20, choices=REPORT_TYPES)
     description = models.TextField(blank=True, null=True)
@@ -30,6 +37,17 @@ class Report(models.Model):
     end_date = models.DateField(blank=True, null=True)
     format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='pdf')
     file = models.FileField(upload_to='reports/', blank=True, null=True)
+    row_count = models.PositiveBigIntegerField(blank=True, null=True)
+    duration = models.FloatField(blank=True, null=True, help_text='Generation time in seconds')
+    rows_per_second = models.FloatField(blank=True, null=True)
+    # Reports made by reports.jobs start queued; others (uploads, earlier rows) have their file
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='completed')
+    progress = models.PositiveSmallIntegerField(default=0, help_text='Percentage of rows written')
+    error = models.TextField(blank=True, null=True)
+    cache_key = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    data_watermark = models.CharField(max_length=64, blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_reports')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
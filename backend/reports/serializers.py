@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from .models import Report, Dashboard, Widget
 from accounts.serializers import UserSerializer
+from .generators import ReportError, get_generator
+from .widget_data import WidgetDataError, get_source
 
 
 class ReportSerializer(serializers.ModelSerializer):
@@ -9,7 +11,10 @@ class ReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = Report
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'file')
+        read_only_fields = (
+            'created_at', 'updated_at', 'file', 'row_count', 'duration', 'rows_per_second',
+            'status', 'progress', 'error', 'cache_key', 'data_watermark', 'started_at', 'finished_at',
+        )
 
 
 class WidgetSerializer(serializers.ModelSerializer):
@@ -17,6 +22,18 @@ class WidgetSerializer(serializers.ModelSerializer):
         model = Widget
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at')
+    
+    def validate_data_source(self, value):
+        try:
+            get_source(value)
+        except WidgetDataError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+    
+    def validate_query_parameters(self, value):
+        if value is not None and not isinstance(value, dict):
+            raise serializers.ValidationError("Query parameters must be an object.")
+        return value
 
 
 class DashboardSerializer(serializers.ModelSerializer):
@@ -46,6 +63,24 @@ class ReportGenerateSerializer(serializers.Serializer):
     end_date = serializers.DateField(required=False)
     format = serializers.ChoiceField(choices=Report.FORMAT_CHOICES, default='pdf')
     parameters = serializers.JSONField(required=False)
+    
+    def validate_report_type(self, value):
+        try:
+            get_generator(value)
+        except ReportError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+    
+    def validate_parameters(self, value):
+        if value is not None and not isinstance(value, dict):
+            raise serializers.ValidationError("Parameters must be an object.")
+        return value
+    
+    def validate(self, attrs):
+        start_date, end_date = attrs.get('start_date'), attrs.get('end_date')
+        if start_date and end_date and end_date < start_date:
+            raise serializers.ValidationError({"end_date": "End date must not be before start date."})
+        return attrs
 
 
 class WidgetDataSerializer(serializers.Serializer):
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .jobs import execute
+
+
+@shared_task(name='reports.generate_report')
+def generate_report(report_id):
+    report = execute(report_id)
+    return report.row_count if report is not None else None
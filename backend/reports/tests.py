@@ -1,3 +1,200 @@
-from django.test import TestCase
+import csv
+import os
+import re
+import shutil
+import tempfile
+import zlib
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from hospital_management import pdf
+from instruments.models import Instrument, InstrumentCategory
+from . import jobs
+from .generators import run
+from .models import Report
+from .writers import PDFWriter
+
+
+def pdf_objects(data):
+    """The objects of a PDF by number, checked against its cross-reference table."""
+    xref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    count = int(re.match(rb'xref\n0 (\d+)\n', data[xref:]).group(1))
+    # After the free entry of object 0
+    entries = data[xref:].split(b'\n')[3:count + 2]
+    objects = {}
+    for number, entry in enumerate(entries, start=1):
+        offset = int(entry[:10])
+        assert data[offset:].startswith(b'%d 0 obj\n' % number), f"xref entry {number} is off"
+        objects[number] = data[offset:data.index(b'endobj\n', offset)]
+    return objects
+
+
+def content_streams(data):
+    return [
+        zlib.decompress(stream)
+        for stream in re.findall(rb'obj\n<< /Filter /FlateDecode /Length \d+ >>\nstream\n(.*?)\nendstream', data, re.S)
+    ]
+
+
+class PDFWriterTests(SimpleTestCase):
+    """Report PDFs are written page by page, with text outside cp1252 drawn as itself."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.pdf')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def write(self, rows, title='Clients'):
+        writer = PDFWriter(self.path, title, ['Hospital', 'City'])
+        for row in rows:
+            writer.writerow(row)
+        writer.close()
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_pages_and_cross_references(self):
+        data = self.write([(f'Hospital {i}', 'Pune') for i in range(200)])
+
+        objects = pdf_objects(data)
+        pages = [body for body in objects.values() if b'/Type /Page ' in body]
+        self.assertGreater(len(pages), 1)
+        self.assertIn(b'/Count %d' % len(pages), objects[2])
+
+    def test_text_outside_cp1252(self):
+        name = 'Szpital Łukasza, Kraków'
+        city = 'Kraków (Ğ, ı, ć)'
+        data = self.write([(name, city)], title='Klienci – Łódź')
+
+        streams = b'\n'.join(content_streams(data))
+        self.assertIn(pdf.font(pdf.REGULAR).encode(name), streams)
+        self.assertIn(pdf.font(pdf.REGULAR).encode(city), streams)
+        # The document title is kept whole too
+        self.assertIn(b'<FEFF%s>' % 'Klienci – Łódź'.encode('utf-16-be').hex().upper().encode(), data)
+        # The fonts are embedded, with a map back to Unicode for search and copy
+        self.assertIn(b'/FontFile2', data)
+        self.assertTrue(any(b'beginbfchar' in stream for stream in content_streams(data)))
+
+    def test_long_values_are_cut_to_the_column(self):
+        data = self.write([('x' * 500, 'Pune')])
+
+        streams = b'\n'.join(content_streams(data))
+        self.assertNotIn(pdf.font(pdf.REGULAR).encode('x' * 500), streams)
+        glyphs = pdf.font(pdf.REGULAR).encode
+        cut = re.search(rb'<((?:%s)+)%s>' % (glyphs('x')[1:-1], glyphs('...')[1:-1]), streams)
+        self.assertIsNotNone(cut)
+        self.assertLess(len(cut.group(1)) // 4, 500)
+
+
+class RunReportTests(TestCase):
+    """run() writes a report's file in each format and records its throughput."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = InstrumentCategory.objects.create(name='Chirurgia')
+        for i in range(3):
+            Instrument.objects.create(
+                name=f'Łopatka {i}', serial_number=f'SN{i}', category=category, purchase_date=date(2026, 1, 1),
+                purchase_price=Decimal('100'), rental_price_per_day=Decimal('5'), selling_price=Decimal('150'),
+            )
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_formats(self):
+        for format in ('csv', 'excel', 'pdf'):
+            with self.subTest(format=format):
+                report = Report.objects.create(title='Inventory', report_type='inventory', format=format)
+
+                run(report)
+
+                report.refresh_from_db()
+                self.assertEqual(report.row_count, 3)
+                self.assertIsNotNone(report.rows_per_second)
+                self.assertTrue(report.file.name.endswith({'csv': '.csv', 'excel': '.xlsx', 'pdf': '.pdf'}[format]))
+                with report.file.open('rb') as f:
+                    data = f.read()
+                if format == 'csv':
+                    rows = list(csv.reader(data.decode('utf-8').splitlines()))
+                    self.assertEqual([row[1] for row in rows[1:]], ['Łopatka 0', 'Łopatka 1', 'Łopatka 2'])
+                elif format == 'pdf':
+                    pdf_objects(data)
+                    self.assertIn(pdf.font(pdf.REGULAR).encode('Łopatka 2'), b''.join(content_streams(data)))
+
+
+class GenerateReportTests(TestCase):
+    """Identical report requests share a job, and a finished file while the data is unchanged."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='password')
+        category = InstrumentCategory.objects.create(name='Imaging')
+        cls.instrument = Instrument.objects.create(
+            name='Monitor', serial_number='SN1', category=category, purchase_date=date(2026, 1, 1),
+            purchase_price=Decimal('100'), rental_price_per_day=Decimal('5'), selling_price=Decimal('150'),
+        )
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        self.request = {'report_type': 'inventory', 'title': 'Inventory', 'format': 'csv'}
+
+    def generate(self, **changes):
+        return self.api.post(reverse('report-generate'), {**self.request, **changes}, format='json')
+
+    def test_identical_request_returns_the_completed_report(self):
+        queued = self.generate()
+        self.assertEqual(queued.status_code, 202)
+        self.assertEqual(queued.data['status'], 'queued')
+
+        # Still being generated: the same report, not a second job
+        waiting = self.generate()
+        self.assertEqual(waiting.status_code, 202)
+        self.assertEqual(waiting.data['id'], queued.data['id'])
+
+        jobs.execute(queued.data['id'])
+        response = self.generate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], queued.data['id'])
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['row_count'], 1)
+        self.assertEqual(Report.objects.count(), 1)
+
+    def test_other_request_or_changed_data_is_queued(self):
+        first = self.generate()
+        jobs.execute(first.data['id'])
+
+        other = self.generate(format='pdf')
+        self.assertEqual(other.status_code, 202)
+        self.assertNotEqual(other.data['id'], first.data['id'])
+
+        self.instrument.name = 'Monitor 2'
+        self.instrument.save()
+        changed = self.generate()
+        self.assertEqual(changed.status_code, 202)
+        self.assertNotIn(changed.data['id'], (first.data['id'], other.data['id']))
+
+    def test_job_reuses_the_file_of_unchanged_data(self):
+        first = jobs.execute(self.generate().data['id'])
+        # Queued before the first one finished
+        second = jobs.create(self.admin, **self.request)
+        second.save()
+
+        second = jobs.execute(second.pk)
+
+        self.assertEqual(second.status, 'completed')
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(second.data_watermark, first.data_watermark)
@@ -4,9 +4,15 @@ from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 from django.db.models import Count, Sum, Avg
-from django.http import HttpResponse
-import io
+import hashlib
+import time
+from hospital_management.downloads import serve_file
+from hospital_management.single_flight import coalesce_requests
+from .generators import ReportError
+from .jobs import generate as generate_report
 from .models import Report, Dashboard, Widget
+from .widget_data import SOURCES, SeriesSource, WidgetDataError, render as render_widgets, widget_data
+from .writers import WRITERS
 from .serializers import (
     ReportSerializer, DashboardSerializer, DashboardDetailSerializer,
     WidgetSerializer, ReportGenerateSerializer, WidgetDataSerializer
@@ -36,23 +42,59 @@ class ReportViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
+    @action(detail=False, methods=['post'])
+    def generate(self, request):
+        """
+        Queue a report for generation and return it straight away (202);
+        poll the report for its status and progress. A report for the same
+        request that is still being generated is returned instead, and a
+        completed one generated from unchanged data is returned as is (200).
+        """
+        serializer = ReportGenerateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        try:
+            report, created = generate_report(request.user, **serializer.validated_data)
+        except ReportError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = self.get_serializer(report)
+        if report.status == 'completed':
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+    
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """
-        Download a report file.
+        Download a report file. Supports conditional and range requests,
+        and gzips CSV files for clients that accept it.
         """
         report = self.get_object()
         
+        if report.status in ('queued', 'running'):
+            response = Response(
+                {"detail": "The report is still being generated.", "progress": report.progress},
+                status=status.HTTP_202_ACCEPTED
+            )
+            response['Retry-After'] = '5'
+            return response
+        
         if not report.file:
             return Response(
                 {"detail": "No file available for this report."},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Return the file
-        response = HttpResponse(report.file, content_type='application/octet-stream')
-        response['Content-Disposition'] = f'attachment; filename="{report.file.name}"'
-        return response
+        writer = WRITERS.get(report.format)
+        digest = hashlib.sha256(f"{report.file.name}:{report.file.size}".encode()).hexdigest()[:32]
+        return serve_file(
+            request,
+            report.file,
+            content_type=writer.content_type if writer else 'application/octet-stream',
+            etag=f'"{digest}"',
+            last_modified=report.finished_at or report.updated_at,
+            compress=report.format == 'csv',
+        )
 
 
 class DashboardViewSet(viewsets.ModelViewSet):
@@ -96,6 +138,42 @@ class DashboardViewSet(viewsets.ModelViewSet):
         
         serializer = DashboardDetailSerializer(dashboard)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    @coalesce_requests
+    def data(self, request, pk=None):
+        """
+        Get the data of every widget on the dashboard in one request. The
+        start_date, end_date and bucket query parameters apply to all
+        widgets.
+        """
+        dashboard = self.get_object()
+        widgets = list(dashboard.widgets.all())
+        
+        started = time.perf_counter()
+        results = render_widgets(
+            widgets,
+            start_date=request.query_params.get('start_date'),
+            end_date=request.query_params.get('end_date'),
+            bucket=request.query_params.get('bucket'),
+        )
+        duration = time.perf_counter() - started
+        
+        return Response({
+            'dashboard': dashboard.pk,
+            'duration_ms': round(duration * 1000, 1),
+            'widgets': [
+                {
+                    'id': widget.pk,
+                    'title': widget.title,
+                    'type': widget.widget_type,
+                    'chart_type': widget.chart_type,
+                    'data_source': widget.data_source,
+                    **results[widget.pk],
+                }
+                for widget in widgets
+            ],
+        })
 
 
 class WidgetViewSet(viewsets.ModelViewSet):
@@ -116,28 +194,45 @@ class WidgetViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
     
     @action(detail=True, methods=['get'])
+    @coalesce_requests
     def data(self, request, pk=None):
         """
-        Get data for a widget.
+        Get data for a widget from its data source. The start_date,
+        end_date and bucket query parameters override the widget's own.
         """
         widget = self.get_object()
         
-        # Parse parameters
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
+        try:
+            data, cached = widget_data(
+                widget,
+                start_date=request.query_params.get('start_date'),
+                end_date=request.query_params.get('end_date'),
+                bucket=request.query_params.get('bucket'),
+            )
+        except WidgetDataError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Generate widget data
-        data = {
+        return Response({
             'title': widget.title,
             'type': widget.widget_type,
             'chart_type': widget.chart_type,
-            'data': {
-                'labels': ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun'],
-                'datasets': [{
-                    'label': 'Sample Data',
-                    'data': [12, 19, 3, 5, 2, 3]
-                }]
+            'data_source': widget.data_source,
+            'data': data,
+            'cached': cached,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def sources(self, request):
+        """
+        List the data sources widgets can use.
+        """
+        return Response([
+            {
+                'name': source.name,
+                'title': source.title,
+                'time_series': issubclass(source, SeriesSource),
+                'default_bucket': getattr(source, 'default_bucket', None),
+                'filters': sorted(source.filters),
             }
-        }
-        
-        return Response(data) 
\ No newline at end of file
+            for source in SOURCES.values()
+        ])
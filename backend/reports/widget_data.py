@@ -0,0 +1,522 @@
+"""
+Widget data sources.
+
+A Widget names a data source; each source registered here compiles to a
+single aggregated query (values() + annotate()) and returns chart data:
+
+    {'labels': [...], 'datasets': [{'label': ..., 'data': [...]}, ...]}
+
+GroupedSource counts or sums rows per value of a field (orders by status,
+revenue by client, ...). SeriesSource buckets rows by day, week, month,
+quarter or year of a date field. Sources with a date field honour
+start_date and end_date; widget query_parameters supply defaults and
+source-specific filters.
+
+Results are cached per source and parameters for WIDGET_DATA_CACHE_TTL
+seconds. The cache key includes the versions of the tables the source
+reads (hospital_management.table_versions), so a write to any of them
+makes the next request recompute. render() answers a whole dashboard:
+widgets sharing a source and parameters share its query, and the
+remaining queries run in parallel.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as day_time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from clients.models import Client
+from hospital_management.table_versions import track, versions
+from instruments.models import Instrument, InstrumentCategory
+from orders.models import Invoice, Order, OrderItem, Payment, RevenueRollup
+from staff.models import Attendance, StaffDepartment, StaffMember
+
+
+SOURCES = {}
+
+BUCKETS = ('day', 'week', 'month', 'quarter', 'year')
+
+
+class WidgetDataError(Exception):
+    """Raised for unknown data sources and invalid widget parameters."""
+
+
+def register(source):
+    SOURCES[source.name] = source
+    return source
+
+
+def get_source(name):
+    try:
+        return SOURCES[name]
+    except KeyError:
+        raise WidgetDataError(f"Unknown data source '{name}'.")
+
+
+def _number(value):
+    if value is None:
+        return 0
+    return value if isinstance(value, int) else float(value)
+
+
+class DataSource:
+    name = None
+    title = None
+    model = None
+    # Tables read besides the model's own, e.g. through joined labels
+    related_models = ()
+    # Field the start_date / end_date range applies to, if any
+    date_field = None
+    date_field_is_datetime = False
+    # parameter -> lookup for the filters a widget may set
+    filters = {}
+
+    def __init__(self, start_date=None, end_date=None, parameters=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.parameters = parameters or {}
+
+    @classmethod
+    def tables(cls):
+        return (cls.model,) + tuple(cls.related_models)
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def filter(self, queryset):
+        for parameter, lookup in self.filters.items():
+            value = self.parameters.get(parameter)
+            if value not in (None, ''):
+                queryset = queryset.filter(**{lookup: value})
+        if self.date_field:
+            if self.start_date:
+                queryset = queryset.filter(**{f"{self.date_field}__gte": self.bound(self.start_date)})
+            if self.end_date:
+                queryset = queryset.filter(**{f"{self.date_field}__lt": self.bound(self.end_date + timedelta(days=1))})
+        return queryset
+
+    def bound(self, day):
+        if self.date_field_is_datetime:
+            return timezone.make_aware(datetime.combine(day, day_time.min))
+        return day
+
+    def compute(self):
+        raise NotImplementedError
+
+
+class GroupedSource(DataSource):
+    """One value per distinct value of `group_field`."""
+    group_field = None
+    measure = Count('pk')
+    measure_label = 'Count'
+    # Largest values first, at most `limit` (or parameters['limit']) groups
+    top = False
+    limit = 10
+
+    def get_limit(self):
+        try:
+            limit = int(self.parameters.get('limit') or self.limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if limit < 1:
+            raise WidgetDataError("limit must be a positive integer.")
+        return limit
+
+    def labels(self, values):
+        try:
+            choices = dict(self.model._meta.get_field(self.group_field).flatchoices)
+        except FieldDoesNotExist:
+            # A lookup through a relation, e.g. category__name
+            choices = {}
+        return [str(choices.get(value, value)) if value is not None else 'None' for value in values]
+
+    def compute(self):
+        rows = self.filter(self.get_queryset()).order_by().values(self.group_field).annotate(value=self.measure)
+        if self.top:
+            rows = rows.order_by('-value')[:self.get_limit()]
+        else:
+            rows = rows.order_by(self.group_field)
+        rows = list(rows)
+        return {
+            'labels': self.labels([row[self.group_field] for row in rows]),
+            'datasets': [{'label': self.measure_label, 'data': [_number(row['value']) for row in rows]}],
+        }
+
+
+class SeriesSource(DataSource):
+    """Values per time bucket of `date_field`."""
+    default_bucket = 'month'
+    # (label, aggregate) pairs, one dataset each
+    measures = (('Count', Count('pk')),)
+
+    def bucket(self):
+        bucket = self.parameters.get('bucket') or self.default_bucket
+        if bucket not in BUCKETS:
+            raise WidgetDataError(f"bucket must be one of {', '.join(BUCKETS)}.")
+        return bucket
+
+    def rows(self):
+        measures = {f"measure_{position}": aggregate for position, (label, aggregate) in enumerate(self.measures)}
+        return (
+            self.filter(self.get_queryset())
+            .annotate(period=Trunc(self.date_field, self.bucket()))
+            .order_by()
+            .values('period')
+            .annotate(**measures)
+            .order_by('period')
+        )
+
+    def label(self, period):
+        if isinstance(period, datetime):
+            period = timezone.localtime(period).date() if timezone.is_aware(period) else period.date()
+        return period.isoformat() if isinstance(period, date) else str(period)
+
+    def compute(self):
+        rows = list(self.rows())
+        return {
+            'labels': [self.label(row['period']) for row in rows],
+            'datasets': [
+                {'label': label, 'data': [_number(row[f"measure_{position}"]) for row in rows]}
+                for position, (label, aggregate) in enumerate(self.measures)
+            ],
+        }
+
+
+@register
+class OrdersByStatus(GroupedSource):
+    name = 'orders_by_status'
+    title = 'Orders by status'
+    model = Order
+    group_field = 'status'
+    measure_label = 'Orders'
+    date_field = 'order_date'
+    date_field_is_datetime = True
+    filters = {'order_type': 'order_type', 'client': 'client_id'}
+
+
+@register
+class OrdersByPaymentStatus(OrdersByStatus):
+    name = 'orders_by_payment_status'
+    title = 'Orders by payment status'
+    group_field = 'payment_status'
+
+
+@register
+class OrdersOverTime(SeriesSource):
+    name = 'orders_over_time'
+    title = 'Orders over time'
+    model = Order
+    date_field = 'order_date'
+    date_field_is_datetime = True
+    filters = {'order_type': 'order_type', 'status': 'status', 'client': 'client_id'}
+    measures = (('Orders', Count('pk')), ('Order value', Sum('grand_total')))
+
+
+@register
+class RevenueByMonth(SeriesSource):
+    name = 'revenue_by_month'
+    title = 'Revenue'
+    model = RevenueRollup
+    date_field = 'day'
+    filters = {'order_type': 'order_type', 'client': 'client_id'}
+    measures = (('Booked', Sum('booked')), ('Collected', Sum('collected')))
+
+    def get_queryset(self):
+        # Order-level rows; the per-category rows break the same totals down
+        return RevenueRollup.objects.filter(category__isnull=True)
+
+
+@register
+class RevenueByClient(GroupedSource):
+    name = 'revenue_by_client'
+    title = 'Top clients by revenue'
+    model = RevenueRollup
+    related_models = (Client,)
+    group_field = 'client__hospital_name'
+    measure = Sum('booked')
+    measure_label = 'Booked'
+    top = True
+    date_field = 'day'
+    filters = {'order_type': 'order_type'}
+
+    def get_queryset(self):
+        return RevenueRollup.objects.filter(category__isnull=True)
+
+
+@register
+class RevenueByCategory(GroupedSource):
+    name = 'revenue_by_category'
+    title = 'Revenue by instrument category'
+    model = RevenueRollup
+    related_models = (InstrumentCategory,)
+    group_field = 'category__name'
+    measure = Sum('booked')
+    measure_label = 'Item subtotals'
+    top = True
+    date_field = 'day'
+    filters = {'order_type': 'order_type', 'client': 'client_id'}
+
+    def get_queryset(self):
+        return RevenueRollup.objects.filter(category__isnull=False)
+
+
+@register
+class InstrumentsByStatus(GroupedSource):
+    name = 'instruments_by_status'
+    title = 'Instruments by status'
+    model = Instrument
+    group_field = 'status'
+    measure_label = 'Instruments'
+    filters = {'category': 'category_id'}
+
+
+@register
+class InstrumentsByCategory(GroupedSource):
+    name = 'instruments_by_category'
+    title = 'Instruments by category'
+    model = Instrument
+    related_models = (InstrumentCategory,)
+    group_field = 'category__name'
+    measure_label = 'Instruments'
+    filters = {'status': 'status'}
+
+
+@register
+class RentalsEnding(SeriesSource):
+    name = 'rentals_ending'
+    title = 'Rentals ending'
+    model = OrderItem
+    related_models = (Order,)
+    date_field = 'rental_end_date'
+    default_bucket = 'week'
+    filters = {'client': 'order__client_id', 'instrument': 'instrument_id'}
+    measures = (('Rentals', Count('pk')), ('Units', Sum('quantity')))
+
+    def get_queryset(self):
+        return OrderItem.objects.filter(order__order_type='rental').exclude(order__status='cancelled')
+
+
+@register
+class PaymentsByMethod(GroupedSource):
+    name = 'payments_by_method'
+    title = 'Payments by method'
+    model = Payment
+    group_field = 'payment_method'
+    measure = Sum('amount')
+    measure_label = 'Amount'
+    date_field = 'payment_date'
+    date_field_is_datetime = True
+    filters = {'status': 'status'}
+
+    def get_queryset(self):
+        if 'status' in self.parameters:
+            return Payment.objects.all()
+        return Payment.objects.filter(status='completed')
+
+
+@register
+class InvoicesByStatus(GroupedSource):
+    name = 'invoices_by_status'
+    title = 'Invoices by status'
+    model = Invoice
+    group_field = 'status'
+    measure_label = 'Invoices'
+    date_field = 'invoice_date'
+
+
+@register
+class AttendanceRate(SeriesSource):
+    """Share of attendance records marked present (half days count half)."""
+    name = 'attendance_rate'
+    title = 'Attendance rate'
+    model = Attendance
+    date_field = 'date'
+    default_bucket = 'week'
+    filters = {'department': 'staff__department_id', 'staff': 'staff_id'}
+    measures = (
+        ('Present', Count('pk', filter=Q(status='present'))),
+        ('Half days', Count('pk', filter=Q(status='half_day'))),
+        ('Records', Count('pk')),
+    )
+
+    def compute(self):
+        rows = list(self.rows())
+        rates = []
+        for row in rows:
+            present, half_days, records = row['measure_0'], row['measure_1'], row['measure_2']
+            rates.append(round(100.0 * (present + 0.5 * half_days) / records, 1) if records else 0)
+        return {
+            'labels': [self.label(row['period']) for row in rows],
+            'datasets': [{'label': 'Attendance %', 'data': rates}],
+        }
+
+
+@register
+class StaffByDepartment(GroupedSource):
+    name = 'staff_by_department'
+    title = 'Staff by department'
+    model = StaffMember
+    related_models = (StaffDepartment,)
+    group_field = 'department__name'
+    measure_label = 'Staff'
+    filters = {'is_active': 'is_active'}
+
+
+def _date(value, name):
+    if value in (None, '') or isinstance(value, date):
+        return value or None
+    parsed = parse_date(str(value))
+    if parsed is None:
+        raise WidgetDataError(f"{name} must be a date in YYYY-MM-DD format.")
+    return parsed
+
+
+def prepare(name, parameters=None, table_versions=None):
+    """
+    The source for data source `name` with `parameters` (including
+    start_date, end_date and bucket), and the key its data is cached
+    under. `table_versions` maps models to versions already read.
+    """
+    parameters = dict(parameters or {})
+    start_date = _date(parameters.pop('start_date', None), 'start_date')
+    end_date = _date(parameters.pop('end_date', None), 'end_date')
+    if start_date and end_date and end_date < start_date:
+        raise WidgetDataError("end_date must not be before start_date.")
+
+    source_class = get_source(name)
+    tables = source_class.tables()
+    if table_versions is None:
+        table_versions = dict(zip(tables, versions(tables)))
+
+    request = json.dumps(dict(parameters, start_date=start_date, end_date=end_date), sort_keys=True, default=str)
+    digest = hashlib.sha256(request.encode()).hexdigest()
+    stamp = '.'.join(str(table_versions[model]) for model in tables)
+    return source_class(start_date, end_date, parameters), f"widget-data:{name}:{digest}:{stamp}"
+
+
+def compute(source, key):
+    data = source.compute()
+    cache.set(key, data, getattr(settings, 'WIDGET_DATA_CACHE_TTL', 300))
+    return data
+
+
+def load(name, parameters=None):
+    """Return (data, cached) for data source `name` with `parameters`."""
+    source, key = prepare(name, parameters)
+    data = cache.get(key)
+    if data is not None:
+        return data, True
+    return compute(source, key), False
+
+
+def widget_parameters(widget, overrides):
+    """A widget's query_parameters with the non-empty `overrides` applied."""
+    if not isinstance(widget.query_parameters or {}, dict):
+        raise WidgetDataError("The widget's query parameters must be an object.")
+    parameters = dict(widget.query_parameters or {})
+    parameters.update({name: value for name, value in overrides.items() if value not in (None, '')})
+    return parameters
+
+
+def widget_data(widget, **overrides):
+    """Data for a widget, with request parameters overriding its query_parameters."""
+    return load(widget.data_source, widget_parameters(widget, overrides))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DASHBOARD_RENDER_WORKERS', 4),
+                thread_name_prefix='widget-data',
+            )
+        return _executor
+
+
+def _timed(source, key):
+    started = time.perf_counter()
+    try:
+        data, error = compute(source, key), None
+    except WidgetDataError as e:
+        data, error = None, str(e)
+    return data, False, time.perf_counter() - started, error
+
+
+def _timed_in_thread(source, key):
+    try:
+        return _timed(source, key)
+    finally:
+        # Pool threads open their own connection; don't leave it behind
+        connection.close()
+
+
+def render(widgets, **overrides):
+    """
+    Data for several widgets at once, as {widget id: result}.
+
+    Widgets with the same source and parameters share one query. Cached
+    results are read with one get_many, and the remaining queries run
+    concurrently on the process's pool of DASHBOARD_RENDER_WORKERS
+    threads. Each result has data, cached, duration_ms (time spent
+    computing it), shared (other widgets it was computed for) and error.
+    """
+    widgets = list(widgets)
+    tables = list({model for widget in widgets if widget.data_source in SOURCES
+                   for model in SOURCES[widget.data_source].tables()})
+    table_versions = dict(zip(tables, versions(tables)))
+
+    results = {}
+    groups = {}
+    for widget in widgets:
+        try:
+            source, key = prepare(widget.data_source, widget_parameters(widget, overrides), table_versions)
+        except WidgetDataError as e:
+            results[widget.pk] = {'data': None, 'cached': False, 'duration_ms': 0.0, 'shared': 0, 'error': str(e)}
+            continue
+        groups.setdefault(key, (source, []))[1].append(widget.pk)
+
+    outcomes = {key: (data, True, 0.0, None) for key, data in cache.get_many(list(groups)).items()}
+    pending = [(key, source) for key, (source, widget_ids) in groups.items() if key not in outcomes]
+    if len(pending) > 1:
+        futures = [(key, _pool().submit(_timed_in_thread, source, key)) for key, source in pending]
+        for key, future in futures:
+            outcomes[key] = future.result()
+    else:
+        for key, source in pending:
+            outcomes[key] = _timed(source, key)
+
+    for key, (source, widget_ids) in groups.items():
+        data, cached, elapsed, error = outcomes[key]
+        for widget_id in widget_ids:
+            results[widget_id] = {
+                'data': data,
+                'cached': cached,
+                'duration_ms': round(elapsed * 1000, 1),
+                'shared': len(widget_ids) - 1,
+                'error': error,
+            }
+    return results
+
+
+def track_sources():
+    """Invalidate cached widget data whenever a table a source reads changes."""
+    models = {model for source in SOURCES.values() for model in source.tables()}
+    # orders.rollups only writes rollups in bulk and touches them itself; a
+    # delete receiver would also turn its deletes into row-by-row ones
+    models.discard(RevenueRollup)
+    track(*models)
@@ -0,0 +1,169 @@
+"""
+Streaming report writers.
+
+Each writer takes rows one at a time and writes them straight to a file,
+so memory use doesn't depend on the number of rows:
+
+- CSV through the csv module,
+- Excel through xlsxwriter in constant_memory mode, which flushes every
+  row to disk as soon as the next one starts,
+- PDF as a plain table, each page written to the file as soon as it
+  is full.
+"""
+import csv
+import datetime
+import zlib
+from decimal import Decimal
+
+import xlsxwriter
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4, landscape
+
+from hospital_management import pdf
+
+
+class ReportWriter:
+    extension = None
+    content_type = None
+
+    def __init__(self, path, title, columns):
+        self.path = path
+        self.title = title
+        self.columns = columns
+
+    def writerow(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CSVWriter(ReportWriter):
+    extension = 'csv'
+    content_type = 'text/csv'
+
+    def __init__(self, path, title, columns):
+        super().__init__(path, title, columns)
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class ExcelWriter(ReportWriter):
+    extension = 'xlsx'
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    # Rows per worksheet, including the header
+    max_rows = 1048576
+
+    def __init__(self, path, title, columns):
+        super().__init__(path, title, columns)
+        self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        self.header_format = self.workbook.add_format({'bold': True})
+        self.date_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        self.datetime_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm'})
+        self.sheets = 0
+        self.add_sheet()
+
+    def add_sheet(self):
+        self.sheets += 1
+        self.sheet = self.workbook.add_worksheet(f"Report {self.sheets}" if self.sheets > 1 else 'Report')
+        self.sheet.write_row(0, 0, self.columns, self.header_format)
+        self.row = 1
+
+    def writerow(self, row):
+        if self.row >= self.max_rows:
+            self.add_sheet()
+        for column, value in enumerate(row):
+            if isinstance(value, datetime.datetime):
+                if timezone.is_aware(value):
+                    value = timezone.make_naive(value)
+                self.sheet.write_datetime(self.row, column, value, self.datetime_format)
+            elif isinstance(value, datetime.date):
+                self.sheet.write_datetime(self.row, column, value, self.date_format)
+            elif isinstance(value, Decimal):
+                self.sheet.write_number(self.row, column, float(value))
+            else:
+                self.sheet.write(self.row, column, value)
+        self.row += 1
+
+    def close(self):
+        self.workbook.close()
+
+
+class PDFWriter(ReportWriter):
+    """
+    A plain table, page by page. reportlab's canvas would hold every page
+    until save(), so each page is drawn as a content stream and written to
+    the file as soon as it fills up (see hospital_management.pdf).
+    """
+    extension = 'pdf'
+    content_type = 'application/pdf'
+
+    font = pdf.REGULAR
+    font_size = 7
+    line_height = 10
+
+    def __init__(self, path, title, columns):
+        super().__init__(path, title, columns)
+        self.width, self.height = landscape(A4)
+        self.margin = 30
+        self.column_width = (self.width - 2 * self.margin) / max(len(columns), 1)
+        self.file = open(path, 'wb')
+        self.document = pdf.Document(self.width, self.height)
+        self.file.write(self.document.header())
+        self.code = None
+        self.page = 0
+        self.new_page()
+
+    def end_page(self):
+        self.file.write(self.document.page(zlib.compress(b'\n'.join(self.code))))
+
+    def new_page(self):
+        if self.page:
+            self.end_page()
+        self.code = []
+        self.page += 1
+        self.y = self.height - self.margin
+        self.text(self.margin, self.title, pdf.BOLD, 10)
+        page_number = f"Page {self.page}"
+        self.text(
+            self.width - self.margin - pdf.string_width(page_number, self.font, self.font_size),
+            page_number, self.font, self.font_size,
+        )
+        self.y -= 2 * self.line_height
+        self.draw(self.columns, pdf.BOLD)
+
+    def text(self, x, text, font, size):
+        self.code.append(pdf.text(x, self.y, font, size, text))
+
+    def draw(self, values, font=None):
+        font = font or self.font
+        for column, value in enumerate(values):
+            text = '' if value is None else str(value)
+            text = pdf.fit(text, font, self.font_size, self.column_width - 4)
+            self.text(self.margin + column * self.column_width, text, font, self.font_size)
+        self.y -= self.line_height
+
+    def writerow(self, row):
+        if self.y < self.margin:
+            self.new_page()
+        self.draw(row)
+
+    def close(self):
+        self.end_page()
+        self.file.write(self.document.close(title=self.title))
+        self.file.close()
+
+
+WRITERS = {
+    'csv': CSVWriter,
+    'excel': ExcelWriter,
+    'pdf': PDFWriter,
+}
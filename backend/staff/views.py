@@ -11,6 +11,7 @@ from .serializers import (
     StaffMemberCreateSerializer, AttendanceSerializer, LeaveSerializer, LeaveApprovalSerializer
 )
 from accounts.permissions import IsAdminUser, IsStaffUser
+from hospital_management.pagination import KeysetOrPageNumberPagination
 
 
 class StaffDepartmentViewSet(viewsets.ModelViewSet):
@@ -32,6 +33,7 @@ class StaffMemberViewSet(viewsets.ModelViewSet):
     """
     queryset = StaffMember.objects.all()
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['department', 'role', 'is_active']
     search_fields = ['employee_id', 'user__email', 'user__first_name', 'user__last_name']
     ordering_fields = ['employee_id', 'date_of_joining', 'created_at']
@@ -75,6 +77,7 @@ class AttendanceViewSet(viewsets.ModelViewSet):
     """
     serializer_class = AttendanceSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['staff', 'date', 'status']
     search_fields = ['staff__employee_id', 'staff__user__first_name', 'staff__user__last_name']
     ordering_fields = ['date', 'created_at']
@@ -182,6 +185,7 @@ class LeaveViewSet(viewsets.ModelViewSet):
     """
     serializer_class = LeaveSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetOrPageNumberPagination
     filterset_fields = ['staff', 'leave_type', 'status', 'start_date']
     search_fields = ['staff__employee_id', 'staff__user__first_name', 'staff__user__last_name']
     ordering_fields = ['start_date', 'created_at']
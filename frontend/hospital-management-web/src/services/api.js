@@ -73,4 +73,11 @@ api.interceptors.response.use(
     }
 );
 
+// Fetch one page of a list endpoint in keyset (cursor) pagination mode.
+// Pass the endpoint path for the first page, then the `next` or `previous`
+// URL from the previous response to move between pages.
+export const getKeysetPage = (url, params = {}) => {
+    return api.get(url, { params: { ...params, pagination: 'keyset' } });
+};
+
 export default api; 
\ No newline at end of file
@@ -1,4 +1,4 @@
-import api from './api';
+import api, { getKeysetPage } from './api';
 
 export const getInstruments = (params) => {
     return api.get('/instruments/instruments/', { params });
@@ -34,4 +34,32 @@ export const getInstrumentMaintenance = (instrumentId) => {
 
 export const createInstrumentMaintenance = (maintenanceData) => {
     return api.post('/instruments/maintenance/', maintenanceData);
-}; 
\ No newline at end of file
+};
+
+export const getInstrumentsKeyset = (params) => {
+    return getKeysetPage('/instruments/instruments/', params);
+};
+
+export const getInstrumentAvailability = (startDate, endDate, params = {}) => {
+    return api.get('/instruments/instruments/availability/', {
+        params: { ...params, start_date: startDate, end_date: endDate }
+    });
+};
+
+export const allocateInstruments = (allocationData) => {
+    return api.post('/instruments/instruments/allocate/', allocationData);
+};
+
+export const importInstruments = (file, options = {}) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    Object.entries(options).forEach(([key, value]) => formData.append(key, value));
+    return api.post('/instruments/instruments/bulk_import/', formData, {
+        headers: { 'Content-Type': 'multipart/form-data' }
+    });
+};
+
+// error_report of an import response; needs the same authentication as the API
+export const downloadImportErrors = (url) => {
+    return api.get(url, { responseType: 'blob' });
+};
@@ -1,4 +1,4 @@
-import api from './api';
+import api, { getKeysetPage } from './api';
 
 export const getNotifications = (params) => {
     return api.get('/notifications/notifications/', { params });
@@ -34,4 +34,8 @@ export const createSMSNotification = (smsData) => {
 
 export const sendSMS = (id) => {
     return api.post(`/notifications/sms/${id}/send/`);
-}; 
\ No newline at end of file
+};
+
+export const getNotificationsKeyset = (params) => {
+    return getKeysetPage('/notifications/notifications/', params);
+};
@@ -1,4 +1,4 @@
-import api from './api';
+import api, { getKeysetPage } from './api';
 
 export const getOrders = (params) => {
     return api.get('/orders/orders/', { params });
@@ -54,4 +54,25 @@ export const sendInvoice = (id) => {
 
 export const markInvoiceAsPaid = (id) => {
     return api.post(`/orders/invoices/${id}/mark_paid/`);
-}; 
\ No newline at end of file
+};
+
+// Resolves with status 202 while the PDF is still being rendered
+export const downloadInvoicePdf = (id) => {
+    return api.get(`/orders/invoices/${id}/pdf/`, { responseType: 'blob' });
+};
+
+export const exportInvoices = (month, params) => {
+    return api.get('/orders/invoices/export/', { params: { ...params, month }, responseType: 'blob' });
+};
+
+export const getOrdersKeyset = (params) => {
+    return getKeysetPage('/orders/orders/', params);
+};
+
+export const getPaymentsKeyset = (params) => {
+    return getKeysetPage('/orders/payments/', params);
+};
+
+export const getInvoicesKeyset = (params) => {
+    return getKeysetPage('/orders/invoices/', params);
+};
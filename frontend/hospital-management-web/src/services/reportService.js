@@ -64,4 +64,11 @@ export const deleteWidget = (id) => {
 
 export const getWidgetData = (id, params) => {
     return api.get(`/reports/widgets/${id}/data/`, { params });
-}; 
\ No newline at end of file
+}; 
+export const getWidgetSources = () => {
+    return api.get('/reports/widgets/sources/');
+};
+
+export const getDashboardData = (id, params) => {
+    return api.get(`/reports/dashboards/${id}/data/`, { params });
+};
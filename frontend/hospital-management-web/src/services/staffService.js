@@ -1,4 +1,4 @@
-import api from './api';
+import api, { getKeysetPage } from './api';
 
 export const getStaffMembers = (params) => {
     return api.get('/staff/members/', { params });
@@ -62,4 +62,12 @@ export const approveLeave = (id) => {
 
 export const rejectLeave = (id, rejectionReason) => {
     return api.post(`/staff/leaves/${id}/reject/`, { rejection_reason: rejectionReason });
-}; 
\ No newline at end of file
+};
+
+export const getAttendanceKeyset = (params) => {
+    return getKeysetPage('/staff/attendance/', params);
+};
+
+export const getLeavesKeyset = (params) => {
+    return getKeysetPage('/staff/leaves/', params);
+};